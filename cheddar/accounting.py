@@ -0,0 +1,207 @@
+"""
+Account for Redis commands and round trips.
+"""
+from contextlib import contextmanager
+from threading import local
+from time import sleep, time
+
+from redis.exceptions import WatchError
+
+
+class RedisStats(object):
+    """
+    Redis usage since a point in time.
+    """
+
+    def __init__(self):
+        self.started = time()
+        self.commands = 0
+        self.round_trips = 0
+        self.duration = 0.0
+
+    def record(self, commands, duration):
+        self.commands += commands
+        self.round_trips += 1
+        self.duration += duration
+
+    def __repr__(self):
+        return "{} Redis round trips ({} commands, {:.3f}s)".format(
+            self.round_trips, self.commands, self.duration)
+
+
+class CountingRedis(object):
+    """
+    Redis client wrapper that counts commands, round trips, and time spent in Redis.
+
+    Every command is one round trip, except that commands queued on a pipeline
+    share the round trip of its `execute`. Usage is recorded into every `RedisStats`
+    started (in this thread) and not yet stopped, so requests and tests may track
+    usage independently; commands looked up while nothing is tracking are the
+    client's own, at the cost of a thread local lookup.
+
+    Because tracking is per thread, commands issued from other threads (e.g. the
+    pool that refreshes remote listings for batch requests) are not counted toward
+    the request that started them.
+    """
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._local = local()
+
+    def start(self):
+        """
+        Start tracking usage in this thread.
+
+        :returns: a `RedisStats` that accumulates usage until it is stopped
+        """
+        stats = RedisStats()
+        self._collectors().append(stats)
+        return stats
+
+    def stop(self, stats):
+        """
+        Stop tracking usage into stats; stopping it again is harmless.
+        """
+        collectors = self._collectors()
+        if stats in collectors:
+            collectors.remove(stats)
+        return stats
+
+    @contextmanager
+    def track(self):
+        """
+        Track usage within a block.
+        """
+        stats = self.start()
+        try:
+            yield stats
+        finally:
+            self.stop(stats)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return CountingPipeline(self, self._redis.pipeline(transaction, shard_hint))
+
+    def transaction(self, func, *watches, **kwargs):
+        """
+        Execute func as a transaction while watching keys.
+
+        Follows `redis.StrictRedis.transaction`, but on a counting pipeline, so that
+        watched reads count as round trips.
+        """
+        shard_hint = kwargs.pop("shard_hint", None)
+        value_from_callable = kwargs.pop("value_from_callable", False)
+        watch_delay = kwargs.pop("watch_delay", None)
+        with self.pipeline(True, shard_hint) as pipe:
+            while True:
+                try:
+                    if watches:
+                        pipe.watch(*watches)
+                    func_value = func(pipe)
+                    exec_value = pipe.execute()
+                    return func_value if value_from_callable else exec_value
+                except WatchError:
+                    if watch_delay is not None and watch_delay > 0:
+                        sleep(watch_delay)
+                    continue
+
+    def scan_iter(self, match=None, count=None):
+        """
+        Iterate through keys, counting each SCAN.
+        """
+        kwargs = {} if count is None else dict(count=count)
+        cursor = "0"
+        while cursor != 0:
+            cursor, keys = self.scan(cursor=cursor, match=match, **kwargs)
+            for key in keys:
+                yield key
+
+    def __getattr__(self, name):
+        attr = getattr(self._redis, name)
+        if not callable(attr) or not self._collectors():
+            return attr
+
+        def command(*args, **kwargs):
+            started = time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._record(1, time() - started)
+        return command
+
+    def _collectors(self):
+        try:
+            return self._local.collectors
+        except AttributeError:
+            self._local.collectors = []
+            return self._local.collectors
+
+    def _record(self, commands, duration):
+        for stats in self._collectors():
+            stats.record(commands, duration)
+
+
+class CountingPipeline(object):
+    """
+    Pipeline wrapper for `CountingRedis`.
+
+    Commands issued after WATCH (and before MULTI) execute immediately and count
+    as round trips of their own; other commands are queued until `execute`.
+    """
+
+    def __init__(self, client, pipe):
+        self._client = client
+        self._pipe = pipe
+        self._watching = False
+        self._queued = 0
+
+    def watch(self, *names):
+        started = time()
+        try:
+            return self._pipe.watch(*names)
+        finally:
+            self._watching = True
+            self._client._record(1, time() - started)
+
+    def multi(self):
+        self._watching = False
+        return self._pipe.multi()
+
+    def execute(self, *args, **kwargs):
+        queued, self._queued, self._watching = self._queued, 0, False
+        started = time()
+        try:
+            return self._pipe.execute(*args, **kwargs)
+        finally:
+            if queued:
+                self._client._record(queued, time() - started)
+
+    def reset(self):
+        self._queued, self._watching = 0, False
+        return self._pipe.reset()
+
+    def __enter__(self):
+        self._pipe.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self._queued, self._watching = 0, False
+        return self._pipe.__exit__(*args)
+
+    def __getattr__(self, name):
+        attr = getattr(self._pipe, name)
+        if not callable(attr):
+            return attr
+
+        def command(*args, **kwargs):
+            if not self._watching:
+                self._queued += 1
+                result = attr(*args, **kwargs)
+                # queued commands return the pipeline for chaining
+                return self if result is self._pipe else result
+
+            started = time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self._client._record(1, time() - started)
+        return command
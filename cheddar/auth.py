@@ -1,16 +1,189 @@
 """
 Authentication.
 """
+from binascii import hexlify
+from hashlib import pbkdf2_hmac, sha256
+from hmac import compare_digest, new as new_hmac
+from os import urandom
+from time import time
+
 from flask import request
 
+from cheddar.cache import LRUCache
+
+
+ALGORITHM = "pbkdf2_sha256"
+
+
+def hash_password(password, iterations, salt=None):
+    """
+    Hash a password with a random salt.
+
+    :returns: a record of the form "pbkdf2_sha256$<iterations>$<salt>$<hash>"
+    """
+    salt = hexlify(urandom(16)) if salt is None else salt
+    digest = hexlify(pbkdf2_hmac("sha256", _to_bytes(password), salt, iterations))
+    return "$".join([ALGORITHM, str(iterations), salt, digest])
+
+
+def is_hashed(record):
+    return record.startswith(ALGORITHM + "$")
+
+
+def verify_password(password, record):
+    """
+    Verify a password against a stored record.
+
+    Records created before passwords were hashed hold the plaintext password.
+
+    :raises ValueError: if a hashed record is malformed
+    """
+    if not is_hashed(record):
+        return compare_digest(_to_bytes(password), record)
+
+    fields = record.split("$")
+    if len(fields) != 4:
+        raise ValueError("Expected 4 fields in password record; found {}".format(len(fields)))
+    _, iterations, salt, _ = fields
+    return compare_digest(hash_password(password, int(iterations), salt), record)
+
+
+class Users(object):
+    """
+    Upload credentials, stored in Redis as salted PBKDF2 hashes.
+
+    Verifying a hash is deliberately slow, so verified credentials are remembered
+    in process for a short while. Cache entries are keyed by the stored record, so
+    changing (or removing) a user's password invalidates them in every process.
+    """
+
+    def __init__(self, redis, logger, iterations, cache_ttl=0, cache_size=1000):
+        """
+        Initialize users.
+
+        :param iterations: number of PBKDF2 iterations for new hashes
+        :param cache_ttl: how many seconds a verified credential is trusted (zero to disable)
+        :param cache_size: maximum number of verified credentials to remember
+        """
+        self.redis = redis
+        self.logger = logger
+        self.iterations = iterations
+        self.cache_ttl = cache_ttl
+        self.cache = LRUCache(cache_size, sizeof=lambda value: 1) if cache_ttl else None
+        # verified passwords are only kept as digests keyed with a per-process secret
+        self.secret = urandom(32)
+
+    def _key(self, username):
+        return "cheddar.user.{}".format(username)
+
+    def list_users(self):
+        """
+        Get all usernames.
+        """
+        prefix = self._key("")
+        return sorted(key[len(prefix):] for key in self.redis.scan_iter(match=prefix + "*"))
+
+    def set_password(self, username, password):
+        """
+        Add a user or change a user's password.
+        """
+        self.redis.set(self._key(username), hash_password(password, self.iterations))
+        self._invalidate(username)
+        self.logger.info("Set password for: %s", username)
+
+    def remove(self, username):
+        """
+        Remove a user.
+
+        :returns: whether the user existed
+        """
+        self._invalidate(username)
+        return bool(self.redis.delete(self._key(username)))
+
+    def upgrade(self):
+        """
+        Hash any passwords still stored in plaintext.
+
+        :returns: the number of passwords hashed
+        """
+        upgraded = 0
+        for username in self.list_users():
+            if self._upgrade(username):
+                upgraded += 1
+        return upgraded
+
+    def verify(self, username, password):
+        """
+        Verify a username and password.
+        """
+        record = self.redis.get(self._key(username))
+        if record is None:
+            self.logger.debug("No such user: %s", username)
+            return False
 
-def check_authentication(redis):
+        digest = new_hmac(self.secret, _to_bytes(password), sha256).digest()
+        if self.cache is not None:
+            cached = self.cache.get((username, record))
+            if cached is not None:
+                cached_digest, expires = cached
+                if expires > time():
+                    return compare_digest(cached_digest, digest)
+                self.cache.invalidate((username, record))
+
+        try:
+            verified = verify_password(password, record)
+        except ValueError as error:
+            self.logger.warn("Malformed password record for: %s: %s", username, error)
+            return False
+        if not verified:
+            self.logger.info("Invalid password for: %s", username)
+            return False
+
+        if self.cache is not None:
+            self.cache.put((username, record), (digest, time() + self.cache_ttl))
+        if not is_hashed(record):
+            self._upgrade(username)
+        return True
+
+    def _upgrade(self, username):
+        """
+        Replace a plaintext password with its hash, unless it changes concurrently.
+        """
+        key = self._key(username)
+
+        def _hash(pipe):
+            record = pipe.get(key)
+            pipe.multi()
+            if record is None or is_hashed(record):
+                return False
+            pipe.set(key, hash_password(record, self.iterations))
+            return True
+
+        upgraded = self.redis.transaction(_hash, key, value_from_callable=True)
+        if upgraded:
+            self.logger.info("Hashed plaintext password for: %s", username)
+        return upgraded
+
+    def _invalidate(self, username):
+        """
+        Forget verified credentials for username in this process.
+        """
+        if self.cache is None:
+            return
+        for key in self.cache.keys():
+            if key[0] == username:
+                self.cache.invalidate(key)
+
+
+def check_authentication(users):
     """
-    Authenticate a request using a Redis lookup.
+    Authenticate a request against the stored users.
     """
     if request.authorization is None:
         return False
 
-    key = "cheddar.user.{}".format(request.authorization.username)
-    expected = redis.get(key)
-    return expected is not None and expected == request.authorization.password
+    return users.verify(request.authorization.username, request.authorization.password)
+
+
+def _to_bytes(value):
+    return value.encode("utf-8") if isinstance(value, unicode) else value
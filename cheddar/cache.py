@@ -0,0 +1,135 @@
+"""
+In-process caching.
+"""
+from collections import OrderedDict
+from threading import Lock
+
+from cheddar.metrics import NULL_METRICS
+
+
+class LRUCache(object):
+    """
+    Size-bounded, least-recently-used cache.
+
+    Entry sizes are computed with `sizeof`; entries larger than `max_entry_size`
+    bypass the cache entirely so that a single large value cannot evict
+    everything else.
+
+    Hits, misses, bypasses, and evictions are counted in `stats` and, if a metrics
+    registry is given, in `cheddar_cache_events_total`.
+    """
+
+    def __init__(self, max_size, max_entry_size=None, sizeof=len, metrics=None, name=None):
+        """
+        Initialize cache.
+
+        :param max_size: maximum total size of all entries
+        :param max_entry_size: maximum size of a single entry (defaults to max_size)
+        :param sizeof: function that computes the size of a value
+        :param metrics: optional `Metrics` counting cache events
+        :param name: name of this cache in metrics (e.g. "storage_local")
+        """
+        self.max_size = max_size
+        self.max_entry_size = max_size if max_entry_size is None else min(max_entry_size, max_size)
+        self.sizeof = sizeof
+        self.metrics = NULL_METRICS if metrics is None else metrics
+        self.name = name
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        """
+        Get a cached value, marking it as recently used.
+
+        :returns: the cached value or None
+        """
+        with self._lock:
+            try:
+                value, size = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                value = None
+            else:
+                self._entries[key] = value, size
+                self.hits += 1
+        self._count("miss" if value is None else "hit")
+        return value
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting least recently used entries as needed.
+
+        :returns: whether the value was cached
+        """
+        size = self.sizeof(value)
+        evicted = 0
+        with self._lock:
+            self._pop(key)
+            if size > self.max_entry_size:
+                self.bypasses += 1
+                cached = False
+            else:
+                while self._entries and self.size + size > self.max_size:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.size -= evicted_size
+                    evicted += 1
+                self.evictions += evicted
+                self._entries[key] = value, size
+                self.size += size
+                cached = True
+        if not cached:
+            self._count("bypass")
+        if evicted:
+            self._count("eviction", evicted)
+        return cached
+
+    def invalidate(self, key):
+        """
+        Remove a cached value, if any.
+        """
+        with self._lock:
+            self._pop(key)
+
+    def keys(self):
+        """
+        Get the keys of all cached values, least recently used first.
+        """
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        """
+        Remove all cached values.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """
+        Get cache statistics.
+        """
+        with self._lock:
+            return dict(entries=len(self._entries),
+                        size=self.size,
+                        max_size=self.max_size,
+                        hits=self.hits,
+                        misses=self.misses,
+                        bypasses=self.bypasses,
+                        evictions=self.evictions)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _count(self, event, value=1):
+        self.metrics.increment("cheddar_cache_events_total", value, cache=self.name, event=event)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
@@ -0,0 +1,125 @@
+"""
+Track changes to the index with serial numbers.
+"""
+from json import dumps, loads
+from time import time
+
+from cheddar.compat import zadd
+
+
+class ChangeLog(object):
+    """
+    Append-only (but capped) log of index changes.
+
+    Each change gets the next serial number, assigned in a transaction that also
+    appends the change, so changes become visible in serial order and clients can
+    sync incrementally by asking for changes since the last serial they saw.
+
+    Changes are kept in a sorted set, scored by serial.
+    """
+
+    UPLOAD = "upload"
+    REMOVE = "remove"
+    REFRESH = "refresh"
+
+    def __init__(self, app):
+        self.redis = app.redis
+        self.logger = app.logger
+        self.size = app.config["CHANGELOG_SIZE"]
+        self.key = "cheddar.changes"
+        self.serial_key = "cheddar.changes:serial"
+
+    def record(self, action, name, version=None):
+        """
+        Record a change.
+
+        :param action: one of `UPLOAD`, `REMOVE`, or `REFRESH`
+        :returns: the change's serial
+        """
+        change = self.change(action, name, version)
+
+        def _record(pipe):
+            change.prepare(pipe)
+            pipe.multi()
+            change.queue(pipe)
+            return change.serial
+
+        return self.redis.transaction(_record, value_from_callable=True)
+
+    def change(self, action, name, version=None):
+        """
+        Create a change to be recorded as part of another transaction.
+
+        :returns: a `Change`
+        """
+        return Change(self, action, name, version)
+
+    def since(self, serial, limit):
+        """
+        Get changes after a serial, oldest first.
+
+        :returns: a dictionary with the changes, whether more changes follow, the
+                  current serial, and whether changes after serial were already
+                  discarded (in which case clients must sync from scratch)
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrangebyscore(self.key, "({}".format(serial), "+inf", start=0, num=limit + 1)
+        pipe.zrange(self.key, 0, 0, withscores=True)
+        pipe.get(self.serial_key)
+        raw_changes, oldest, current = pipe.execute()
+
+        return dict(changes=[loads(change) for change in raw_changes[:limit]],
+                    more=len(raw_changes) > limit,
+                    serial=int(current or 0),
+                    truncated=bool(oldest) and oldest[0][1] > serial + 1)
+
+    def recent(self, count):
+        """
+        Get the most recent changes, newest first.
+        """
+        return [loads(change) for change in self.redis.zrevrange(self.key, 0, count - 1)]
+
+    def serial(self):
+        """
+        Get the serial of the most recent change.
+        """
+        return int(self.redis.get(self.serial_key) or 0)
+
+
+class Change(object):
+    """
+    A change recorded within another transaction, so that it is recorded exactly when
+    the transaction's writes are.
+
+    Call `prepare` while the transaction's pipeline is still watching keys (before MULTI)
+    and `queue` after MULTI.
+    """
+
+    def __init__(self, changelog, action, name, version=None):
+        self.changelog = changelog
+        self.action = action
+        self.name = name
+        self.version = version
+        self.serial = None
+
+    def prepare(self, pipe):
+        """
+        Watch and read the current serial.
+        """
+        pipe.watch(self.changelog.serial_key)
+        self.serial = int(pipe.get(self.changelog.serial_key) or 0) + 1
+
+    def queue(self, pipe):
+        """
+        Queue commands that assign the next serial and append the change.
+        """
+        change = dict(serial=self.serial,
+                      action=self.action,
+                      name=self.name,
+                      version=self.version,
+                      timestamp=time())
+        pipe.set(self.changelog.serial_key, self.serial)
+        zadd(pipe, self.changelog.key, {dumps(change, sort_keys=True): self.serial})
+        pipe.zremrangebyrank(self.changelog.key, 0, -(self.changelog.size + 1))
+        self.changelog.logger.debug("Recording change: %s %s %s as: %s",
+                                    self.action, self.name, self.version, self.serial)
@@ -0,0 +1,21 @@
+"""
+Compatibility across dependency versions.
+"""
+from redis import __version__ as redis_version
+
+
+# redis-py 3 takes sorted set members as a mapping; earlier versions take keyword arguments
+# (or positional arguments whose order differs between `Redis` and `StrictRedis`)
+REDIS_ZADD_MAPPING = int(redis_version.split(".")[0]) >= 3
+
+
+def zadd(redis, name, mapping):
+    """
+    Add members (with scores) to a sorted set.
+
+    :param redis: a Redis client or pipeline
+    :param mapping: a dictionary mapping members to scores
+    """
+    if REDIS_ZADD_MAPPING:
+        return redis.zadd(name, mapping)
+    return redis.zadd(name, **mapping)
@@ -1,26 +1,43 @@
 """
 Configure the Flask application.
 """
+from importlib import import_module
+from logging import INFO
 from logging.config import dictConfig
-from time import ctime
+from random import random, seed
+from time import ctime, time
 
-from flask import request
-from redis import Redis
+from flask import g, request
+from redis import BlockingConnectionPool, Redis
 
 from cheddar import defaults
+from cheddar.accounting import CountingRedis
+from cheddar.auth import Users
+from cheddar.cache import LRUCache
+from cheddar.changelog import ChangeLog
 from cheddar.controllers import create_routes
 from cheddar.errorhandlers import create_errorhandlers
 from cheddar.history import History
 from cheddar.index.combined import CombinedIndex
+from cheddar.index.manifest import StorageManifest
 from cheddar.index.storage import DistributionStorage
+from cheddar.metrics import Metrics, NULL_METRICS
 from cheddar.model.distribution import Projects
+from cheddar.profiling import Profiler
+from cheddar.rendered import RenderedCache
+
+
+# Modules imported on first use, unless preloaded
+LAZY_IMPORTS = ["BeautifulSoup", "magic", "pkg_resources", "pkginfo"]
 
 
 def configure_app(app, debug=False, testing=False):
     """
     Load configuration and initialize collaborators.
-    """
 
+    Nothing here connects to Redis or touches storage; both happen on first use.
+    """
+    started = time()
     app.debug = debug
     app.testing = testing
 
@@ -29,12 +46,34 @@ def configure_app(app, debug=False, testing=False):
     _configure_logging(app)
     _configure_jinja(app)
 
-    app.redis = Redis(app.config['REDIS_HOSTNAME'])
-    app.projects = Projects(app.redis, app.logger)
-    app.local_storage = DistributionStorage(app.config["LOCAL_CACHE_DIR"], app.logger)
-    app.remote_storage = DistributionStorage(app.config["REMOTE_CACHE_DIR"], app.logger)
+    app.redis = _create_redis(app)
+    app.metrics = _create_metrics(app)
+    app.users = Users(app.redis,
+                      app.logger,
+                      app.config["AUTH_HASH_ITERATIONS"],
+                      cache_ttl=app.config["AUTH_CACHE_TTL"],
+                      cache_size=app.config["AUTH_CACHE_SIZE"])
+    app.projects = Projects(app.redis,
+                            app.logger,
+                            legacy_reads=app.config["LEGACY_METADATA_READS"],
+                            metrics=app.metrics)
+    app.local_storage = DistributionStorage(app.config["LOCAL_CACHE_DIR"],
+                                            app.logger,
+                                            cache=_create_storage_cache(app, "local"),
+                                            manifest=_create_storage_manifest(app, "local"),
+                                            metrics=app.metrics,
+                                            name="local")
+    app.remote_storage = DistributionStorage(app.config["REMOTE_CACHE_DIR"],
+                                             app.logger,
+                                             cache=_create_storage_cache(app, "remote"),
+                                             manifest=_create_storage_manifest(app, "remote"),
+                                             metrics=app.metrics,
+                                             name="remote")
     app.history = History(app)
+    app.changelog = ChangeLog(app)
+    app.rendered = RenderedCache(app)
     app.index = CombinedIndex(app)
+    app.profiler = Profiler(app) if app.config["PROFILING_ENABLED"] else None
 
     if app.config.get('FORCE_READ_REQUESTS'):
         # read the request fully so that nginx and uwsgi play nice
@@ -43,9 +82,51 @@ def configure_app(app, debug=False, testing=False):
             request.stream.read()
             return response
 
+    if app.config["METRICS_ENABLED"]:
+        _configure_request_metrics(app)
+
+    if app.config["REDIS_ACCOUNTING"]:
+        _configure_redis_accounting(app)
+
+    if app.config["REQUEST_LOG_SAMPLE_RATE"]:
+        _configure_request_logging(app)
+
+    if app.profiler is not None:
+        _configure_profiling(app)
+
     create_routes(app)
     create_errorhandlers(app)
 
+    if app.config["PRELOAD"]:
+        _preload(app)
+
+    app.logger.debug("Configured app in %.3fs", time() - started)
+
+
+def after_fork(app):
+    """
+    Reinitialize per-process state in a forked worker.
+
+    Redis connections (and pending metrics) inherited from the parent must not be
+    shared between processes; the pool is reset without closing the parent's sockets.
+    """
+    pool = getattr(app.redis, "connection_pool", None)
+    if pool is not None:
+        pool.reset()
+    app.metrics.discard()
+    # otherwise every worker samples (and profiles) the same requests
+    seed()
+
+
+def _preload(app):
+    """
+    Import lazily imported modules and compile templates ahead of the first request.
+    """
+    for name in LAZY_IMPORTS:
+        import_module(name)
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
 
 def _configure_from_defaults(app):
     """
@@ -73,6 +154,190 @@ def _configure_logging(app):
     dictConfig(app.config['LOGGING'])
 
 
+def _create_redis(app):
+    """
+    Create a Redis client, sharing a bounded pool of connections if so configured.
+
+    The client counts its commands and round trips if so configured.
+    """
+    if not app.config["REDIS_MAX_CONNECTIONS"]:
+        redis = Redis(app.config['REDIS_HOSTNAME'])
+    else:
+        pool = BlockingConnectionPool(host=app.config['REDIS_HOSTNAME'],
+                                      max_connections=app.config["REDIS_MAX_CONNECTIONS"],
+                                      timeout=app.config["REDIS_POOL_TIMEOUT"])
+        redis = Redis(connection_pool=pool)
+
+    if not app.config["REDIS_ACCOUNTING"]:
+        return redis
+    return CountingRedis(redis)
+
+
+def _create_metrics(app):
+    """
+    Create a metrics registry, if enabled.
+    """
+    if not app.config["METRICS_ENABLED"]:
+        return NULL_METRICS
+
+    return Metrics(app.redis, app.logger, flush_interval=app.config["METRICS_FLUSH_INTERVAL"])
+
+
+def _configure_request_metrics(app):
+    """
+    Observe request latency per endpoint.
+    """
+    @app.before_request
+    def start_timer():
+        g.request_started = time()
+
+    @app.after_request
+    def observe_request(response):
+        started = getattr(g, "request_started", None)
+        if started is not None:
+            app.metrics.observe("cheddar_request_duration_seconds",
+                                time() - started,
+                                endpoint=request.endpoint or "unknown",
+                                method=request.method,
+                                status=response.status_code)
+        app.metrics.maybe_flush()
+        return response
+
+
+def _configure_redis_accounting(app):
+    """
+    Report Redis usage per request.
+    """
+    @app.before_request
+    def start_redis_accounting():
+        g.redis_stats = app.redis.start()
+
+    @app.after_request
+    def report_redis_accounting(response):
+        stats = getattr(g, "redis_stats", None)
+        if stats is None:
+            return response
+        app.redis.stop(stats)
+
+        if app.debug:
+            response.headers["X-Redis-Commands"] = str(stats.commands)
+            response.headers["X-Redis-Round-Trips"] = str(stats.round_trips)
+            response.headers["X-Redis-Time"] = "{:.6f}".format(stats.duration)
+
+        endpoint = request.endpoint or "unknown"
+        app.metrics.increment("cheddar_redis_round_trips_total", stats.round_trips, endpoint=endpoint)
+        app.metrics.increment("cheddar_redis_commands_total", stats.commands, endpoint=endpoint)
+        app.metrics.increment("cheddar_redis_duration_seconds_total", stats.duration, endpoint=endpoint)
+
+        duration = time() - stats.started
+        threshold = app.config["SLOW_REQUEST_THRESHOLD"]
+        if threshold and duration >= threshold:
+            app.logger.warning("Slow request: %s %s took %.3fs with %s",
+                               request.method, request.full_path, duration, stats)
+        return response
+
+    @app.teardown_request
+    def stop_redis_accounting(exc):
+        stats = getattr(g, "redis_stats", None)
+        if stats is not None:
+            app.redis.stop(stats)
+
+
+def _configure_request_logging(app):
+    """
+    Log a structured record for a sample of requests.
+
+    Sampling is decided before the request runs, so unsampled requests only pay
+    for a random number.
+    """
+    sample_rate = app.config["REQUEST_LOG_SAMPLE_RATE"]
+
+    @app.before_request
+    def sample_request():
+        if random() * sample_rate < 1:
+            g.request_logged = time()
+
+    @app.after_request
+    def log_request(response):
+        started = getattr(g, "request_logged", None)
+        if started is None or not app.logger.isEnabledFor(INFO):
+            return response
+
+        record = dict(method=request.method,
+                      path=request.path,
+                      endpoint=request.endpoint,
+                      name=(request.view_args or {}).get("name"),
+                      status=response.status_code,
+                      duration=time() - started)
+        stats = getattr(g, "redis_stats", None)
+        if stats is not None:
+            record.update(redis_commands=stats.commands,
+                          redis_round_trips=stats.round_trips,
+                          redis_duration=stats.duration)
+        app.logger.info("Request: %(method)s %(path)s %(status)s %(duration).3fs", record,
+                        extra=dict(request=record))
+        return response
+
+
+def _configure_profiling(app):
+    """
+    Profile selected requests.
+
+    Profiles of requests that fail with an unhandled exception (which skip
+    `after_request`) are stopped, but not saved, on teardown.
+    """
+    @app.before_request
+    def start_profile():
+        if app.profiler.should_profile():
+            g.profile_started = time()
+            g.profile = app.profiler.start()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = getattr(g, "profile", None)
+        if profile is not None:
+            g.profile = None
+            response.headers["X-Cheddar-Profile-Id"] = app.profiler.finish(profile,
+                                                                           g.profile_started,
+                                                                           response)
+        return response
+
+    @app.teardown_request
+    def abort_profile(error):
+        profile = getattr(g, "profile", None)
+        if profile is not None:
+            g.profile = None
+            app.profiler.abort(profile)
+
+
+def _create_storage_cache(app, name):
+    """
+    Create an in-memory cache of hot distribution content, if enabled.
+    """
+    if not app.config["STORAGE_CACHE_SIZE"]:
+        return None
+
+    def sizeof(value):
+        content_data = value[0]
+        return len(content_data)
+
+    return LRUCache(app.config["STORAGE_CACHE_SIZE"],
+                    max_entry_size=app.config["STORAGE_CACHE_MAX_ENTRY_SIZE"],
+                    sizeof=sizeof,
+                    metrics=app.metrics,
+                    name="storage_{}".format(name))
+
+
+def _create_storage_manifest(app, name):
+    """
+    Create a Redis manifest of stored distributions, if enabled.
+    """
+    if not app.config["STORAGE_MANIFEST"]:
+        return None
+
+    return StorageManifest(app.redis, app.logger, "cheddar.manifest.{}".format(name))
+
+
 def _configure_jinja(app):
     def islist(obj):
         return isinstance(obj, list)
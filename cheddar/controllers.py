@@ -6,10 +6,12 @@ from functools import wraps
 from urlparse import urljoin
 
 from flask import jsonify, make_response, render_template, request
+from requests import codes
 
 from cheddar.auth import check_authentication
 from cheddar.exceptions import BadRequestError, NotFoundError
-from cheddar.model.versions import sort_key
+from cheddar.model.versions import sort_versions
+from cheddar.rendered import IDENTITY
 
 
 def create_routes(app):
@@ -20,7 +22,7 @@ def create_routes(app):
         """
         @wraps(func)
         def wrapper(*args, **kwargs):
-            if not check_authentication(app.redis):
+            if not check_authentication(app.users):
                 response = make_response("", 401)
                 response.headers["WWW-Authenticate"] = 'Basic realm="cheddar"'
                 return response
@@ -30,10 +32,75 @@ def create_routes(app):
     @app.route("/")
     def index():
         """
-        Index page: show recent history.
+        Index page: show recent changes.
         """
         app.logger.debug("Showing index page")
-        return _render("index.html", history=app.history.all())
+        return _render("index.html",
+                       history=app.history.all(),
+                       changes=app.changelog.recent(app.config["HISTORY_SIZE"]))
+
+    @app.route("/changes/")
+    @app.route("/changes")
+    def list_changes():
+        """
+        List changes (uploads, removals, and remote refreshes) after a serial, oldest first.
+
+        Clients sync incrementally by passing the serial of the last change they saw
+        as `since`; `more` signals another page and `truncated` that changes were
+        already discarded, so the client must sync from scratch.
+        """
+        try:
+            since = int(request.args.get("since", 0))
+            limit = int(request.args.get("limit", 100))
+        except ValueError:
+            raise BadRequestError("Expected integer since and limit")
+        if since < 0 or limit < 1:
+            raise BadRequestError("Expected non-negative since and positive limit")
+
+        app.logger.debug("Showing changes since: %s", since)
+        return jsonify(**app.changelog.since(since, min(limit, app.config["CHANGES_MAX_LIMIT"])))
+
+    if app.config["METRICS_ENABLED"]:
+        @app.route("/metrics")
+        def show_metrics():
+            """
+            Show metrics, totalled across workers, in the Prometheus text format.
+
+            This worker's pending metrics are flushed first; other workers' metrics
+            may lag by up to the flush interval.
+            """
+            app.metrics.flush()
+            response = make_response(app.metrics.render())
+            response.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+            return response
+
+    if app.profiler is not None:
+        @app.route("/profiles/")
+        @app.route("/profiles")
+        @authenticated
+        def list_profiles():
+            """
+            List recent request profiles. Requires auth.
+            """
+            return _render("profiles.html", profiles=app.profiler.list_profiles())
+
+        @app.route("/profiles/<profile_id>")
+        @authenticated
+        def show_profile(profile_id):
+            """
+            Summarize a request profile as text. Requires auth.
+            """
+            sort = request.args.get("sort", "cumulative")
+            try:
+                summary = app.profiler.summarize(profile_id, sort=sort)
+            except KeyError:
+                raise BadRequestError("Unknown sort: {}".format(sort))
+            if summary is None:
+                raise NotFoundError()
+
+            response = make_response(summary)
+            response.headers["Content-Type"] = "text/plain; charset=utf-8"
+            return response
 
     @app.route("/simple/")
     @app.route("/simple")
@@ -43,13 +110,16 @@ def create_routes(app):
         """
         app.logger.debug("Showing all projects")
 
-        def name_sort_key(name):
-            return name.lower()
+        def render():
+            def name_sort_key(name):
+                return name.lower()
+
+            projects = sorted([project.name for project in app.index.get_projects()],
+                              key=name_sort_key)
 
-        projects = sorted([project.name for project in app.index.get_projects()],
-                          key=name_sort_key)
+            return _render("simple.html", projects=projects)
 
-        return _render("simple.html", projects=projects)
+        return _render_listing(None, render)
 
     @app.route("/simple/<name>/")
     @app.route("/simple/<name>")
@@ -57,18 +127,65 @@ def create_routes(app):
         """
         List versions for a hosted project.
         """
-        app.logger.info("Showing package index for: {}".format(name))
+        app.logger.info("Showing package index for: %s", name)
 
-        versions = app.index.get_versions(name)
+        def render():
+            versions = app.index.get_versions(name)
 
-        if not versions:
-            raise NotFoundError()
+            if not versions:
+                raise NotFoundError()
+
+            # indexes order listings when they are written; only sort unordered ones
+            ordered_versions = versions
+            if not isinstance(versions, OrderedDict):
+                ordered_versions = sort_versions(versions)
+
+            return _render("project.html", project=name, versions=ordered_versions)
+
+        return _render_listing(name, render)
 
-        sorted_versions = OrderedDict()
-        for version in sorted(versions.keys(), key=sort_key, reverse=True):
-            sorted_versions[version] = versions[version]
+    @app.route("/batch/", methods=["POST"])
+    @app.route("/batch", methods=["POST"])
+    def get_projects_batch():
+        """
+        List versions for many projects.
 
-        return _render("project.html", project=name, versions=sorted_versions)
+        Expects a JSON list of project names (or an object with a "projects" list)
+        and returns each project's versions, newest first, as (filename, path) pairs.
+        Projects that cannot be found (or fetched) are reported inline.
+        """
+        data = request.get_json(force=True, silent=True)
+        names = data.get("projects") if isinstance(data, dict) else data
+        if not isinstance(names, list) or not all(isinstance(name, basestring) for name in names):
+            raise BadRequestError("Expected a list of project names")
+        if len(names) > app.config["BATCH_MAX_PROJECTS"]:
+            raise BadRequestError("Too many projects; the limit is {}".format(
+                app.config["BATCH_MAX_PROJECTS"]))
+
+        # resolve each name once, but answer in request order
+        names = list(OrderedDict.fromkeys(names))
+        app.logger.info("Showing package indexes for: %s projects", len(names))
+
+        results = app.index.get_versions_batch(names)
+
+        projects = []
+        for name in names:
+            versions = results.get(name)
+            if isinstance(versions, NotFoundError):
+                error = dict(status=codes.not_found)
+                if versions.status_code is not None:
+                    error["upstream_status"] = versions.status_code
+                projects.append(dict(name=name, error=error))
+            elif isinstance(versions, Exception):
+                projects.append(dict(name=name, error=dict(status=codes.bad_gateway)))
+            elif not versions:
+                projects.append(dict(name=name, error=dict(status=codes.not_found)))
+            else:
+                if not isinstance(versions, OrderedDict):
+                    versions = sort_versions(versions)
+                projects.append(dict(name=name, versions=versions.items()))
+
+        return jsonify(projects=projects)
 
     @app.route("/simple/<name>/<version>/", methods=["GET", "DELETE"])
     @app.route("/simple/<name>/<version>", methods=["GET", "DELETE"])
@@ -82,7 +199,7 @@ def create_routes(app):
         """
         Get metadata for version.
         """
-        app.logger.debug("Getting: {} {}".format(name, version))
+        app.logger.debug("Getting: %s %s", name, version)
 
         metadata = app.index.get_metadata(name, version)
 
@@ -96,7 +213,7 @@ def create_routes(app):
         """
         Delete all version data. Requires auth.
         """
-        app.logger.debug("Removing: {} {}".format(name, version))
+        app.logger.debug("Removing: %s %s", name, version)
         app.index.remove_version(name, version)
         return ""
 
@@ -106,7 +223,7 @@ def create_routes(app):
         """
         Local distribution download access.
         """
-        app.logger.debug("Getting local distribution: {}".format(location))
+        app.logger.debug("Getting local distribution: %s", location)
         content_data, content_type = app.index.get_distribution(location, local=True)
         response = make_response(content_data)
         response.headers['Content-Type'] = content_type
@@ -125,7 +242,7 @@ def create_routes(app):
         # urljoin logic happens here instead of within the remote index.
         location = urljoin(request.args["base"], path)
 
-        app.logger.debug("Getting remote distribution: {}".format(location))
+        app.logger.debug("Getting remote distribution: %s", location)
         content_data, content_type = app.index.get_distribution(location, local=False)
         response = make_response(content_data)
         response.headers['Content-Type'] = content_type
@@ -183,6 +300,45 @@ def create_routes(app):
         else:
             return render_template(template, **data)
 
+    def _render_listing(name, render):
+        """
+        Serve a listing from the rendered cache, rendering (and caching) it on a miss.
+
+        Listings are served pre-compressed when the client accepts it and carry a
+        strong ETag per variant; a matching If-None-Match gets a 304 without
+        consulting the index.
+
+        :param name: the project name or None for the list of projects
+        :param render: function that renders the listing
+        """
+        representation = "json" if _wants_json() else "html"
+        encoding = app.rendered.negotiate(request.accept_encodings)
+        entry, stamp = app.rendered.get(name, representation, encoding)
+        if entry is None:
+            rendered = app.make_response(render())
+            entry = app.rendered.put(name,
+                                     representation,
+                                     stamp,
+                                     rendered.get_data(),
+                                     rendered.headers["Content-Type"],
+                                     encoding)
+
+        if encoding not in entry["variants"]:
+            encoding = IDENTITY
+        etag = entry["etag"] if encoding == IDENTITY else "{}-{}".format(entry["etag"], encoding)
+
+        if request.if_none_match.contains(etag):
+            response = make_response("", 304)
+        else:
+            response = make_response(entry["variants"][encoding])
+            response.headers["Content-Type"] = entry["content_type"]
+            if encoding != IDENTITY:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = app.config["LISTING_CACHE_CONTROL"]
+        response.headers["Vary"] = "Accept, Accept-Encoding"
+        return response
+
     def _wants_json():
         """
         Should response use JSON?
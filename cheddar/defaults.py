@@ -11,25 +11,132 @@ INDEX_URL = "http://pypi.python.org/simple"
 # Where do we find Redis?
 REDIS_HOSTNAME = 'localhost'
 
+# How many Redis connections may each process open?
+# (Leave unset for an unbounded pool; set it when serving with gevent so that
+# greenlets wait for a pooled connection instead of opening thousands.)
+REDIS_MAX_CONNECTIONS = None
+
+# How many seconds should a request wait for a pooled Redis connection?
+REDIS_POOL_TIMEOUT = 20
+
+# Should Redis commands and round trips be counted per request?
+# (Totals are sent as X-Redis-* response headers in debug mode and reported as metrics.)
+REDIS_ACCOUNTING = True
+
+# How many seconds may a request take before it is logged as slow, along with its Redis usage?
+# (Set to zero to disable.)
+SLOW_REQUEST_THRESHOLD = 1.0
+
+# Should parsers and templates be loaded at startup instead of on first use?
+# (Useful when uwsgi loads the app once in its master, so that forked workers share them.)
+PRELOAD = False
+
+# Should local metadata still be read from pre-1.6 keys and project names?
+# (Disable once "cheddar-manage migrate" has converted existing data.)
+LEGACY_METADATA_READS = True
+
 # How many seconds should we cache version content?
 VERSIONS_LONG_TTL = 3 * 24 * 60 * 60
 
 # How many seconds should we wait to requery version content?
 VERSIONS_SHORT_TTL = 10 * 60
 
+# How many seconds may rendered listings (/simple and /simple/<name>) be served from Redis?
+# (Set to zero to disable; keep this below VERSIONS_SHORT_TTL so remote listings still refresh.)
+RENDERED_CACHE_TTL = 60
+
+# What Cache-Control header should listings send along with their ETag?
+LISTING_CACHE_CONTROL = "public, max-age=60"
+
+# How many bytes must a listing have before compressed (gzip, and brotli if installed)
+# variants are cached alongside it?
+LISTING_COMPRESS_MIN_SIZE = 1024
+
 # How long should we wait for remote HTTP requests to complete?
 # Note that "pip install" has a default timeout of 15 seconds...
 GET_TIMEOUT = 20
 
+# How should a project's listing combine local and remote versions?
+#  - "local-only": a project hosted locally hides the remote index's versions
+#  - "merged": list versions from both indexes (local files win over remote files of the same name)
+#  - "remote-shadowed": list versions from both, except remote versions that are also hosted locally
+INDEX_MODE = "local-only"
+
+# Which projects use a different mode? (e.g. {"requests": "merged"}; names are compared canonically)
+INDEX_MODES = {}
+
+# How many seconds may a merged listing wait for the remote index?
+# (Past this, local versions are served while the remote listing refreshes in the background.)
+REMOTE_LATENCY_BUDGET = 0.5
+
+# How many projects may a single batch request resolve?
+BATCH_MAX_PROJECTS = 500
+
+# How many remote listings may a worker process fetch at once (for batch requests and merged listings)?
+BATCH_FETCH_WORKERS = 8
+
 # Where should we cache remote package data?
 REMOTE_CACHE_DIR = "/var/tmp/cheddar-{}/remote".format(getuser())
 
 # Where should we cache local package data?
 LOCAL_CACHE_DIR = "/var/tmp/cheddar-{}/local".format(getuser())
 
+# How many bytes of distribution content should each worker keep in memory?
+# (Set to zero to disable; each storage location gets its own cache.)
+STORAGE_CACHE_SIZE = 0
+
+# How large may a single distribution be and still be kept in memory?
+STORAGE_CACHE_MAX_ENTRY_SIZE = 1024 * 1024
+
+# Should stored distributions be tracked in a Redis manifest?
+# (Run "cheddar-manage reconcile" after enabling this on existing storage.)
+STORAGE_MANIFEST = False
+
+# How many PBKDF2 iterations should new password hashes use?
+AUTH_HASH_ITERATIONS = 100000
+
+# How many seconds may a verified credential be trusted without hashing it again?
+# (Set to zero to disable; changing a password always invalidates it.)
+AUTH_CACHE_TTL = 60
+
+# How many verified credentials should each worker remember?
+AUTH_CACHE_SIZE = 1000
+
+# Should request, cache, and upstream metrics be collected and served at /metrics?
+METRICS_ENABLED = True
+
+# How many seconds may each worker hold metrics before adding them to the totals in Redis?
+METRICS_FLUSH_INTERVAL = 10
+
+# Log a structured record for 1 in how many requests? (Set to zero to disable.)
+# (Records carry a "request" attribute with method, path, endpoint, status, and timings.)
+REQUEST_LOG_SAMPLE_RATE = 0
+
+# Should requests be profiled on demand (and profiles listed at /profiles)?
+# (Profiling costs nothing while disabled.)
+PROFILING_ENABLED = False
+
+# Where should request profiles be written?
+PROFILE_DIR = "/var/tmp/cheddar-{}/profiles".format(getuser())
+
+# Which header, sent along with upload credentials, requests a profile?
+PROFILE_HEADER = "X-Cheddar-Profile"
+
+# Profile 1 in how many requests? (Set to zero to only profile on request.)
+PROFILE_SAMPLE_RATE = 0
+
+# How many profiles should be kept?
+PROFILE_HISTORY = 50
+
 # How much history to keep?
 HISTORY_SIZE = 50
 
+# How many changes should be kept for incremental sync (via /changes)?
+CHANGELOG_SIZE = 10000
+
+# How many changes may a single /changes request return?
+CHANGES_MAX_LIMIT = 1000
+
 # Logging configuration
 LOGGING = {
     'version': 1,
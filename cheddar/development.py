@@ -3,8 +3,6 @@ Run a development server.
 """
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
 
-from cheddar.app import create_app
-
 
 def main():
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
@@ -18,12 +16,38 @@ def main():
                         type=int,
                         default=5000,
                         help='Listen port')
+    parser.add_argument('--gevent',
+                        dest='gevent',
+                        action='store_true',
+                        default=False,
+                        help='Serve with cooperative (gevent) concurrency')
     args, extra = parser.parse_known_args()
 
+    host = '0.0.0.0' if args.all_interfaces else '127.0.0.1'
+
+    if args.gevent:
+        run_gevent(host, args.port)
+        return
+
+    # imported here so that --gevent can patch the standard library first
+    from cheddar.app import create_app
     app = create_app(debug=True)
+    app.run(host=host,
+            port=args.port)
 
-    if args.all_interfaces:
-        app.run(host='0.0.0.0',
-                port=args.port)
-    else:
-        app.run(port=args.port)
+
+def run_gevent(host, port):
+    """
+    Serve with gevent's WSGI server, as production_gevent does under uwsgi.
+
+    The standard library is patched before the app (and with it flask, requests,
+    and redis) is imported.
+    """
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.pywsgi import WSGIServer
+
+    from cheddar.app import create_app
+
+    app = create_app(debug=True)
+    WSGIServer((host, port), app).serve_forever()
@@ -14,18 +14,26 @@ class History(object):
     def key(self):
         return "cheddar.history"
 
-    def add(self, name, version):
+    def add(self, name, version, pipe=None):
         """
         Add a new/version and truncate history.
+
+        :param pipe: optional pipeline (e.g. a transaction) on which to queue commands
         """
-        self.redis.lpush(self.key, "{}/{}".format(name, version))
-        self.redis.ltrim(self.key, 0, self.size - 1)
+        commands = self.redis.pipeline() if pipe is None else pipe
+        commands.lpush(self.key, "{}/{}".format(name, version))
+        commands.ltrim(self.key, 0, self.size - 1)
+        if pipe is None:
+            commands.execute()
 
-    def remove(self, name, version):
+    def remove(self, name, version, pipe=None):
         """
         Remove a new/version from history.
+
+        :param pipe: optional pipeline (e.g. a transaction) on which to queue commands
         """
-        self.redis.lrem(self.key, value="{}/{}".format(name, version))
+        commands = self.redis if pipe is None else pipe
+        commands.lrem(self.key, value="{}/{}".format(name, version))
 
     def all(self):
         """
@@ -1,20 +1,93 @@
 """
 Implements a combined local and remote package index.
 """
+from collections import OrderedDict
+from threading import Event, Lock
+from time import time
+
+from cheddar.exceptions import NotFoundError
 from cheddar.index.index import Index
 from cheddar.index.local import LocalIndex
 from cheddar.index.remote import CachedRemoteIndex
+from cheddar.model.versions import canonicalize_name, parse_filenames, sort_versions
+
+
+LOCAL_ONLY = "local-only"
+MERGED = "merged"
+REMOTE_SHADOWED = "remote-shadowed"
+
+MODES = [LOCAL_ONLY, MERGED, REMOTE_SHADOWED]
+
+
+def merge_versions(local_versions, remote_versions, mode):
+    """
+    Merge local and remote versions listings, newest first.
+
+    :param mode: `MERGED` or `REMOTE_SHADOWED`
+    """
+    if mode == REMOTE_SHADOWED:
+        local_parsed = parse_filenames(list(local_versions))
+        local_releases = set(parsed.parsed_version
+                             for parsed in local_parsed.itervalues() if parsed)
+        remote_parsed = parse_filenames(list(remote_versions))
+        remote_versions = {filename: path for filename, path in remote_versions.iteritems()
+                           if remote_parsed[filename] is None or
+                           remote_parsed[filename].parsed_version not in local_releases}
+
+    # local files come first among files of the same version
+    versions = OrderedDict(local_versions)
+    for filename, path in remote_versions.iteritems():
+        versions.setdefault(filename, path)
+    return sort_versions(versions)
+
+
+class RemoteListing(object):
+    """
+    A remote versions listing, either cached or being refreshed in the background.
+    """
+
+    def __init__(self, versions=None):
+        self.done = Event()
+        self.versions = versions
+        self.error = None
+        if versions is not None:
+            self.done.set()
+        # whether a request gave up waiting (and served a listing without these versions)
+        self.abandoned = False
 
 
 class CombinedIndex(Index):
     """
     Combined local and remote index.
+
+    By default, a project hosted locally hides the remote index's versions. Projects
+    may instead merge both listings (see `MODES`); a fresh cached remote listing is
+    merged right away, while a missing or expired one is refreshed concurrently on the
+    remote index's shared fetch pool and, if that takes longer than the latency budget,
+    local versions are served while the refresh finishes in the background.
     """
 
     def __init__(self, app):
         self.local = LocalIndex(app)
         self.remote = CachedRemoteIndex(app)
         self.logger = app.logger
+        self.metrics = app.metrics
+        self.rendered = app.rendered
+        self.mode = app.config["INDEX_MODE"]
+        self.modes = {canonicalize_name(name): mode
+                      for name, mode in app.config["INDEX_MODES"].iteritems()}
+        self.remote_budget = app.config["REMOTE_LATENCY_BUDGET"]
+        for mode in [self.mode] + self.modes.values():
+            if mode not in MODES:
+                raise ValueError("Unknown index mode: {}".format(mode))
+        self._listings = {}
+        self._lock = Lock()
+
+    def get_mode(self, name):
+        """
+        Get the mode that combines a project's local and remote versions.
+        """
+        return self.modes.get(canonicalize_name(name), self.mode)
 
     def get_projects(self):
         """
@@ -26,21 +99,139 @@ class CombinedIndex(Index):
         """
         Get versions from both indexes, favoring the local index.
         """
+        mode = self.get_mode(name)
+        if mode != LOCAL_ONLY:
+            return self._get_merged_versions(name, mode)
+
         # A project hosted locally will mask anything hosted remotedly.
-        # It *is* possible to query both indexes and merge the results, but
-        # this comes as the cost of the added latency of the remote index
-        # on every query with a cache miss.
-        #
-        # At the moment, this overhead doesn't seem worthwhile.
+        # Merging (see `MODES`) adds the remote index's latency, up to a budget.
         local_versions = self.local.get_versions(name)
         if local_versions:
-            self.logger.info("Obtained versions listing for: {} using local index".format(name))
+            self.logger.info("Obtained versions listing for: %s using local index", name)
             return local_versions
 
         remote_versions = self.remote.get_versions(name)
-        self.logger.info("Obtained versions listing for: {} using remote index".format(name))
+        self.logger.info("Obtained versions listing for: %s using remote index", name)
         return remote_versions
 
+    def get_versions_batch(self, names):
+        """
+        Get versions for many projects from both indexes, favoring the local index.
+
+        Local listings are read first (in a single pipeline); only projects that are
+        not hosted locally, or that merge listings, are resolved by the remote index.
+        """
+        results = self.local.get_versions_batch(names)
+        remote_names = [name for name, versions in results.iteritems() if not versions]
+        merged_names = [name for name, versions in results.iteritems()
+                        if versions and self.get_mode(name) != LOCAL_ONLY]
+        # start merged projects' remote listings first, so they share one latency budget
+        deadline = time() + self.remote_budget
+        listings = self._start_remote_listings(merged_names)
+        if remote_names:
+            results.update(self.remote.get_versions_batch(remote_names))
+        for name, listing in listings.iteritems():
+            results[name] = self._merge_within_budget(name,
+                                                      self.get_mode(name),
+                                                      results[name],
+                                                      listing,
+                                                      deadline)
+        self.logger.info("Obtained versions listings for: %s projects (%s remote)",
+                         len(results), len(remote_names))
+        return results
+
+    def _get_merged_versions(self, name, mode):
+        """
+        Get versions from both indexes at once, waiting for the remote index only within budget.
+        """
+        deadline = time() + self.remote_budget
+        listing = self._start_remote_listings([name])[name]
+        local_versions = self.local.get_versions(name)
+        if not local_versions:
+            # nothing to fall back to; wait as a project that is not hosted locally would
+            listing.done.wait()
+            if listing.error is not None:
+                raise listing.error
+            self.logger.info("Obtained versions listing for: %s using remote index", name)
+            return listing.versions
+
+        return self._merge_within_budget(name, mode, local_versions, listing, deadline)
+
+    def _merge_within_budget(self, name, mode, local_versions, listing, deadline):
+        # each waiter has its own deadline; the shared flag only tells the refresh that
+        # some listing was served without its versions
+        arrived = listing.done.wait(max(0, deadline - time()))
+        with self._lock:
+            if not arrived and not listing.done.is_set():
+                listing.abandoned = True
+            else:
+                arrived = True
+        if not arrived:
+            self.logger.info("Remote versions listing for: %s exceeded the latency budget; "
+                             "serving local versions", name)
+            self.metrics.increment("cheddar_remote_budget_exceeded_total")
+            return local_versions
+
+        if listing.error is not None:
+            if not isinstance(listing.error, NotFoundError):
+                self.logger.warning("Unable to get remote versions listing for: %s: %s",
+                                    name, listing.error)
+            return local_versions
+
+        self.logger.info("Obtained versions listing for: %s using local and remote indexes (%s)",
+                         name, mode)
+        return merge_versions(local_versions, listing.versions, mode)
+
+    def _start_remote_listings(self, names):
+        """
+        Get remote versions listings, refreshing missing or expired ones in the background.
+
+        Cached listings are read in one round trip. Refreshes run on the remote index's
+        (bounded) fetch pool, and a listing already being refreshed is not refreshed twice.
+
+        :returns: a dictionary mapping each name to a `RemoteListing`
+        """
+        listings = {}
+        if not names:
+            return listings
+
+        cached = self.remote._get_cached_indexes(names)
+        for name, (cached_versions, cached_expired) in cached.iteritems():
+            self.remote._count_listing(cached_versions, cached_expired)
+            if cached_versions is not None and not cached_expired:
+                listings[name] = RemoteListing(cached_versions)
+                continue
+
+            key = canonicalize_name(name)
+            with self._lock:
+                listing = self._listings.get(key)
+                if listing is not None:
+                    listings[name] = listing
+                    continue
+                listing = listings[name] = self._listings[key] = RemoteListing()
+
+            self.remote._get_pool().apply_async(self._resolve_remote_listing,
+                                                (key, name, listing, cached_versions))
+        return listings
+
+    def _resolve_remote_listing(self, key, name, listing, cached_versions):
+        try:
+            listing.versions = self.remote._refresh_versions(name, cached_versions)
+        except Exception as error:
+            listing.error = error
+        finally:
+            with self._lock:
+                del self._listings[key]
+                if not listing.abandoned:
+                    listing.done.set()
+            if listing.abandoned:
+                # a listing without these versions may have been rendered and cached;
+                # invalidate it before anyone waiting can render the full listing
+                self.rendered.invalidate(name, projects=False)
+                self.logger.debug("Finished remote versions listing for: %s in the background",
+                                  name)
+                listing.done.set()
+
     def get_metadata(self, name, version):
         """
         Get metadata from local index.
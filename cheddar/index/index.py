@@ -3,6 +3,8 @@ Abstraction around a package index.
 """
 from abc import ABCMeta, abstractmethod
 
+from cheddar.exceptions import NotFoundError
+
 
 class Index(object):
     """
@@ -25,10 +27,31 @@ class Index(object):
         Get the list of versions for a project.
 
         :param name: the project name
-        :returns: a dictionary mapping versions to paths
+        :returns: a dictionary mapping versions to paths; an `OrderedDict`, newest first,
+                  avoids sorting on every request
         """
         pass
 
+    def get_versions_batch(self, names):
+        """
+        Get the lists of versions for many projects.
+
+        Resolves projects one at a time; implementations may override this to
+        resolve them concurrently.
+
+        :param names: an iterable of project names
+        :returns: a dictionary mapping each name to either its versions (as returned
+                  by `get_versions`) or the error (e.g. `NotFoundError`) raised while
+                  getting them
+        """
+        results = {}
+        for name in names:
+            try:
+                results[name] = self.get_versions(name)
+            except NotFoundError as error:
+                results[name] = error
+        return results
+
     @abstractmethod
     def get_metadata(self, name, version):
         """
@@ -1,73 +1,87 @@
 """
 Implements a local package index.
 """
+from collections import OrderedDict
+from hashlib import md5, sha256
+from json import dumps, loads
+from multiprocessing import cpu_count, Pool
+from os import stat
 from os.path import basename
 from time import time
 
 from werkzeug.utils import secure_filename
 
+from cheddar.changelog import ChangeLog
 from cheddar.exceptions import BadRequestError, ConflictError, NotFoundError
 from cheddar.index.index import Index
-from cheddar.model.distribution import Version
-from cheddar.model.versions import (guess_name_and_version,
-                                    read_metadata)
+from cheddar.model.distribution import format_listing_entry, Version
+from cheddar.model.versions import canonicalize_name, parse_filename, read_metadata
 
 
 class LocalIndex(Index):
     """
     Support register, upload, and management of locally hosted projects.
     """
+
+    # How many files to rebuild between progress reports?
+    PROGRESS_INTERVAL = 100
+
     def __init__(self, app):
         self.redis = app.redis
+        self.signatures_key = "cheddar.local:rebuild"
         self.storage = app.local_storage
         self.logger = app.logger
         self.projects = app.projects
         self.history = app.history
+        self.rendered = app.rendered
+        self.changelog = app.changelog
 
     def get_projects(self):
         self.logger.info("Getting local projects")
 
         projects = self.projects.list_projects()
 
-        self.logger.debug("Obtained local projects: {}".format(projects))
+        self.logger.debug("Obtained local projects: %s", projects)
         return projects
 
     def get_versions(self, name):
-        self.logger.info("Getting local versions listing for: {}".format(name))
-
-        # Pip converts underscores to dashes in distribution names. e.g. Pip will search for
-        # foo-bar when the dist name is foo_bar. Workaround by searching for both names here
-        # instead of normalizing the name on package registration and upload.
-        project = (self.projects.get_project(name) or
-                   self.projects.get_project(name.replace("-", "_")))
-        if project is None:
+        self.logger.info("Getting local versions listing for: %s", name)
+
+        # Pip normalizes distribution names (e.g. searching for foo-bar when the dist name
+        # is foo_bar); projects are looked up by their canonical name to match.
+        listing = self.projects.get_listing(name, digests=True)
+        if listing is None:
             return None
 
-        versions = {}
-        for project_version in project.get_versions():
-            metadata = project_version.get_metadata()
-            if metadata is None:
-                continue
-            filename = metadata[Version.FILENAME]
-            versions[filename] = "/local/{}".format(filename)
+        versions = self._to_versions(listing)
 
-        self.logger.debug("Obtained local versions listing for: {}".format(name))
+        self.logger.debug("Obtained local versions listing for: %s", name)
         return versions
 
+    def get_versions_batch(self, names):
+        """
+        Get local versions listings for many projects with pipelined reads.
+        """
+        self.logger.info("Getting local versions listings for: %s projects", len(names))
+
+        listings = self.projects.get_listings(names, digests=True)
+        return {name: None if listing is None else self._to_versions(listing)
+                for name, listing in listings.iteritems()}
+
     def get_metadata(self, name, version):
-        self.logger.info("Getting local metatdata for: {} {}".format(name, version))
+        self.logger.info("Getting local metatdata for: %s %s", name, version)
 
         metadata = self.projects.get_metadata(name, version)
 
-        self.logger.debug("Obtained metadata: {} for: {}: {}".format(metadata, name, version))
+        self.logger.debug("Obtained metadata: %s for: %s: %s", metadata, name, version)
         return metadata
 
     def get_distribution(self, location, **kwargs):
-        self.logger.info("Getting local distribution: {}".format(location))
+        self.logger.info("Getting local distribution: %s", location)
 
         result = self.storage.read(location)
         if result is None:
-            self.logger.info("Distribution not found for: {}".format(location))
+            self.logger.info("Distribution not found for: %s", location)
             raise NotFoundError()
 
         # don't log binary version content (.tar.gz, .zip, etc.), even at debug
@@ -77,22 +91,28 @@ class LocalIndex(Index):
         """
         Remove redis and file data for project version.
         """
-        self.logger.info("Removing version: {} {}".format(name, version))
+        self.logger.info("Removing version: %s %s", name, version)
 
         metadata = self.projects.get_metadata(name, version)
         if metadata is None:
-            self.logger.info("Version not found: {} {}".format(name, version))
+            self.logger.info("Version not found: %s %s", name, version)
             raise NotFoundError()
 
+        def callback(pipe):
+            self.history.remove(metadata["name"], version, pipe)
+            self.rendered.invalidate(metadata["name"], pipe)
+
         self.storage.remove(metadata[Version.FILENAME])
-        self.projects.remove_metadata(name, version)
-        self.history.remove(name, version)
+        change = self.changelog.change(ChangeLog.REMOVE, metadata["name"], version)
+        self.projects.remove_metadata(name, version, callback=callback, change=change)
 
     def validate_metadata(self, metadata):
         """
         Validate that name and version are provided in the metadata.
         """
-        self.logger.info("Validating metadata: {}".format(metadata))
+        self.logger.info("Validating metadata for: %s %s",
+                         metadata.get("name"), metadata.get("version"))
+        self.logger.debug("Validating metadata: %s", metadata)
         for required in ["name", "version"]:
             if required not in metadata:
                 return False
@@ -103,44 +123,225 @@ class LocalIndex(Index):
         Upload distribution file and update redis data.
         """
         filename = secure_filename(upload_file.filename)
-        self.logger.info("Uploading distribution: {}".format(filename))
+        self.logger.info("Uploading distribution: %s", filename)
         # don't log binary version content (.tar.gz, .zip, etc.), even at debug
 
         if self.storage.exists(filename):
-            self.logger.warn("Aborting upload of: {}; already exists".format(filename))
+            self.logger.warn("Aborting upload of: %s; already exists", filename)
             raise ConflictError()
 
-        # write to storage first because read_metadata needs a file path
-        path = self.storage.write(filename, upload_file.read())
+        # spool to a temporary file (hashing as we go) so that large uploads are
+        # not held in memory and unvalidated files are never visible to readers
+        spooled = self.storage.spool(filename, upload_file.stream)
 
         try:
             # extract metadata
             self.logger.debug("Parsing source distribution for metadata")
-            metadata = self._get_metadata(path, filename)
+            metadata = self._get_metadata(spooled.path, filename)
         except:
-            self.logger.debug("Removing uploaded file: {} on error".format(filename))
-            self.storage.remove(filename)
+            self.logger.debug("Discarding uploaded file: %s on error", filename)
+            self.storage.discard(spooled)
             raise
-        else:
-            self.history.add(metadata["name"], metadata["version"])
-            self.projects.add_metadata(metadata)
 
-    def rebuild(self):
+        metadata[Version.SHA256_DIGEST] = spooled.sha256_digest
+        metadata[Version.MD5_DIGEST] = spooled.md5_digest
+
+        def callback(pipe):
+            self.history.add(metadata["name"], metadata["version"], pipe)
+            self.rendered.invalidate(metadata["name"], pipe)
+
+        self.storage.commit(spooled, filename)
+        self.projects.add_metadata(metadata,
+                                   callback=callback,
+                                   change=self.changelog.change(ChangeLog.UPLOAD,
+                                                                metadata["name"],
+                                                                metadata["version"]))
+
+    def rebuild(self, workers=None, full=False, progress=None):
         """
         Rebuild redis index from file data.
 
-        Rebuilding the index does not currently discard old index data,
-        which could be accomplished by computing the set of all keys
-        before and after the rebuild and removing the difference.
+        Metadata is extracted on a pool of worker processes. Unless a full rebuild
+        is requested, files whose size, modification time, and digest are unchanged
+        since the last rebuild are skipped. Versions (and projects) in the index whose
+        file is gone are removed; versions whose file cannot be read are kept.
+
+        Re-read versions keep their original upload timestamp; digests are recomputed
+        from the file.
+
+        A storage manifest is repaired in the same pass: files it does not (accurately)
+        record, as after losing Redis, are re-read and their entries written from the
+        digests computed by the workers, so no file is digested twice.
+
+        :param workers: number of worker processes (defaults to the number of CPUs)
+        :param full: whether to re-read unchanged files
+        :param progress: optional function called with the number of files done, the
+                         total number of files, and the elapsed time
+        :returns: a dictionary of statistics
         """
-        for path in self.storage:
+        started = time()
+        manifest = self.storage.manifest
+
+        # versions in the index before the rebuild (and their filenames), by canonical name
+        before = {}
+        for project in self.projects.list_projects():
+            for version, filename in project.get_listing().iteritems():
+                before[(canonicalize_name(project.name), version)] = (project.name, filename)
+
+        signatures = self.redis.hgetall(self.signatures_key)
+        # versions in the index after the rebuild, by canonical name
+        after = set()
+        # filenames whose signatures are current
+        current = set()
+        changed = {}
+        # paths whose manifest entries are missing or stale (e.g. lost with the rest of redis)
+        unrecorded = set()
+        entries = {} if manifest is None else manifest.entries()
+        for path in self.storage.walk():
+            filename = basename(path)
+            file_stat = stat(path)
+            signature = [file_stat.st_size, file_stat.st_mtime]
+            if manifest is not None:
+                entry = entries.pop(filename, None)
+                recorded = entry and [entry["path"], entry["size"], entry["modified"]]
+                if recorded == [path] + signature:
+                    signature.append(entry["sha256"])
+                else:
+                    # never matches a previous signature, which includes the digest
+                    unrecorded.add(path)
+            previous = signatures.get(filename)
+            if previous is not None and not full:
+                previous = loads(previous)
+                key = (canonicalize_name(previous["name"]), previous["version"])
+                if previous["signature"] == signature and key in before:
+                    after.add(key)
+                    current.add(filename)
+                    continue
+            changed[path] = signature
+
+        for filename in entries:
+            self.logger.info("Removing orphaned manifest entry for: %s", filename)
+            manifest.remove(filename)
+
+        total = len(changed)
+        stats = dict(files=len(after) + total, skipped=len(after), parsed=0, failed=0, removed=0)
+        self.logger.info("Rebuilding local index: %s files changed, %s unchanged",
+                         total, len(after))
+
+        results = self._extract_all(changed, workers)
+        for done, (path, metadata, digests, error) in enumerate(results, 1):
             filename = basename(path)
-            metadata = self._get_metadata(path, filename)
-            self.projects.add_metadata(metadata)
+            signature = changed[path]
+            if path in unrecorded and digests is not None:
+                size, modified = signature
+                manifest.add(filename, path, size, digests[0], modified=modified)
+                signature = signature + [digests[0]]
+            try:
+                if error is not None:
+                    raise ValueError(error)
+                metadata = self._check_metadata(metadata, filename)
+                metadata[Version.SHA256_DIGEST], metadata[Version.MD5_DIGEST] = digests
+            except (BadRequestError, ValueError) as error:
+                self.logger.warn("Unable to rebuild metadata for: %s: %s", filename, error)
+                stats["failed"] += 1
+            else:
+                name, version = metadata["name"], metadata["version"]
+                key = (canonicalize_name(name), version)
+                change = None
+                if key in before:
+                    self._carry_forward(before[key][0], metadata)
+                else:
+                    change = self.changelog.change(ChangeLog.UPLOAD, name, version)
+                self.projects.add_metadata(metadata, callback=self._invalidate(name), change=change)
+                self.redis.hset(self.signatures_key, filename, dumps(dict(name=name,
+                                                                          version=version,
+                                                                          signature=signature)))
+                after.add(key)
+                current.add(filename)
+                stats["parsed"] += 1
+
+            if progress is not None:
+                progress(done, total, time() - started)
+            if done % self.PROGRESS_INTERVAL == 0:
+                self.logger.info("Rebuilt %s of %s files (%.1f files/second)",
+                                 done, total, done / max(time() - started, 1e-6))
+
+        # remove versions (and, implicitly, projects) that no longer have files
+        for key in set(before) - after:
+            (name, filename), version = before[key], key[1]
+            if filename is not None and self.storage.exists(filename):
+                self.logger.warn("Keeping version: %s %s; its file could not be read",
+                                 name, version)
+                continue
+            self.logger.info("Removing orphaned version: %s %s", name, version)
+            change = self.changelog.change(ChangeLog.REMOVE, name, version)
+            self.projects.remove_metadata(name, version,
+                                          callback=self._invalidate(name),
+                                          change=change)
+            stats["removed"] += 1
+
+        stale = set(signatures) - current
+        if stale:
+            self.redis.hdel(self.signatures_key, *stale)
+
+        stats["elapsed"] = time() - started
+        stats["rate"] = stats["parsed"] / max(stats["elapsed"], 1e-6)
+        self.logger.info("Rebuilt local index: %s", stats)
+        return stats
+
+    def _to_versions(self, listing):
+        """
+        Convert a listing of version to filename and digest into a versions listing.
+
+        Links carry the sha256 digest, if known, so that pip can verify downloads.
+        """
+        # the listing is already ordered, newest first
+        return OrderedDict((filename, format_listing_entry("/local/{}".format(filename), digest))
+                           for filename, digest in listing.itervalues())
+
+    def _invalidate(self, name):
+        """
+        Create a transaction callback that invalidates rendered listings for name.
+        """
+        return lambda pipe: self.rendered.invalidate(name, pipe)
+
+    def _carry_forward(self, name, metadata):
+        """
+        Keep the original upload timestamp of a version that is being re-read.
+        """
+        existing = self.projects.get_metadata(name, metadata["version"])
+        if existing is not None and "_uploaded_timestamp" in existing:
+            metadata["_uploaded_timestamp"] = existing["_uploaded_timestamp"]
+
+    def _extract_all(self, paths, workers):
+        """
+        Extract metadata for paths, in parallel if more than one worker is requested.
+
+        :returns: an iterable of (path, metadata, digests, error) tuples
+        """
+        workers = cpu_count() if workers is None else workers
+        if workers <= 1 or len(paths) <= 1:
+            for path in paths:
+                yield _extract_metadata(path)
+            return
+
+        pool = Pool(workers)
+        try:
+            for result in pool.imap_unordered(_extract_metadata, paths, chunksize=8):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
 
     def _get_metadata(self, path, filename):
-        metadata = read_metadata(path)
+        try:
+            metadata = read_metadata(path, filename)
+        except ValueError as error:
+            self.logger.warn("Aborting upload of: %s; unreadable metadata: %s", filename, error)
+            raise BadRequestError()
+        return self._check_metadata(metadata, filename)
 
+    def _check_metadata(self, metadata, filename):
         # make sure metadata validates
         if not self.validate_metadata(metadata):
             raise BadRequestError()
@@ -150,9 +351,11 @@ class LocalIndex(Index):
             raise BadRequestError()
 
         # make sure metadata is consistent with filename
-        expected_name, expected_version = guess_name_and_version(filename)
-        if metadata["name"] != expected_name or metadata["version"] != expected_version:
-            self.logger.warn("Aborting upload of: {}; conflicting filename and metadata".format(filename))
+        # wheels (and eggs) escape names, so names are compared in canonical form
+        expected = parse_filename(filename)
+        if (canonicalize_name(metadata["name"]) != expected.canonical_name or
+                metadata["version"] != expected.version):
+            self.logger.warn("Aborting upload of: %s; conflicting filename and metadata", filename)
             raise BadRequestError()
 
         # include local path in metadata
@@ -161,3 +364,35 @@ class LocalIndex(Index):
         metadata["_uploaded_timestamp"] = time()
 
         return metadata
+
+
+def _extract_metadata(path):
+    """
+    Read digests and metadata from a stored distribution; runs in rebuild worker processes.
+
+    Digests are computed even if metadata cannot be read, so that the file's manifest
+    entry can be written.
+
+    :returns: a tuple of path, metadata (or None), sha256 and md5 digests (or None), and
+              error message (or None)
+    """
+    try:
+        digests = _digest_file(path)
+    except Exception as error:
+        return path, None, None, "{}".format(error)
+    try:
+        return path, read_metadata(path), digests, None
+    except Exception as error:
+        return path, None, digests, "{}".format(error)
+
+
+def _digest_file(path, chunk_size=64 * 1024):
+    """
+    Compute the sha256 and md5 digests of a file.
+    """
+    sha256_hash, md5_hash = sha256(), md5()
+    with open(path, "rb") as file_:
+        for chunk in iter(lambda: file_.read(chunk_size), b""):
+            sha256_hash.update(chunk)
+            md5_hash.update(chunk)
+    return sha256_hash.hexdigest(), md5_hash.hexdigest()
@@ -0,0 +1,137 @@
+"""
+Implements a Redis manifest of stored distributions.
+"""
+from json import dumps, loads
+from time import time
+
+from cheddar.compat import zadd
+
+
+class StorageManifest(object):
+    """
+    Track stored objects in Redis so that listing and sizing do not walk the file system.
+
+    - Entries are kept in a single hash, mapping name to a JSON entry.
+    - Modification times are kept in a sorted set to find the oldest entries.
+    - Totals (count and size) are maintained incrementally.
+    """
+
+    COUNT = "count"
+    SIZE = "size"
+
+    def __init__(self, redis, logger, key):
+        self.redis = redis
+        self.logger = logger
+        self.key = key
+        self.modified_key = "{}.modified".format(key)
+        self.totals_key = "{}.totals".format(key)
+
+    def get(self, name):
+        """
+        Get the entry for name.
+
+        :returns: a dictionary with name, path, size, sha256, created, and modified or None
+        """
+        entry = self.redis.hget(self.key, name)
+        return None if entry is None else loads(entry)
+
+    def entries(self):
+        """
+        Get all entries.
+
+        :returns: a dictionary mapping name to entry
+        """
+        return {name: loads(entry) for name, entry in self.redis.hgetall(self.key).iteritems()}
+
+    def totals(self):
+        """
+        Get the number and total size of stored objects.
+        """
+        totals = self.redis.hgetall(self.totals_key)
+        return (int(totals.get(StorageManifest.COUNT, 0)),
+                int(totals.get(StorageManifest.SIZE, 0)))
+
+    def oldest(self, count=1):
+        """
+        Get the names of the least recently modified entries.
+        """
+        return self.redis.zrange(self.modified_key, 0, count - 1)
+
+    def add(self, name, path, size, sha256_digest, modified=None):
+        """
+        Add or replace an entry.
+        """
+        now = time()
+        modified = now if modified is None else modified
+
+        def _add(pipe):
+            previous = pipe.hget(self.key, name)
+            previous = None if previous is None else loads(previous)
+
+            entry = dict(name=name,
+                         path=path,
+                         size=size,
+                         sha256=sha256_digest,
+                         created=now if previous is None else previous["created"],
+                         modified=modified)
+
+            pipe.multi()
+            pipe.hset(self.key, name, dumps(entry))
+            zadd(pipe, self.modified_key, {name: modified})
+            if previous is None:
+                pipe.hincrby(self.totals_key, StorageManifest.COUNT, 1)
+                pipe.hincrby(self.totals_key, StorageManifest.SIZE, size)
+            else:
+                pipe.hincrby(self.totals_key, StorageManifest.SIZE, size - previous["size"])
+
+        self.redis.transaction(_add, self.key)
+        self.logger.debug("Added manifest entry for: %s", name)
+
+    def remove(self, name):
+        """
+        Remove an entry, if any.
+        """
+        def _remove(pipe):
+            previous = pipe.hget(self.key, name)
+            if previous is None:
+                return
+            previous = loads(previous)
+
+            pipe.multi()
+            pipe.hdel(self.key, name)
+            pipe.zrem(self.modified_key, name)
+            pipe.hincrby(self.totals_key, StorageManifest.COUNT, -1)
+            pipe.hincrby(self.totals_key, StorageManifest.SIZE, -previous["size"])
+
+        self.redis.transaction(_remove, self.key)
+        self.logger.debug("Removed manifest entry for: %s", name)
+
+    def reconcile(self, files, digest):
+        """
+        Repair drift between the manifest and the file system.
+
+        :param files: an iterable of (name, path, size, modified) tuples for stored files
+        :param digest: a function that computes the sha256 digest of a path
+        :returns: a dictionary counting added, updated, and removed entries
+        """
+        entries = self.entries()
+        result = dict(added=0, updated=0, removed=0)
+
+        for name, path, size, modified in files:
+            entry = entries.pop(name, None)
+            if entry is None:
+                self.logger.info("Adding missing manifest entry for: %s", name)
+                result["added"] += 1
+            elif (entry["path"], entry["size"], entry["modified"]) != (path, size, modified):
+                self.logger.info("Updating stale manifest entry for: %s", name)
+                result["updated"] += 1
+            else:
+                continue
+            self.add(name, path, size, digest(path), modified=modified)
+
+        for name in entries:
+            self.logger.info("Removing orphaned manifest entry for: %s", name)
+            self.remove(name)
+            result["removed"] += 1
+
+        return result
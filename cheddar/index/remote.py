@@ -1,17 +1,22 @@
 """
 Implements a remote (proxy) package index.
 """
+from collections import OrderedDict
 from json import dumps, loads
+from multiprocessing.pool import ThreadPool
+from os import getpid
 from os.path import abspath, basename, join
+from threading import Lock
 from urllib import quote
 from urlparse import urlsplit, urlunsplit
 
-from BeautifulSoup import BeautifulSoup
 from requests import codes, ConnectionError, get, Timeout
 
+from cheddar.changelog import ChangeLog
 from cheddar.exceptions import NotFoundError
 from cheddar.index.index import Index
-from cheddar.model.versions import guess_name_and_version
+from cheddar.metrics import NULL_METRICS
+from cheddar.model.versions import canonicalize_name, parse_filename, sort_versions
 
 
 class RemoteIndex(Index):
@@ -25,6 +30,7 @@ class RemoteIndex(Index):
         self.index_url = app.config["INDEX_URL"]
         self.get_timeout = app.config["GET_TIMEOUT"]
         self.logger = app.logger
+        self.metrics = app.metrics
 
     def get_projects(self):
         """
@@ -38,10 +44,10 @@ class RemoteIndex(Index):
         """
         url = "{}/{}".format(self.index_url, name)
 
-        versions = {name: build_remote_path(href, location)
-                    for name, href, location in self._iter_listings(url, name)}
+        versions = sort_versions({name: build_remote_path(href, location)
+                                  for name, href, location in self._iter_listings(url, name)})
 
-        self.logger.debug("Obtained remote version listing for: {}: {}".format(name, versions))
+        self.logger.debug("Obtained remote version listing for: %s: %s", name, versions)
         return versions
 
     def get_metadata(self, name, version):
@@ -54,9 +60,9 @@ class RemoteIndex(Index):
         """
         Request distribution data for remote location.
         """
-        self.logger.info("Getting remote distribution: {}".format(location))
+        self.logger.info("Getting remote distribution: %s", location)
 
-        response = fetch_url(location, self.get_timeout, self.logger)
+        response = fetch_url(location, self.get_timeout, self.logger, self.metrics)
 
         # don't log binary distribution content (.tar.gz, .zip, etc.), even at debug
         return response.content, response.headers["Content-Type"]
@@ -86,30 +92,30 @@ class RemoteIndex(Index):
         Interpret version links and either yield (name, href, location) tuples
         or recursively spider to new links.
         """
-        self.logger.info("Getting remote version listing for: {}".format(name))
+        self.logger.info("Getting remote version listing for: %s", name)
 
-        response = fetch_url(url, self.get_timeout, self.logger)
+        response = fetch_url(url, self.get_timeout, self.logger, self.metrics)
 
         # Record the actual hostname used in case of redirection
         location = get_request_location(response, url)
-        self.logger.debug("Index location was: {}".format(location))
+        self.logger.debug("Index location was: %s", location)
 
         for link in iter_version_links(response.text, name):
             if isinstance(link, tuple):
                 # Direct link
-                name, href = link
-                yield name, href, location
+                filename, href = link
+                yield filename, href, location
             else:
                 # Recursive link
                 if depth <= RemoteIndex.MAX_DEPTH:
                     try:
-                        self.logger.info("Spidering to: {}".format(link))
+                        self.logger.info("Spidering to: %s", link)
                         for listing in self._iter_listings(link, name, depth + 1):
                             yield listing
                     except NotFoundError:
-                        self.logger.debug("Unable to spider to: {}".format(link))
+                        self.logger.debug("Unable to spider to: %s", link)
                 else:
-                    self.logger.info("Reached max depth; aborted spidering to: {}".format(link))
+                    self.logger.info("Reached max depth; aborted spidering to: %s", link)
 
 
 class CachedRemoteIndex(RemoteIndex):
@@ -117,15 +123,36 @@ class CachedRemoteIndex(RemoteIndex):
     Cache remote package data.
 
     - Since version data may change frequently, it is cached in Redis for simple expiration.
+      Listings are cached as a list of (filename, path) pairs, newest first, so that
+      they never need to be sorted when read.
     - Distribution files are saved to the file system for easy inspection and backup.
     """
     def __init__(self, app):
         super(CachedRemoteIndex, self).__init__(app)
         self.redis = app.redis
         self.storage = app.remote_storage
+        self.rendered = app.rendered
+        self.changelog = app.changelog
         self.versions_short_ttl = app.config["VERSIONS_SHORT_TTL"]
         self.versions_long_ttl = app.config["VERSIONS_LONG_TTL"]
+        self.batch_workers = app.config["BATCH_FETCH_WORKERS"]
         self.logger = app.logger
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = Lock()
+
+    def _get_pool(self):
+        """
+        Get the pool that fetches listings from the remote index, shared by all requests.
+
+        The pool is created on first use, and again in a forked worker, whose copy of
+        the parent's pool has no threads.
+        """
+        with self._pool_lock:
+            if self._pool is None or self._pool_pid != getpid():
+                self._pool = ThreadPool(self.batch_workers)
+                self._pool_pid = getpid()
+            return self._pool
 
     def _key(self, name):
         return "cheddar.remote.{}".format(name)
@@ -152,15 +179,48 @@ class CachedRemoteIndex(RemoteIndex):
         versions = self.redis.get(self._key(name))
         if versions is None:
             # not cached
-            self.logger.debug("Cached index for: {} was not found".format(name))
+            self.logger.debug("Cached index for: %s was not found", name)
             return None, False
 
         ttl = self.redis.ttl(self._key(name))
-        self.logger.debug("Cached index for: {} has a ttl of: {}".format(name, ttl))
+        return self._parse_cached_index(name, versions, ttl)
+
+    def _get_cached_indexes(self, names):
+        """
+        Get the cached values of many distributions in one round trip.
+
+        :returns: a dictionary mapping name to a tuple of the cached value and whether it
+                  was expired
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        for name in names:
+            pipe.get(self._key(name))
+            pipe.ttl(self._key(name))
+        results = pipe.execute()
+
+        cached = {}
+        for index, name in enumerate(names):
+            versions, ttl = results[2 * index], results[2 * index + 1]
+            if versions is None:
+                self.logger.debug("Cached index for: %s was not found", name)
+                cached[name] = None, False
+            else:
+                cached[name] = self._parse_cached_index(name, versions, ttl)
+        return cached
+
+    def _parse_cached_index(self, name, versions, ttl):
+        self.logger.debug("Cached index for: %s has a ttl of: %s", name, ttl)
         expired = self._is_expired(ttl)
-        self.logger.debug("Cached index for: {} was expired: {}".format(name, expired))
+        self.logger.debug("Cached index for: %s was expired: %s", name, expired)
 
-        return loads(versions), expired
+        versions = loads(versions)
+        if isinstance(versions, dict):
+            # negative results and listings cached by earlier releases
+            versions = sort_versions(versions)
+        else:
+            versions = OrderedDict(versions)
+
+        return versions, expired
 
     def _save_negative_index(self, name):
         """
@@ -169,12 +229,20 @@ class CachedRemoteIndex(RemoteIndex):
         Caching a negative result ensures that we don't keep querying the remote
         index for something that truly does not exist.
         """
-        self.logger.debug("Caching negative versions listing for: {}".format(name))
-        self.redis.setex(self._key(name), time=int(self.versions_long_ttl), value=dumps({}))
+        self.logger.debug("Caching negative versions listing for: %s", name)
+        pipe = self.redis.pipeline()
+        pipe.setex(self._key(name), time=int(self.versions_long_ttl), value=dumps({}))
+        self.rendered.invalidate(name, pipe, projects=False)
+        pipe.execute()
 
     def _save_index(self, name, versions):
-        self.logger.debug("Caching positive versions listing for: {}".format(name))
-        self.redis.setex(self._key(name), time=int(self.versions_long_ttl), value=dumps(versions))
+        self.logger.debug("Caching positive versions listing for: %s", name)
+        if not isinstance(versions, OrderedDict):
+            versions = sort_versions(versions)
+        pipe = self.redis.pipeline()
+        pipe.setex(self._key(name), time=int(self.versions_long_ttl), value=dumps(versions.items()))
+        self.rendered.invalidate(name, pipe, projects=False)
+        pipe.execute()
 
     def get_versions(self, name):
         """
@@ -182,36 +250,83 @@ class CachedRemoteIndex(RemoteIndex):
 
         Currently, does not implement negative caching.
         """
-        self.logger.info("Checking for cached versions listing for: {}".format(name))
+        self.logger.info("Checking for cached versions listing for: %s", name)
 
         # check cache
         cached_versions, cached_expired = self._get_cached_index(name)
 
+        self._count_listing(cached_versions, cached_expired)
+
         # is it cached and recent enough?
         if cached_versions is not None and not cached_expired:
             # yes, return it
-            self.logger.debug("Found cached versions listing for: {}".format(name))
+            self.logger.debug("Found cached versions listing for: %s", name)
             return cached_versions
 
         # need to refresh
+        return self._refresh_versions(name, cached_versions)
+
+    def get_versions_batch(self, names):
+        """
+        Adds redis caching to versions listings for many projects.
+
+        Cached listings are read in one round trip; listings that are missing or
+        expired are fetched from the remote index in parallel, on a pool shared by
+        all requests. A project that fails to fetch gets its error as its result.
+        """
+        self.logger.info("Checking for cached versions listings for: %s projects", len(names))
+
+        results = {}
+        refresh = {}
+        for name, (cached_versions, cached_expired) in self._get_cached_indexes(names).iteritems():
+            self._count_listing(cached_versions, cached_expired)
+            if cached_versions is not None and not cached_expired:
+                results[name] = cached_versions
+            else:
+                refresh[name] = cached_versions
+
+        if not refresh:
+            return results
+
+        def fetch(name):
+            try:
+                return name, self._refresh_versions(name, refresh[name])
+            except NotFoundError as error:
+                return name, error
+            except Exception as error:
+                self.logger.warn("Unable to refresh versions listing for: %s", name, exc_info=True)
+                return name, error
+
+        self.logger.info("Refreshing versions listings for: %s projects", len(refresh))
+        results.update(self._get_pool().map(fetch, refresh.keys()))
+        return results
+
+    def _refresh_versions(self, name, cached_versions):
+        """
+        Refresh a versions listing from the remote index, falling back to an expired cached value.
+        """
         try:
             computed_versions = super(CachedRemoteIndex, self).get_versions(name)
         except NotFoundError as error:
             if error.status_code == codes.not_found:
                 # no value
                 self._save_negative_index(name)
+                if cached_versions:
+                    self.changelog.record(ChangeLog.REFRESH, name)
                 raise
             elif cached_versions is None:
                 # no cached value
                 raise
             else:
                 # fall back to cached value
-                self.logger.debug("Returning expired cached versions: {}".format(cached_versions))
+                self.logger.debug("Returning expired cached versions: %s", cached_versions)
                 return cached_versions
         else:
             # found
             self._save_index(name, computed_versions)
-            self.logger.debug("Returning new versions: {}".format(computed_versions))
+            if computed_versions != cached_versions:
+                self.changelog.record(ChangeLog.REFRESH, name)
+            self.logger.debug("Returning new versions: %s", computed_versions)
             return computed_versions
 
     def get_distribution(self, location, **kwargs):
@@ -220,17 +335,35 @@ class CachedRemoteIndex(RemoteIndex):
         """
         cached = self.storage.read(location)
         if cached is not None:
-            self.logger.debug("Found cached distribution for: {}".format(location))
+            self.logger.debug("Found cached distribution for: %s", location)
+            self.metrics.increment("cheddar_remote_distribution_bytes_total", len(cached[0]),
+                                   source="cache")
             return cached
 
         content_data, content_type = super(CachedRemoteIndex, self).get_distribution(location,
                                                                                      **kwargs)
+        self.metrics.increment("cheddar_remote_distribution_bytes_total", len(content_data),
+                               source="upstream")
 
-        self.logger.debug("Caching distribution for: {}".format(location))
+        self.logger.debug("Caching distribution for: %s", location)
         self.storage.write(location, content_data)
 
         return content_data, content_type
 
+    def _count_listing(self, cached_versions, cached_expired):
+        """
+        Count a cache lookup as a hit, a negative hit, stale, or a miss.
+        """
+        if cached_versions is None:
+            result = "miss"
+        elif cached_expired:
+            result = "stale"
+        elif not cached_versions:
+            result = "negative"
+        else:
+            result = "hit"
+        self.metrics.increment("cheddar_remote_listings_total", result=result)
+
 
 def get_absolute_path(url, path):
     """
@@ -311,12 +444,15 @@ def iter_version_links(html, name):
     Either yields hrefs to be recursively searches or tuples of (name, href)
     that match the given name.
     """
+    # deferred: only listing refreshes parse HTML
+    from BeautifulSoup import BeautifulSoup
     soup = BeautifulSoup(html)
+    canonical_name = canonicalize_name(name)
     for node in soup.findAll("a"):
         if node.get("href") is None:
             continue
         try:
-            guessed_name, _ = guess_name_and_version(node.text)
+            parsed = parse_filename(node.text)
         except ValueError:
             href = node["href"]
             for extension in [".tar.gz", ".zip"]:
@@ -329,28 +465,34 @@ def iter_version_links(html, name):
                     yield href
             # else couldn't parse name and version, probably the wrong kind of link
         else:
-            if guessed_name.replace("_", "-").lower() != name.replace("_", "-").lower():
+            if parsed.canonical_name != canonical_name:
                 continue
             yield node.text, node["href"]
 
 
-def fetch_url(url, timeout, logger):
+def fetch_url(url, timeout, logger, metrics=NULL_METRICS):
     """
     Get a URL, handling timeouts and connection errors.
 
+    :param metrics: optional `Metrics` observing latency and errors per host
     :raises: NotFoundError: if get fails to return 200
     """
+    host = urlsplit(url).netloc
     try:
-        response = get(url, timeout=timeout)
+        with metrics.timer("cheddar_upstream_request_duration_seconds", host=host):
+            response = get(url, timeout=timeout)
     except Timeout:
-        logger.info("Timed out getting url: {}".format(url))
+        logger.info("Timed out getting url: %s", url)
+        metrics.increment("cheddar_upstream_errors_total", host=host, reason="timeout")
         raise NotFoundError()
     except ConnectionError:
-        logger.info("Unable to connect to url: {}".format(url))
+        logger.info("Unable to connect to url: %s", url)
+        metrics.increment("cheddar_upstream_errors_total", host=host, reason="connection")
         raise NotFoundError()
 
     if response.status_code != codes.ok:
-        logger.info("Unexpected status code: {} getting url: {}".format(response.status_code, url))
+        logger.info("Unexpected status code: %s getting url: %s", response.status_code, url)
+        metrics.increment("cheddar_upstream_errors_total", host=host, reason=response.status_code)
         raise NotFoundError(response.status_code)
 
     return response
@@ -1,33 +1,67 @@
 """
 Implements distribution file storage.
 """
-from os import makedirs, remove, walk
-from os.path import basename, exists, isdir, join
-
-from magic import from_buffer
+from collections import namedtuple
+from errno import EEXIST
+from hashlib import md5, sha256
+from os import fdopen, makedirs, remove, rename, stat, walk
+from os.path import basename, exists, getmtime, isdir, join
+from tempfile import mkstemp
 
+from cheddar.metrics import NULL_METRICS
 from cheddar.model.versions import is_pre_release
 
 
+SpooledFile = namedtuple("SpooledFile", ["path", "size", "sha256_digest", "md5_digest"])
+
+
+def _signature(path):
+    """
+    Identify a file's current content cheaply (by inode, size, and modification time).
+
+    :returns: the signature or None if the file does not exist
+    """
+    try:
+        file_stat = stat(path)
+    except OSError:
+        return None
+    return file_stat.st_ino, file_stat.st_size, file_stat.st_mtime
+
+
 class DistributionStorage(object):
     """
     File system storage with release/pre-release partitioning.
     """
 
-    def __init__(self, base_dir, logger):
+    # How many bytes to read at a time when spooling streams?
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, base_dir, logger, cache=None, manifest=None, metrics=None, name=None):
         """
         Initialize storage.
 
         :param base_dir: root directory for storage
+        :param cache: optional `LRUCache` of (content data, content type, file signature) for hot
+                      entries; entries are checked against the file's signature before use, so
+                      that writes and removals made by other processes are seen
+        :param manifest: optional `StorageManifest` tracking stored entries
+        :param metrics: optional `Metrics` counting reads and bytes read
+        :param name: name of this storage in metrics (e.g. "local" or "remote")
         """
         self.logger = logger
+        self.metrics = NULL_METRICS if metrics is None else metrics
+        self.name = name or basename(base_dir)
+        self.cache = cache
+        self.manifest = manifest
         self.base_dir = base_dir
         self.release_dir = join(base_dir, "releases")
         self.pre_release_dir = join(base_dir, "pre-releases")
-        self._make_base_dirs()
+        # spooled files live under the base dir so that commits are atomic renames
+        self.tmp_dir = join(base_dir, "tmp")
+        # base dirs are created by the first write (or spool), not at startup
 
     def exists(self, name):
-        return exists(self.compute_path(name))
+        return self._find_path(name) is not None
 
     def read(self, name):
         """
@@ -35,15 +69,33 @@ class DistributionStorage(object):
 
         :returns: content data and content type, as a tuple
         """
-        if not self.exists(name):
-            self.logger.debug("No file exists for: {}".format(name))
+        path = self._find_path(name)
+        signature = None if path is None else _signature(path)
+        if signature is None:
+            self.logger.debug("No file exists for: %s", name)
+            self._invalidate(name)
+            self._count_read("missing")
             return None
 
-        with open(self.compute_path(name)) as file_:
+        if self.cache is not None:
+            cached = self.cache.get(basename(name))
+            if cached is not None and cached[2] == signature:
+                self.logger.debug("Found cached content for: %s", name)
+                self._count_read("memory", len(cached[0]))
+                return cached[:2]
+
+        # libmagic is loaded on the first read from disk rather than at startup
+        from magic import from_buffer
+        with open(path) as file_:
             content_data = file_.read()
             content_type = from_buffer(content_data, mime=True)
-            self.logger.debug("Computed content type: {} for: {}".format(content_type, name))
-            return content_data, content_type
+            self.logger.debug("Computed content type: %s for: %s", content_type, name)
+
+        if self.cache is not None:
+            self.cache.put(basename(name), (content_data, content_type, signature))
+
+        self._count_read("disk", len(content_data))
+        return content_data, content_type
 
     def write(self, name, data):
         """
@@ -51,21 +103,73 @@ class DistributionStorage(object):
         """
         self._make_base_dirs()
         path = self.compute_path(name)
+        self._invalidate(name)
         with open(path, "wb") as file_:
             file_.write(data)
-        self.logger.debug("Wrote file for: {}".format(name))
+        self.logger.debug("Wrote file for: %s", name)
+        if self.manifest is not None:
+            self.manifest.add(basename(name), path, len(data), sha256(data).hexdigest(),
+                              modified=getmtime(path))
+        return path
+
+    def spool(self, name, stream):
+        """
+        Copy a stream to a temporary file, hashing its content along the way.
+
+        The stream is consumed in chunks so that large uploads are never held
+        in memory. The temporary file keeps the extension of name so that it
+        may be inspected before it is committed.
+
+        :returns: a `SpooledFile`
+        """
+        self._make_base_dirs()
+        fd, path = mkstemp(suffix="-{}".format(basename(name)), dir=self.tmp_dir)
+        sha256_hash, md5_hash, size = sha256(), md5(), 0
+        try:
+            with fdopen(fd, "wb") as file_:
+                for chunk in iter(lambda: stream.read(self.CHUNK_SIZE), b""):
+                    file_.write(chunk)
+                    sha256_hash.update(chunk)
+                    md5_hash.update(chunk)
+                    size += len(chunk)
+        except:
+            self._discard(path)
+            raise
+        self.logger.debug("Spooled %s bytes for: %s", size, name)
+        return SpooledFile(path, size, sha256_hash.hexdigest(), md5_hash.hexdigest())
+
+    def commit(self, spooled, name):
+        """
+        Atomically move a spooled file into place.
+        """
+        path = self.compute_path(name)
+        self._invalidate(name)
+        rename(spooled.path, path)
+        self.logger.debug("Committed file for: %s", name)
+        if self.manifest is not None:
+            self.manifest.add(basename(name), path, spooled.size, spooled.sha256_digest,
+                              modified=getmtime(path))
         return path
 
+    def discard(self, spooled):
+        """
+        Remove a spooled file that will not be committed.
+        """
+        self._discard(spooled.path)
+
     def remove(self, name):
         """
-        Write entry to storage.
+        Remove entry from storage.
         """
+        self._invalidate(name)
+        if self.manifest is not None:
+            self.manifest.remove(basename(name))
         try:
-            remove(self.compute_path(name))
-            self.logger.debug("Removed file for: {}".format(name))
+            remove(self._find_path(name) or self.compute_path(name))
+            self.logger.debug("Removed file for: %s", name)
             return True
         except OSError:
-            self.logger.debug("Unable to remove file for: {}".format(name))
+            self.logger.debug("Unable to remove file for: %s", name)
             return False
 
     def compute_path(self, name):
@@ -75,20 +179,123 @@ class DistributionStorage(object):
         Path incorporates "pre-release" or "release" to easily
         differentiate released distributions for backup.
         """
-        base_dir = self.pre_release_dir if is_pre_release(name) else self.release_dir
+        base_dir = self.pre_release_dir if is_pre_release(basename(name)) else self.release_dir
         path = join(base_dir, basename(name))
-        self.logger.debug("Computed path: {} for: {}".format(path, name))
+        self.logger.debug("Computed path: %s for: %s", path, name)
         return path
 
-    def __iter__(self):
-        for dirpath, _, filenames in walk(self.base_dir):
+    def stats(self):
+        """
+        Compute the number and total size of stored entries.
+
+        Uses the manifest, if any, instead of walking the file system.
+        """
+        if self.manifest is not None:
+            return self.manifest.totals()
+
+        sizes = [stat(path).st_size for path in self.walk()]
+        return len(sizes), sum(sizes)
+
+    def oldest(self, count=1):
+        """
+        Get the paths of the least recently modified entries.
+
+        Uses the manifest, if any, instead of walking the file system.
+        """
+        if self.manifest is not None:
+            return [self.compute_path(name) for name in self.manifest.oldest(count)]
+
+        return sorted(self.walk(), key=getmtime)[:count]
+
+    def reconcile(self):
+        """
+        Repair drift between the manifest and the file system.
+
+        :returns: a dictionary counting added, updated, and removed entries
+        """
+        if self.manifest is None:
+            raise ValueError("Storage does not have a manifest")
+
+        def iter_files():
+            for path in self.walk():
+                file_stat = stat(path)
+                yield basename(path), path, file_stat.st_size, file_stat.st_mtime
+
+        return self.manifest.reconcile(iter_files(), self._digest)
+
+    def walk(self):
+        """
+        Iterate through the paths of all stored entries on the file system.
+        """
+        for dirpath, dirnames, filenames in walk(self.base_dir):
+            if dirpath == self.base_dir and basename(self.tmp_dir) in dirnames:
+                # never expose partially written or unvalidated files
+                dirnames.remove(basename(self.tmp_dir))
             for filename in filenames:
                 yield join(dirpath, filename)
 
+    def __iter__(self):
+        """
+        Iterate through the paths of all stored entries.
+
+        Uses the manifest, if any, instead of walking the file system.
+        """
+        if self.manifest is None:
+            return self.walk()
+        return (entry["path"] for entry in self.manifest.entries().itervalues())
+
+    def _digest(self, path):
+        """
+        Compute the sha256 digest of a stored file.
+        """
+        sha256_hash = sha256()
+        with open(path, "rb") as file_:
+            for chunk in iter(lambda: file_.read(self.CHUNK_SIZE), b""):
+                sha256_hash.update(chunk)
+        return sha256_hash.hexdigest()
+
+    def _find_path(self, name):
+        """
+        Find the stored path for name, if any.
+
+        Earlier releases misclassified some filenames (e.g. wheels) as pre-releases,
+        so the other partition is checked as well.
+        """
+        path = self.compute_path(name)
+        if exists(path):
+            return path
+        other_dir = self.release_dir if is_pre_release(basename(name)) else self.pre_release_dir
+        path = join(other_dir, basename(name))
+        return path if exists(path) else None
+
+    def _count_read(self, result, size=0):
+        self.metrics.increment("cheddar_storage_reads_total", storage=self.name, result=result)
+        if size:
+            self.metrics.increment("cheddar_storage_read_bytes_total", size,
+                                   storage=self.name, source=result)
+
+    def _discard(self, path):
+        try:
+            remove(path)
+        except OSError:
+            self.logger.debug("Unable to discard spooled file: %s", path)
+
+    def _invalidate(self, name):
+        """
+        Discard any cached content for name.
+        """
+        if self.cache is not None:
+            self.cache.invalidate(basename(name))
+
     def _make_base_dirs(self):
         """
         Ensure that base dirs exists.
         """
-        for dir_ in [self.release_dir, self.pre_release_dir]:
+        for dir_ in [self.release_dir, self.pre_release_dir, self.tmp_dir]:
             if not isdir(dir_):
-                makedirs(dir_)
+                try:
+                    makedirs(dir_)
+                except OSError as error:
+                    # another worker (or thread) created it first
+                    if error.errno != EEXIST:
+                        raise
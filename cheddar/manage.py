@@ -0,0 +1,137 @@
+"""
+Management commands.
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from getpass import getpass
+from sys import exit
+
+from cheddar.app import create_app
+
+
+def reconcile(app, args):
+    """
+    Repair storage manifests against the file system.
+    """
+    for name, storage in [("local", app.local_storage), ("remote", app.remote_storage)]:
+        if storage.manifest is None:
+            print "No manifest configured for {} storage".format(name)
+            continue
+        result = storage.reconcile()
+        count, size = storage.stats()
+        print "Reconciled {} storage: added {added}, updated {updated}, removed {removed}".format(
+            name, **result)
+        print "{} storage contains {} files totaling {} bytes".format(
+            name.capitalize(), count, size)
+
+
+def migrate(app, args):
+    """
+    Convert local metadata stored under legacy keys.
+    """
+    migrated = app.projects.migrate()
+    print "Migrated {} versions".format(migrated)
+
+
+def rebuild(app, args):
+    """
+    Rebuild the local index from stored distributions.
+    """
+    def progress(done, total, elapsed):
+        if done % 100 == 0 or done == total:
+            print "Rebuilt {} of {} files ({:.1f} files/second)".format(
+                done, total, done / max(elapsed, 1e-6))
+
+    stats = app.index.local.rebuild(workers=args.workers, full=args.full, progress=progress)
+    print ("Parsed {parsed}, skipped {skipped}, failed {failed}, and removed {removed} "
+           "in {elapsed:.1f} seconds").format(**stats)
+
+
+def add_user(app, args):
+    """
+    Add a user or change a user's password.
+    """
+    password = args.password
+    if password is None:
+        password = getpass("Password for {}: ".format(args.username))
+        if password != getpass("Confirm password: "):
+            exit("Passwords do not match")
+    app.users.set_password(args.username, password)
+    print "Set password for {}".format(args.username)
+
+
+def remove_user(app, args):
+    """
+    Remove a user.
+    """
+    if not app.users.remove(args.username):
+        exit("No such user: {}".format(args.username))
+    print "Removed {}".format(args.username)
+
+
+def list_users(app, args):
+    """
+    List users.
+    """
+    for username in app.users.list_users():
+        print username
+
+
+def upgrade_users(app, args):
+    """
+    Hash passwords still stored in plaintext.
+    """
+    print "Hashed {} plaintext passwords".format(app.users.upgrade())
+
+
+def main():
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers()
+
+    reconcile_parser = subparsers.add_parser(
+        "reconcile",
+        help="Repair storage manifests against the file system")
+    reconcile_parser.set_defaults(func=reconcile)
+
+    migrate_parser = subparsers.add_parser("migrate",
+                                           help="Convert local metadata stored under legacy keys")
+    migrate_parser.set_defaults(func=migrate)
+
+    rebuild_parser = subparsers.add_parser("rebuild",
+                                           help="Rebuild the local index from stored distributions")
+    rebuild_parser.add_argument("--workers",
+                                type=int,
+                                default=None,
+                                help="Number of worker processes (defaults to the number of CPUs)")
+    rebuild_parser.add_argument("--full",
+                                action="store_true",
+                                default=False,
+                                help="Re-read files that have not changed since the last rebuild")
+    rebuild_parser.set_defaults(func=rebuild)
+
+    user_parser = subparsers.add_parser("user", help="Manage upload credentials")
+    user_subparsers = user_parser.add_subparsers()
+
+    add_user_parser = user_subparsers.add_parser("add",
+                                                 help="Add a user or change a user's password")
+    add_user_parser.add_argument("username")
+    add_user_parser.add_argument("--password",
+                                 default=None,
+                                 help="Password (prompted for if omitted)")
+    add_user_parser.set_defaults(func=add_user)
+
+    remove_user_parser = user_subparsers.add_parser("remove", help="Remove a user")
+    remove_user_parser.add_argument("username")
+    remove_user_parser.set_defaults(func=remove_user)
+
+    list_users_parser = user_subparsers.add_parser("list", help="List users")
+    list_users_parser.set_defaults(func=list_users)
+
+    upgrade_users_parser = user_subparsers.add_parser(
+        "upgrade",
+        help="Hash passwords still stored in plaintext")
+    upgrade_users_parser.set_defaults(func=upgrade_users)
+
+    args = parser.parse_args()
+
+    app = create_app()
+    args.func(app, args)
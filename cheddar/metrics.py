@@ -0,0 +1,213 @@
+"""
+Collect metrics and expose them in the Prometheus text format.
+"""
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+from redis import RedisError
+
+
+# Histogram buckets (in seconds) suitable for request and upstream latencies
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+COUNTER = "counter"
+HISTOGRAM = "histogram"
+
+
+def format_sample(name, labels):
+    """
+    Format a sample name and labels (e.g. 'foo_total{result="hit"}').
+    """
+    if not labels:
+        return name
+    pairs = ('{}="{}"'.format(key, _escape(value)) for key, value in sorted(labels.iteritems()))
+    return "{}{{{}}}".format(name, ",".join(pairs))
+
+
+def _escape(value):
+    return unicode(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class NullMetrics(object):
+    """
+    Metrics that go nowhere.
+    """
+
+    def increment(self, name, value=1, **labels):
+        pass
+
+    def observe(self, name, value, **labels):
+        pass
+
+    @contextmanager
+    def timer(self, name, **labels):
+        yield
+
+    def maybe_flush(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def discard(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class Metrics(NullMetrics):
+    """
+    Metrics registry, aggregated across processes in Redis.
+
+    Counters and histograms accumulate in process and are periodically flushed
+    to a single Redis hash as increments (HINCRBYFLOAT), so every worker process
+    contributes to the same totals. Hash fields are Prometheus samples, which
+    makes rendering a matter of reading the hash back.
+    """
+
+    def __init__(self, redis, logger, flush_interval=10, buckets=DEFAULT_BUCKETS):
+        """
+        Initialize metrics.
+
+        :param flush_interval: minimum number of seconds between flushes to Redis
+        :param buckets: histogram bucket upper bounds
+        """
+        self.redis = redis
+        self.logger = logger
+        self.flush_interval = flush_interval
+        self.buckets = buckets
+        self.key = "cheddar.metrics"
+        self.types_key = "cheddar.metrics:types"
+        self.last_flush = time()
+        self._pending = {}
+        self._types = {}
+        self._lock = Lock()
+
+    def increment(self, name, value=1, **labels):
+        """
+        Increment a counter.
+        """
+        sample = format_sample(name, labels)
+        with self._lock:
+            self._types[name] = COUNTER
+            self._pending[sample] = self._pending.get(sample, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Observe a value (e.g. a duration in seconds) in a histogram.
+        """
+        samples = [format_sample("{}_bucket".format(name), dict(labels, le=repr(bound)))
+                   for bound in self.buckets if value <= bound]
+        samples.append(format_sample("{}_bucket".format(name), dict(labels, le="+Inf")))
+        samples.append(format_sample("{}_count".format(name), labels))
+        sum_sample = format_sample("{}_sum".format(name), labels)
+        with self._lock:
+            self._types[name] = HISTOGRAM
+            for sample in samples:
+                self._pending[sample] = self._pending.get(sample, 0) + 1
+            self._pending[sum_sample] = self._pending.get(sum_sample, 0) + value
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Observe the duration of a block in a histogram.
+        """
+        started = time()
+        try:
+            yield
+        finally:
+            self.observe(name, time() - started, **labels)
+
+    def maybe_flush(self):
+        """
+        Flush if the flush interval has passed.
+        """
+        if time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Add metrics accumulated in this process to the totals in Redis.
+
+        If Redis is unavailable, the samples are kept for the next flush.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            types, self._types = self._types, {}
+            self.last_flush = time()
+
+        if not pending:
+            return
+
+        pipe = self.redis.pipeline(transaction=False)
+        for sample, value in pending.iteritems():
+            pipe.hincrbyfloat(self.key, sample, value)
+        pipe.hmset(self.types_key, types)
+        try:
+            pipe.execute()
+        except RedisError as error:
+            self.logger.warn("Unable to flush %s metric samples: %s", len(pending), error)
+            with self._lock:
+                for sample, value in pending.iteritems():
+                    self._pending[sample] = self._pending.get(sample, 0) + value
+                for name, type_ in types.iteritems():
+                    self._types.setdefault(name, type_)
+            return
+        self.logger.debug("Flushed %s metric samples", len(pending))
+
+    def discard(self):
+        """
+        Drop metrics accumulated in this process without flushing them.
+
+        Called in forked workers, which would otherwise each flush their parent's pending metrics.
+        """
+        self._lock = Lock()
+        self._pending = {}
+        self._types = {}
+        self.last_flush = time()
+
+    def render(self):
+        """
+        Render the totals in Redis in the Prometheus text format.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self.key)
+        pipe.hgetall(self.types_key)
+        samples, types = pipe.execute()
+
+        families = {}
+        for sample, value in samples.iteritems():
+            families.setdefault(self._family(sample, types), []).append((sample, value))
+
+        lines = []
+        for family in sorted(families):
+            lines.append("# TYPE {} {}".format(family, types.get(family, "untyped")))
+            for sample, value in sorted(families[family], key=_sample_sort_key):
+                lines.append("{} {}".format(sample, _format_value(value)))
+        return "".join("{}\n".format(line) for line in lines)
+
+    def _family(self, sample, types):
+        name = sample.split("{", 1)[0]
+        for suffix in ("_bucket", "_count", "_sum"):
+            if name.endswith(suffix) and types.get(name[:-len(suffix)]) == HISTOGRAM:
+                return name[:-len(suffix)]
+        return name
+
+
+def _sample_sort_key(item):
+    """
+    Sort samples by name and labels, with histogram buckets in increasing order.
+    """
+    sample = item[0]
+    if 'le="' not in sample:
+        return sample, 0.0
+    head, rest = sample.split('le="', 1)
+    bound, tail = rest.split('"', 1)
+    return head + tail, float("inf") if bound == "+Inf" else float(bound)
+
+
+def _format_value(value):
+    value = float(value)
+    return repr(int(value)) if value.is_integer() else repr(value)
@@ -1,19 +1,66 @@
 """
 Distribution model manipulation functions.
+
+Hosted projects are stored in Redis as:
+
+ - a set of project names: `cheddar.local`
+ - a hash mapping canonical (PEP 503) names to project names: `cheddar.local:names`
+ - a hash per project mapping version to filename and, if known, sha256 digest
+   (`<filename>#sha256=<digest>`): `cheddar.local.project:<name>`
+ - a hash per version mapping metadata field to a JSON value:
+   `cheddar.local.metadata:<name>:<version>`
+ - a sorted set per project ranking its versions, oldest first: `cheddar.local.order:<name>`
+
+Version order is computed when versions are added so that listings never parse versions.
+
+Project names cannot contain ":", so these keys cannot collide with each other or with legacy keys.
+
+Earlier releases stored a set of versions per project (`cheddar.local.<name>`) and a JSON
+string per version (`cheddar.local.<name>-<version>`). These legacy keys are still read,
+if enabled, until `Projects.migrate` has converted them.
 """
+from collections import OrderedDict
 from json import dumps, loads
 
+from cheddar.compat import zadd
+from cheddar.metrics import NULL_METRICS
+from cheddar.model.versions import canonicalize_name, parse_version
+
+
+# Separates a filename from its digest in project hash values (and listing links)
+DIGEST_FRAGMENT = "#sha256="
+
+
+def format_listing_entry(filename, digest=None):
+    """
+    Format a project hash value from a filename and an optional sha256 digest.
+    """
+    return filename if not digest else "{}{}{}".format(filename, DIGEST_FRAGMENT, digest)
+
+
+def parse_listing_entry(value):
+    """
+    Parse a project hash value into a filename and a sha256 digest (or None).
+
+    Values written before digests were recorded hold only the filename.
+    """
+    filename, _, digest = value.partition(DIGEST_FRAGMENT)
+    return filename, digest or None
+
 
 class Projects(object):
     """
     Collection of hosted projects.
     """
 
-    def __init__(self, redis, logger, prefix=""):
+    def __init__(self, redis, logger, prefix="", legacy_reads=True, metrics=None):
         self.redis = redis
         self.logger = logger
+        self.metrics = NULL_METRICS if metrics is None else metrics
         self.prefix = prefix
+        self.legacy_reads = legacy_reads
         self.key = "{}cheddar.local".format(self.prefix)
+        self.names_key = "{}cheddar.local:names".format(self.prefix)
 
     def list_projects(self):
         """
@@ -23,24 +70,97 @@ class Projects(object):
 
     def get_project(self, name):
         """
-        Get a hosted project.
+        Get a hosted project by any equivalent form of its name.
+
+        The canonical name and any legacy candidates are checked in one round trip.
         """
-        if self.redis.sismember(self.key, name):
-            return Project(self, name)
-        return None
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hget(self.names_key, canonicalize_name(name))
+        candidates = self._queue_legacy_candidates(pipe, name)
+        results = pipe.execute()
+        stored_name = results[0]
+        if stored_name is None:
+            stored_name = self._pick_legacy_candidate(candidates, results[1:])
+        if stored_name is None:
+            return None
+        return Project(self, stored_name)
+
+    def get_listing(self, name, digests=False):
+        """
+        Get the filenames of all versions of a hosted project.
+
+        :param digests: whether to map versions to (filename, sha256 digest or None) instead
+        :returns: a dictionary mapping version to filename or None
+        """
+        with self.metrics.timer("cheddar_model_duration_seconds", operation="get_listing"):
+            project = self.get_project(name)
+            if project is None:
+                return None
+            return project.get_listing(digests)
+
+    def get_listings(self, names, digests=False):
+        """
+        Get the filenames of all versions of many hosted projects.
+
+        Reads are pipelined: resolving names takes one round trip and reading every
+        listing takes one more (plus one more for legacy metadata, if any).
+
+        :param digests: whether to map versions to (filename, sha256 digest or None) instead
+        :returns: a dictionary mapping each name to an `OrderedDict` of version to
+                  filename or None
+        """
+        names = list(names)
+        listings = dict.fromkeys(names)
+        if not names:
+            return listings
+
+        with self.metrics.timer("cheddar_model_duration_seconds", operation="get_listings"):
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hmget(self.names_key, [canonicalize_name(name) for name in names])
+            all_candidates = [self._queue_legacy_candidates(pipe, name) for name in names]
+            results = pipe.execute()
+            stored_names, results = results[0], results[1:]
+
+            projects = []
+            offset = 0
+            for name, stored_name, candidates in zip(names, stored_names, all_candidates):
+                legacy_results = results[offset:offset + len(candidates)]
+                offset += len(candidates)
+                if stored_name is None:
+                    stored_name = self._pick_legacy_candidate(candidates, legacy_results)
+                if stored_name is not None:
+                    projects.append((name, Project(self, stored_name)))
+
+            pipe = self.redis.pipeline(transaction=False)
+            counts = [project._queue_listing(pipe) for _, project in projects]
+            results = pipe.execute() if projects else []
+
+            offset = 0
+            for (name, project), count in zip(projects, counts):
+                listings[name] = project._build_listing(results[offset:offset + count], digests)
+                offset += count
+            return listings
 
     def add_project(self, name):
         """
         Add a hosted projects.
+
+        The first project added under a canonical name owns that name.
         """
-        self.redis.sadd(self.key, name)
+        pipe = self.redis.pipeline()
+        pipe.sadd(self.key, name)
+        pipe.hsetnx(self.names_key, canonicalize_name(name), name)
+        pipe.execute()
         return Project(self, name)
 
     def remove_project(self, name):
         """
         Remove a hosted projects.
         """
+        canonical_name = canonicalize_name(name)
         self.redis.srem(self.key, name)
+        if self.redis.hget(self.names_key, canonical_name) == name:
+            self.redis.hdel(self.names_key, canonical_name)
 
     def get_metadata(self, name, version):
         project = self.get_project(name)
@@ -53,32 +173,158 @@ class Projects(object):
 
         return project_version.get_metadata()
 
-    def add_metadata(self, metadata):
+    def add_metadata(self, metadata, callback=None, change=None):
         """
         Add a project, a version, and metadata.
+
+        All writes happen in a single transaction.
+
+        :param callback: optional function that queues additional commands on the
+                         transaction's pipeline (e.g. history updates)
+        :param change: optional `Change` to record in the same transaction
         """
         name, version = metadata["name"], metadata["version"]
+        canonical_name = canonicalize_name(name)
+
+        self.logger.debug("Saving distribution: %s %s", name, version)
+
+        def _add(pipe):
+            # equivalent names (e.g. "foo_bar" and "Foo-Bar") belong to the same project
+            stored_name = self._resolve(pipe, name) or name
+            project = Project(self, stored_name)
+            project_version = Version(project, version)
+            pipe.watch(project.key, project.legacy_key)
+            versions = project._get_version_names(pipe)
+            versions.add(version)
+            if change is not None:
+                change.prepare(pipe)
+
+            pipe.multi()
+            pipe.sadd(self.key, stored_name)
+            pipe.hsetnx(self.names_key, canonical_name, stored_name)
+            project_version._write_metadata(pipe, metadata)
+            project._write_order(pipe, versions)
+            if callback is not None:
+                callback(pipe)
+            if change is not None:
+                change.queue(pipe)
+
+        with self.metrics.timer("cheddar_model_duration_seconds", operation="add_metadata"):
+            self.redis.transaction(_add, self.names_key)
+
+    def remove_metadata(self, name, version, callback=None, change=None):
+        """
+        Remove metadata, version, and (maybe) project.
 
-        self.logger.debug("Saving distribution: {} {}".format(name, version))
+        All writes happen in a single transaction, which is retried if the project
+        changes concurrently, so a project is removed exactly when its last version is.
 
-        project = self.add_project(name)
-        project_version = project.add_version(version)
-        project_version.set_metadata(metadata)
+        :param callback: optional function that queues additional commands on the
+                         transaction's pipeline (e.g. history updates)
+        :param change: optional `Change` to record in the same transaction
+        :returns: whether the project was found
+        """
+        canonical_name = canonicalize_name(name)
+
+        def _remove(pipe):
+            stored_name = self._resolve(pipe, name)
+            if stored_name is None:
+                pipe.multi()
+                return False
+
+            project = Project(self, stored_name)
+            project_version = Version(project, version)
+            pipe.watch(project.key, project.legacy_key)
+            remaining = project._get_version_names(pipe)
+            remaining.discard(version)
+            if change is not None:
+                change.prepare(pipe)
+
+            pipe.multi()
+            project_version._remove_metadata(pipe)
+            if not remaining:
+                pipe.delete(project.key, project.legacy_key, project.order_key)
+                pipe.srem(self.key, stored_name)
+                pipe.hdel(self.names_key, canonical_name)
+            if callback is not None:
+                callback(pipe)
+            if change is not None:
+                change.queue(pipe)
+            return True
+
+        with self.metrics.timer("cheddar_model_duration_seconds", operation="remove_metadata"):
+            return self.redis.transaction(_remove, self.names_key, value_from_callable=True)
+
+    def backfill_names(self):
+        """
+        Add canonical name mappings for projects that lack them.
 
-    def remove_metadata(self, name, version):
+        :returns: the number of mappings added
         """
-        Remove metadata, version, and (maybe) project.
+        pipe = self.redis.pipeline()
+        for name in self.redis.smembers(self.key):
+            pipe.hsetnx(self.names_key, canonicalize_name(name), name)
+        return sum(pipe.execute())
+
+    def migrate(self):
         """
-        # Here be race conditions...
-        project = Project(self, name)
-        project_version = Version(project, version)
+        Convert metadata stored under legacy keys to the current schema.
 
-        project_version.remove_metadata()
-        project.remove_version(version)
+        Safe to run while serving traffic: each version is converted in its own
+        transaction and versions that already have current metadata are left alone.
 
-        if project.num_versions() == 0:
-            project.remove()
-            self.remove_project(name)
+        :returns: the number of versions migrated
+        """
+        self.backfill_names()
+
+        migrated = 0
+        for project in self.list_projects():
+            for version in self.redis.smembers(project.legacy_key):
+                if Version(project, version).migrate():
+                    migrated += 1
+            project.reorder()
+            self.logger.info("Migrated metadata for: %s", project.name)
+        return migrated
+
+    def _resolve(self, pipe, name):
+        """
+        Resolve the stored project name for name within a transaction.
+        """
+        stored_name = pipe.hget(self.names_key, canonicalize_name(name))
+        if stored_name is None and self.legacy_reads:
+            stored_name = self._get_legacy_project_name(name)
+        return stored_name
+
+    def _get_legacy_project_name(self, name):
+        """
+        Find a project stored before canonical names were tracked.
+
+        Pip converts underscores to dashes in distribution names, so check for both.
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        candidates = self._queue_legacy_candidates(pipe, name)
+        if not candidates:
+            return None
+        return self._pick_legacy_candidate(candidates, pipe.execute())
+
+    def _queue_legacy_candidates(self, pipe, name):
+        """
+        Queue membership checks for legacy project names on a pipeline.
+
+        :returns: the candidate names checked, in order (none if legacy reads are disabled)
+        """
+        if not self.legacy_reads:
+            return []
+        candidates = [name] if "-" not in name else [name, name.replace("-", "_")]
+        for candidate in candidates:
+            pipe.sismember(self.key, candidate)
+        return candidates
+
+    def _pick_legacy_candidate(self, candidates, results):
+        for candidate, is_member in zip(candidates, results):
+            if is_member:
+                return candidate
+        return None
 
 
 class Project(object):
@@ -89,26 +335,45 @@ class Project(object):
         self.redis = projects.redis
         self.logger = projects.logger
         self.prefix = projects.prefix
+        self.legacy_reads = projects.legacy_reads
         self.name = name
-        self.key = "{}cheddar.local.{}".format(self.prefix, self.name)
+        self.key = "{}cheddar.local.project:{}".format(self.prefix, self.name)
+        self.legacy_key = "{}cheddar.local.{}".format(self.prefix, self.name)
+        self.order_key = "{}cheddar.local.order:{}".format(self.prefix, self.name)
 
     def get_versions(self):
         """
         Get all versions for the project.
         """
-        return [Version(self, version) for version in self.redis.smembers(self.key)]
+        return [Version(self, version) for version in self._get_version_names()]
+
+    def get_listing(self, digests=False):
+        """
+        Get the filenames of all versions for the project, newest first.
+
+        Current metadata takes one round trip; versions still stored under legacy
+        keys take one more.
+
+        :param digests: whether to map versions to (filename, sha256 digest or None) instead
+        :returns: an `OrderedDict` mapping version to filename
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_listing(pipe)
+        return self._build_listing(pipe.execute(), digests)
 
     def num_versions(self):
         """
         Get the number of versions for a project.
         """
-        return self.redis.scard(self.key)
+        return len(self._get_version_names())
 
     def get_version(self, version):
         """
         Add a version to a project.
         """
-        if self.redis.sismember(self.key, version):
+        if self.redis.hexists(self.key, version):
+            return Version(self, version)
+        if self.legacy_reads and self.redis.sismember(self.legacy_key, version):
             return Version(self, version)
         return None
 
@@ -116,20 +381,95 @@ class Project(object):
         """
         Add a version to a project.
         """
-        self.redis.sadd(self.key, version)
+        self.redis.hsetnx(self.key, version, "")
         return Version(self, version)
 
     def remove_version(self, version):
         """
         Remove a version from a project.
         """
-        self.redis.srem(self.key, version)
+        self.redis.hdel(self.key, version)
+        self.redis.srem(self.legacy_key, version)
+        self.redis.zrem(self.order_key, version)
 
     def remove(self):
         """
         Remove a project.
         """
-        self.redis.delete(self.key)
+        self.redis.delete(self.key, self.legacy_key, self.order_key)
+
+    def reorder(self):
+        """
+        Recompute the order of the project's versions.
+        """
+        def _reorder(pipe):
+            versions = self._get_version_names(pipe)
+            pipe.multi()
+            pipe.delete(self.order_key)
+            self._write_order(pipe, versions)
+
+        self.redis.transaction(_reorder, self.key, self.legacy_key)
+
+    def _get_version_names(self, redis=None):
+        redis = self.redis if redis is None else redis
+        versions = set(redis.hkeys(self.key))
+        if self.legacy_reads:
+            versions.update(redis.smembers(self.legacy_key))
+        return versions
+
+    def _queue_listing(self, pipe):
+        """
+        Queue the reads needed to build the project's listing.
+
+        :returns: the number of queued commands
+        """
+        pipe.hgetall(self.key)
+        pipe.zrange(self.order_key, 0, -1, desc=True)
+        if not self.legacy_reads:
+            return 2
+        pipe.smembers(self.legacy_key)
+        return 3
+
+    def _build_listing(self, results, digests=False):
+        """
+        Build the project's listing from the results of the reads queued by `_queue_listing`.
+        """
+        filenames, order = results[0], results[1]
+        legacy_versions = results[2] if self.legacy_reads else []
+        listing = {version: parse_listing_entry(value)
+                   for version, value in filenames.iteritems() if value}
+
+        legacy_versions = [version for version in legacy_versions if version not in filenames]
+        if legacy_versions:
+            keys = [Version(self, version).legacy_key for version in legacy_versions]
+            for version, raw_metadata in zip(legacy_versions, self.redis.mget(keys)):
+                metadata = {} if raw_metadata is None else loads(raw_metadata)
+                if metadata.get(Version.FILENAME) is None:
+                    self.logger.debug("Incomplete metadata for: %s %s", self.name, version)
+                    continue
+                listing[version] = metadata[Version.FILENAME], metadata.get(Version.SHA256_DIGEST)
+
+        if not digests:
+            listing = {version: filename for version, (filename, _) in listing.iteritems()}
+
+        ordered = OrderedDict((version, listing[version])
+                              for version in order if version in listing)
+        if len(ordered) < len(listing):
+            # versions written without an order (e.g. before migration); sort them here
+            self.logger.debug("Incomplete version order for: %s", self.name)
+            ordered = OrderedDict(sorted(listing.iteritems(),
+                                         key=lambda item: parse_version(item[0]),
+                                         reverse=True))
+        return ordered
+
+    def _write_order(self, pipe, versions):
+        """
+        Queue commands that rank versions by their parsed value.
+        """
+        if not versions:
+            return
+        ranks = {version: rank for rank, version in enumerate(sorted(versions, key=parse_version))}
+        zadd(pipe, self.order_key, ranks)
 
 
 class Version(object):
@@ -138,42 +478,110 @@ class Version(object):
     """
 
     FILENAME = "_filename"
+    SHA256_DIGEST = "_sha256_digest"
+    MD5_DIGEST = "_md5_digest"
 
     def __init__(self, project, version):
         self.redis = project.redis
         self.logger = project.logger
         self.prefix = project.prefix
+        self.legacy_reads = project.legacy_reads
         self.name = project.name
         self.version = version
-        self.key = "{}cheddar.local.{}-{}".format(self.prefix, self.name, self.version)
+        self.project_key = project.key
+        self.legacy_project_key = project.legacy_key
+        self.order_key = project.order_key
+        self.key = "{}cheddar.local.metadata:{}:{}".format(self.prefix, self.name, self.version)
+        self.legacy_key = "{}cheddar.local.{}-{}".format(self.prefix, self.name, self.version)
 
     def get_metadata(self):
         """
         Get the version's metadata.
         """
-        raw_metadata = self.redis.get(self.key)
-
-        if raw_metadata is None:
-            self.logger.debug("No metadata found for: {} {}".format(self.name, self.version))
+        raw_metadata = self.redis.hgetall(self.key)
+        if raw_metadata:
+            metadata = {field: loads(value) for field, value in raw_metadata.iteritems()}
+        else:
+            metadata = self._get_legacy_metadata()
+
+        if metadata is None:
+            self.logger.debug("No metadata found for: %s %s", self.name, self.version)
             return None
 
-        metadata = loads(raw_metadata)
-
         if Version.FILENAME not in metadata:
-            self.logger.debug("Incomplete metadata for: {} {}".format(self.name, self.version))
+            self.logger.debug("Incomplete metadata for: %s %s", self.name, self.version)
             return None
 
         return metadata
 
+    def get_field(self, field):
+        """
+        Get a single field of the version's metadata.
+        """
+        value = self.redis.hget(self.key, field)
+        if value is not None:
+            return loads(value)
+
+        metadata = self._get_legacy_metadata()
+        return None if metadata is None else metadata.get(field)
+
     def set_metadata(self, metadata):
         """
         Set the version's metadata.
         """
-        self.logger.debug("Saving metadata: {} for: {} {}".format(metadata, self.name, self.version))
-        self.redis.set(self.key, dumps(metadata))
+        self.logger.debug("Saving metadata: %s for: %s %s", metadata, self.name, self.version)
+        pipe = self.redis.pipeline()
+        self._write_metadata(pipe, metadata)
+        pipe.execute()
 
     def remove_metadata(self):
         """
         Remove the version's metadata.
         """
-        self.redis.delete(self.key)
+        pipe = self.redis.pipeline()
+        self._remove_metadata(pipe)
+        pipe.execute()
+
+    def migrate(self):
+        """
+        Convert the version's legacy metadata to the current schema.
+
+        :returns: whether any metadata was converted
+        """
+        def _migrate(pipe):
+            raw_metadata = pipe.get(self.legacy_key)
+            convert = raw_metadata is not None and not pipe.exists(self.key)
+
+            pipe.multi()
+            if convert:
+                self._write_metadata(pipe, loads(raw_metadata))
+            pipe.delete(self.legacy_key)
+            pipe.srem(self.legacy_project_key, self.version)
+            return convert
+
+        return self.redis.transaction(_migrate, self.legacy_key, self.key, value_from_callable=True)
+
+    def _get_legacy_metadata(self):
+        if not self.legacy_reads:
+            return None
+        raw_metadata = self.redis.get(self.legacy_key)
+        return None if raw_metadata is None else loads(raw_metadata)
+
+    def _write_metadata(self, pipe, metadata):
+        """
+        Queue commands that replace the version's metadata.
+        """
+        pipe.delete(self.key)
+        pipe.hmset(self.key, {field: dumps(value) for field, value in metadata.iteritems()})
+        entry = format_listing_entry(metadata.get(Version.FILENAME, ""),
+                                     metadata.get(Version.SHA256_DIGEST))
+        pipe.hset(self.project_key, self.version, entry)
+
+    def _remove_metadata(self, pipe):
+        """
+        Queue commands that remove the version and its metadata.
+        """
+        pipe.delete(self.key, self.legacy_key)
+        pipe.hdel(self.project_key, self.version)
+        pipe.srem(self.legacy_project_key, self.version)
+        pipe.zrem(self.order_key, self.version)
@@ -1,72 +1,264 @@
 """
 Version and metadata utilities.
 """
-from pkg_resources import parse_version
+from collections import namedtuple, OrderedDict
+from re import compile as compile_regex, VERBOSE
+from struct import error as StructError
+from tarfile import open as tar_open, TarError
+from zipfile import BadZipfile, ZipFile
+from zlib import error as ZlibError
 
-from pkginfo import SDist
 
+_SEPARATORS = compile_regex(r"[-_.]+")
 
-def read_metadata(path):
+# Source archive extensions, removed before splitting name from version
+_SDIST_EXTENSION = compile_regex(r"\.(?:tar\.gz|tar\.bz2|tgz|tar|zip)$")
+
+# Source distributions: <name>-<version>, where names (and versions) may contain hyphens.
+# The version starts at the first segment that begins with a digit and contains a dot
+# (e.g. project-1-1.0), else at the first segment that begins with a digit (e.g. foo-1-1),
+# else it is the last segment.
+_SDIST = compile_regex(r"""
+    ^(?P<name>.+?)-
+    (?P<version>
+        (?=\d[^-]*\.)\d.*
+      | \d(?!.*-\d[^-]*\.).*
+      | [^-]+
+    )$
+""", VERBOSE)
+
+# Wheels (per PEP 427): <name>-<version>[-<build>]-<python>-<abi>-<platform>.whl
+_WHEEL = compile_regex(r"^(?P<name>[^-]+)-(?P<version>[^-]+)(?:-\d[^-]*)?-[^-]+-[^-]+-[^-]+\.whl$")
+
+# Eggs: <name>-<version>[-py<python>[-<platform>]].egg
+_EGG = compile_regex(r"^(?P<name>[^-]+)-(?P<version>[^-]+)(?:-py\d[^-]*(?:-.+)?)?\.egg$")
+
+# How many parsed filenames are memoized?
+FILENAME_CACHE_SIZE = 10000
+
+# A plain dict (emptied when full) rather than an `LRUCache`: lookups must cost less than parsing
+_parsed_filenames = {}
+
+
+ParsedFilename = namedtuple("ParsedFilename",
+                            ["name", "version", "canonical_name", "parsed_version", "is_pre_release"])
+
+
+def read_metadata(source, filename=None):
     """
-    Extract package metadata from source distribution.
+    Extract package metadata from a distribution.
+
+    Only the metadata member (PKG-INFO or .dist-info/METADATA) is read: zip archives
+    and wheels are read through their central directory and tar archives are only
+    streamed until the metadata member is found.
 
-    :param path: path to source distribution
+    :param source: path to (or file-like object containing) the distribution
+    :param filename: the distribution's filename, which determines the archive format;
+                     defaults to source, which must then be a path
     :returns: dict of meta data
     """
-    distribution = SDist(path)
+    filename = source if filename is None else filename
+    try:
+        if filename.endswith((".zip", ".whl", ".egg")):
+            data = _read_zip_metadata(source, filename.endswith(".whl"))
+        elif filename.endswith(("gz", "bz2", ".tar")):
+            data = _read_tar_metadata(source)
+        else:
+            raise ValueError("Not a known archive format: {}".format(filename))
+    except (BadZipfile, TarError, IOError, EOFError, StructError, ZlibError) as error:
+        # truncated or corrupt archives surface as any of these
+        raise ValueError("Unable to read archive: {}: {}".format(filename, error))
+
+    # deferred: only uploads and imports read metadata
+    from pkginfo import Distribution
+    distribution = Distribution()
+    distribution.parse(data)
     return {key: getattr(distribution, key) for key in distribution.iterkeys()}
 
 
+def _is_metadata(data):
+    return b"Metadata-Version" in data
+
+
+def _read_zip_metadata(source, is_wheel):
+    """
+    Read the shallowest metadata member of a zip archive.
+    """
+    member_name = "METADATA" if is_wheel else "PKG-INFO"
+    with ZipFile(source) as archive:
+        candidates = [name for name in archive.namelist()
+                      if name.split("/")[-1] == member_name and
+                      (not is_wheel or ("/" in name and name.split("/")[-2].endswith(".dist-info")))]
+        for name in sorted(candidates, key=lambda name: name.count("/")):
+            data = archive.read(name)
+            if _is_metadata(data):
+                return data
+    raise ValueError("No {} in archive".format(member_name))
+
+
+def _read_tar_metadata(source):
+    """
+    Read the shallowest PKG-INFO member of a (compressed) tar archive.
+
+    Members are streamed in order and reading stops at the first top-level
+    PKG-INFO (e.g. foo-1.0/PKG-INFO), which sdists almost always include.
+    """
+    try:
+        if hasattr(source, "read"):
+            archive = tar_open(fileobj=source, mode="r|*")
+        else:
+            archive = tar_open(source, mode="r|*")
+    except TypeError:
+        # Python 2's tarfile fails this way on a truncated gzip header
+        raise TarError("truncated gzip header")
+
+    fallback, fallback_depth = None, None
+    with archive:
+        for member in archive:
+            if not member.isfile() or member.name.split("/")[-1] != "PKG-INFO":
+                continue
+            data = archive.extractfile(member).read()
+            if not _is_metadata(data):
+                continue
+            depth = member.name.strip("./").count("/")
+            if depth <= 1:
+                return data
+            if fallback is None or depth < fallback_depth:
+                fallback, fallback_depth = data, depth
+
+    if fallback is None:
+        raise ValueError("No PKG-INFO in archive")
+    return fallback
+
+
+def parse_version(version):
+    """
+    Parse a version, as `pkg_resources.parse_version`.
+
+    pkg_resources is imported on first use: importing it scans every installed
+    distribution, which is slow.
+    """
+    from pkg_resources import parse_version as parse
+    return parse(version)
+
+
+def parse_filename(basename):
+    """
+    Parse a distribution's filename.
+
+    Results are memoized, since the same filenames are parsed for every listing,
+    link, and storage path.
+
+    :returns: a `ParsedFilename`
+    :raises ValueError: if basename is not a distribution's filename
+    """
+    try:
+        return _parsed_filenames[basename]
+    except KeyError:
+        pass
+    parsed = _parse_filename(basename)
+    if len(_parsed_filenames) >= FILENAME_CACHE_SIZE:
+        _parsed_filenames.clear()
+    _parsed_filenames[basename] = parsed
+    return parsed
+
+
+def parse_filenames(basenames):
+    """
+    Parse the filenames of a listing at once.
+
+    :returns: a dictionary mapping each basename to a `ParsedFilename`, or None
+              if it is not a distribution's filename
+    """
+    parsed = {}
+    for basename in basenames:
+        try:
+            parsed[basename] = parse_filename(basename)
+        except ValueError:
+            parsed[basename] = None
+    return parsed
+
+
+def _parse_filename(basename):
+    if basename.endswith(".exe"):
+        raise ValueError("Expected basename to have a valid package extension.")
+
+    match = (basename.endswith(".whl") and _WHEEL.match(basename) or
+             basename.endswith(".egg") and _EGG.match(basename) or
+             _SDIST.match(_SDIST_EXTENSION.sub("", basename)))
+    if match is None:
+        raise ValueError("Unable to parse name and version from: {}".format(basename))
+
+    name, version = match.group("name", "version")
+    parsed_version = parse_version(version)
+    return ParsedFilename(name, version, canonicalize_name(name), parsed_version,
+                          _is_pre_release(parsed_version))
+
+
 def sort_key(basename):
     """
     Define a sort key suitable for use in `sorted`
     that leverages the parsed version.
     """
     try:
-        _, version = guess_name_and_version(basename)
+        return parse_filename(basename).parsed_version
     except ValueError:
-        version = basename
-    return parse_version(version)
+        return parse_version(basename)
+
+
+def sort_versions(versions):
+    """
+    Order a versions listing, newest first.
+
+    :param versions: a dictionary mapping filenames to paths
+    :returns: an `OrderedDict` mapping filenames to paths
+    """
+    parsed = parse_filenames(list(versions))
+
+    def key(item):
+        parsed_filename = parsed[item[0]]
+        return parse_version(item[0]) if parsed_filename is None else parsed_filename.parsed_version
+
+    return OrderedDict(sorted(versions.iteritems(), key=key, reverse=True))
 
 
 def guess_name_and_version(basename):
     """
     Guess the distribution's name and version from its filename.
     """
-    rest = basename
+    parsed = parse_filename(basename)
+    return parsed.name, parsed.version
 
-    for bad_extension in [".exe"]:
-        if rest.endswith(bad_extension):
-            # bad extension
-            raise ValueError("Expected basename to have a valid package extension.")
 
-    for extension in [".tar.gz", ".zip"]:
-        if rest.endswith(extension):
-            rest = rest[:- len(extension)]
-            break
+def canonicalize_name(name):
+    """
+    Compute the canonical form of a package name (per PEP 503).
 
-    name, version = rest.split("-", 1)
-    if version[0].isdigit():
-        # first split left
-        return name, version
-    else:
-        # otherwise split right
-        return rest.rsplit("-", 1)
+    Runs of "-", "_", and "." are equivalent and names are case insensitive.
+    """
+    return _SEPARATORS.sub("-", name).lower()
 
 
 def name_match(this, that):
     """
     Do two package names match?
     """
-    def _normalize(name):
-        return name.replace("_", "-").lower()
-
-    return _normalize(this) == _normalize(that)
+    return canonicalize_name(this) == canonicalize_name(that)
 
 
 def is_pre_release(basename):
     """
     Determine whether the version is a pre-release.
+    """
+    try:
+        return parse_filename(basename).is_pre_release
+    except ValueError:
+        return _is_pre_release(parse_version(basename))
+
+
+def _is_pre_release(parsed_version):
+    """
+    Determine whether a parsed version is a pre-release.
 
     The existence of "patch levels" and other exotic versions make version analysis trick.
     PEP386's version improvements are also impractical because PyPi has to deal with actual
@@ -74,8 +266,6 @@ def is_pre_release(basename):
 
     See: http://pythonhosted.org/setuptools/pkg_resources.html#parsing-utilities
     """
-    parsed_version = sort_key(basename)
-
     def is_patch(part):
         # the tailing "-" is important here
         return part == "*post" or part == "*final-"
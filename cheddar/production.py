@@ -6,6 +6,16 @@ Creates and configures a new application.
 By default uwsgi will use a module's 'application' value.
 """
 from cheddar.app import create_app
+from cheddar.configure import after_fork
 
 
 application = create_app()
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    # not running under uwsgi
+    pass
+else:
+    # uwsgi (without lazy-apps) loads the app once and forks workers from it
+    postfork(lambda: after_fork(application))
@@ -0,0 +1,27 @@
+"""
+Production WSGI hook for gevent workers.
+
+Patches the standard library for cooperative concurrency *before* anything else
+is imported, so that remote index requests (`requests`) and Redis access (`redis`)
+yield to other greenlets instead of blocking the worker. A single process can
+then hold many in-flight proxy requests while local listings keep being served.
+
+Use with uwsgi's gevent loop (see conf/etc/cheddar/uwsgi-gevent.ini) and set
+`REDIS_MAX_CONNECTIONS` so that greenlets share a bounded Redis pool.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from cheddar.app import create_app  # noqa
+from cheddar.configure import after_fork  # noqa
+
+
+application = create_app()
+
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    # not running under uwsgi
+    pass
+else:
+    postfork(lambda: after_fork(application))
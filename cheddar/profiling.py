@@ -0,0 +1,163 @@
+"""
+Profile individual requests on demand.
+"""
+from cProfile import Profile
+from errno import EEXIST
+from glob import glob
+from json import dump, load
+from os import makedirs, remove
+from os.path import basename, isdir, join, splitext
+from pstats import Stats
+from random import random
+from re import compile as re_compile
+from StringIO import StringIO
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from flask import request
+
+from cheddar.auth import check_authentication
+
+
+PROFILE_ID = re_compile(r"^[0-9]+-[0-9a-f]+$")
+
+
+class Profiler(object):
+    """
+    Capture cProfile profiles of selected requests.
+
+    A request is profiled if it sends the profile header along with valid upload
+    credentials, or if it is sampled (1 in `PROFILE_SAMPLE_RATE` requests).
+
+    Each profile is written to the profile directory as `<id>.prof` (loadable with
+    `pstats` or any compatible viewer) next to `<id>.json`, which tags it with the
+    request's endpoint, project name, and timings.
+
+    cProfile hooks the whole process (every greenlet, under gevent), so a worker
+    profiles one request at a time; requests selected while another is being
+    profiled are not profiled.
+    """
+
+    def __init__(self, app):
+        self.users = app.users
+        self.logger = app.logger
+        self.profile_dir = app.config["PROFILE_DIR"]
+        self.sample_rate = app.config["PROFILE_SAMPLE_RATE"]
+        self.header = app.config["PROFILE_HEADER"]
+        self.keep = app.config["PROFILE_HISTORY"]
+        self._active = Lock()
+
+    def should_profile(self):
+        """
+        Should the current request be profiled?
+        """
+        if request.headers.get(self.header):
+            if check_authentication(self.users):
+                return True
+            self.logger.info("Ignoring unauthenticated profile request for: %s", request.path)
+        return bool(self.sample_rate) and random() * self.sample_rate < 1
+
+    def start(self):
+        """
+        Start profiling the current request.
+
+        :returns: the running profile or None if another request is being profiled
+        """
+        if not self._active.acquire(False):
+            self.logger.debug("Not profiling: %s; another request is being profiled", request.path)
+            return None
+        profile = Profile()
+        profile.enable()
+        return profile
+
+    def abort(self, profile):
+        """
+        Stop profiling the current request without saving the profile.
+        """
+        profile.disable()
+        self._active.release()
+
+    def finish(self, profile, started, response):
+        """
+        Stop profiling the current request and save the profile.
+
+        :param started: when the request started
+        :returns: the profile's id
+        """
+        profile.disable()
+        self._active.release()
+        duration = time() - started
+
+        profile_id = "{}-{}".format(int(started * 1000), uuid4().hex[:8])
+        view_args = request.view_args or {}
+        meta = dict(id=profile_id,
+                    endpoint=request.endpoint,
+                    method=request.method,
+                    path=request.path,
+                    name=view_args.get("name"),
+                    status=response.status_code,
+                    created=started,
+                    duration=duration,
+                    profiled=Stats(profile).total_tt)
+
+        if not isdir(self.profile_dir):
+            try:
+                makedirs(self.profile_dir)
+            except OSError as error:
+                # another worker (or thread) created it first
+                if error.errno != EEXIST:
+                    raise
+        profile.dump_stats(self._path(profile_id, ".prof"))
+        with open(self._path(profile_id, ".json"), "w") as file_:
+            dump(meta, file_)
+
+        self.logger.info("Profiled: %s %s in %.3fs as: %s",
+                         request.method, request.path, duration, profile_id)
+        self._prune()
+        return profile_id
+
+    def list_profiles(self):
+        """
+        List saved profiles, newest first.
+        """
+        profiles = []
+        for path in glob(self._path("*", ".json")):
+            try:
+                with open(path) as file_:
+                    profiles.append(load(file_))
+            except (IOError, ValueError):
+                # pruned (or still being written) by another worker
+                continue
+        return sorted(profiles, key=lambda meta: meta["created"], reverse=True)
+
+    def summarize(self, profile_id, sort="cumulative", limit=50):
+        """
+        Summarize a saved profile as text.
+
+        :returns: the summary or None if there is no such profile
+        """
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            stream = StringIO()
+            Stats(self._path(profile_id, ".prof"), stream=stream).sort_stats(sort).print_stats(limit)
+        except IOError:
+            return None
+        return stream.getvalue()
+
+    def _path(self, profile_id, extension):
+        return join(self.profile_dir, profile_id + extension)
+
+    def _prune(self):
+        """
+        Remove all but the most recent profiles.
+        """
+        profile_ids = sorted((splitext(basename(path))[0] for path in glob(self._path("*", ".json"))),
+                             key=lambda profile_id: int(profile_id.split("-", 1)[0]))
+        for profile_id in profile_ids[:max(len(profile_ids) - self.keep, 0)]:
+            for extension in (".json", ".prof"):
+                try:
+                    remove(self._path(profile_id, extension))
+                except OSError:
+                    self.logger.debug("Unable to remove profile: %s", profile_id)
@@ -0,0 +1,187 @@
+"""
+Cache rendered listings in Redis.
+"""
+from hashlib import sha1
+from json import dumps, loads
+from time import time
+from uuid import uuid4
+from zlib import compressobj, DEFLATED, MAX_WBITS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from cheddar.model.versions import canonicalize_name
+
+
+IDENTITY = "identity"
+
+# brotli's default (11) is far slower than gzip's best for little gain on listings
+BROTLI_QUALITY = 6
+
+
+def gzip_compress(data):
+    """
+    Compress data in gzip format.
+
+    Unlike `gzip.GzipFile`, no timestamp is written, so equal data compresses equally.
+    """
+    compressor = compressobj(9, DEFLATED, 16 + MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def brotli_compress(data):
+    """
+    Compress data in brotli format at a moderate quality.
+    """
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+# Supported content encodings, in order of preference
+COMPRESSORS = [("gzip", gzip_compress)]
+if brotli is not None:
+    COMPRESSORS.insert(0, ("br", brotli_compress))
+
+
+class RenderedCache(object):
+    """
+    Cache rendered listing responses (/simple and /simple/<name>) per representation.
+
+    Entries for a project live in one hash per canonical name, so that a single
+    write invalidates every representation and every spelling of the name. An
+    invalidation also replaces the hash's stamp, which keeps responses rendered
+    from data read before the invalidation from being cached after it.
+
+    Each entry is stored with pre-compressed variants of its body (one field per
+    content encoding), so compression happens once per content change and reads
+    only fetch the variant being served.
+    """
+
+    STAMP = "_stamp"
+
+    def __init__(self, app):
+        self.redis = app.redis
+        self.logger = app.logger
+        self.ttl = app.config["RENDERED_CACHE_TTL"]
+        self.min_compress_size = app.config["LISTING_COMPRESS_MIN_SIZE"]
+
+    def _key(self, name=None):
+        if name is None:
+            return "cheddar.rendered:simple"
+        return "cheddar.rendered:simple:{}".format(canonicalize_name(name))
+
+    def _field(self, name, representation, encoding=None):
+        field = representation if name is None else "{}:{}".format(representation, name)
+        return field if encoding is None else "{}|{}".format(field, encoding)
+
+    def negotiate(self, accept_encodings):
+        """
+        Choose the preferred content encoding that a client accepts.
+
+        :param accept_encodings: the request's `Accept-Encoding` values
+        """
+        for encoding, _ in COMPRESSORS:
+            if accept_encodings[encoding] > 0:
+                return encoding
+        return IDENTITY
+
+    def get(self, name, representation, encoding=IDENTITY):
+        """
+        Get a cached listing.
+
+        :param name: the project name or None for the list of projects
+        :param representation: the response representation (e.g. "html" or "json")
+        :param encoding: the preferred content encoding
+        :returns: the cached entry (or None) and a stamp to pass to `put`; the entry's
+                  variants hold the body in the preferred encoding, if cached, or as is
+        """
+        if not self.ttl:
+            return None, None
+
+        key = self._key(name)
+        raw_entry, body, stamp = self.redis.hmget(key,
+                                                  self._field(name, representation),
+                                                  self._field(name, representation, encoding),
+                                                  RenderedCache.STAMP)
+        if raw_entry is None:
+            self.logger.debug("No rendered listing for: %s %s", name, representation)
+            return None, stamp
+
+        entry = loads(raw_entry)
+        if time() - entry["created"] >= self.ttl:
+            self.logger.debug("Rendered listing for: %s %s was expired", name, representation)
+            return None, stamp
+
+        if body is None:
+            # too small to compress (or cached by a worker without this encoding)
+            encoding = IDENTITY
+            body = self.redis.hget(key, self._field(name, representation, encoding))
+            if body is None:
+                return None, stamp
+
+        entry["variants"] = {encoding: body}
+        return entry, stamp
+
+    def put(self, name, representation, stamp, body, content_type, encoding=None):
+        """
+        Cache a listing unless the listing was invalidated since `get` returned stamp.
+
+        :param encoding: the negotiated content encoding; when caching is disabled, only
+                         this variant is compressed
+        :returns: the entry, with content type, (strong) etag, creation time, and
+                  variants mapping content encoding to body
+        """
+        entry = dict(content_type=content_type,
+                     etag=sha1(body).hexdigest(),
+                     created=time())
+        variants = {IDENTITY: body}
+        if len(body) >= self.min_compress_size:
+            for compressor_encoding, compress in COMPRESSORS:
+                if self.ttl or compressor_encoding == encoding:
+                    variants[compressor_encoding] = compress(body)
+
+        if not self.ttl:
+            entry["variants"] = variants
+            return entry
+
+        key = self._key(name)
+        fields = {self._field(name, representation, variant_encoding): variant
+                  for variant_encoding, variant in variants.iteritems()}
+        fields[self._field(name, representation)] = dumps(entry)
+
+        def _put(pipe):
+            current = pipe.hget(key, RenderedCache.STAMP)
+            pipe.multi()
+            if current != stamp:
+                self.logger.debug("Not caching invalidated listing for: %s", name)
+                return
+            pipe.hmset(key, fields)
+            pipe.expire(key, self.ttl)
+
+        self.redis.transaction(_put, key)
+        entry["variants"] = variants
+        return entry
+
+    def invalidate(self, name=None, pipe=None, projects=True):
+        """
+        Invalidate a project's listing and, optionally, the list of projects.
+
+        :param name: the project name or None to invalidate only the list of projects
+        :param pipe: optional pipeline (e.g. a transaction) on which to queue commands
+        :param projects: whether the list of projects may have changed
+        """
+        if not self.ttl:
+            return
+
+        keys = [] if name is None else [self._key(name)]
+        if projects:
+            keys.append(self._key())
+
+        commands = self.redis.pipeline() if pipe is None else pipe
+        for key in keys:
+            commands.delete(key)
+            commands.hset(key, RenderedCache.STAMP, uuid4().hex)
+            commands.expire(key, self.ttl)
+        if pipe is None:
+            commands.execute()
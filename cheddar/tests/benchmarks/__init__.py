@@ -0,0 +1,5 @@
+"""
+Benchmarks; run modules directly (e.g. `python -m cheddar.tests.benchmarks.bench_metadata`).
+
+`cheddar.tests.benchmarks.suite` covers the hot paths and can save and compare baselines.
+"""
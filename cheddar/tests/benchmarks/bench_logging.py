@@ -0,0 +1,98 @@
+"""
+Benchmark the cost of logging large listings.
+
+Compares formatting a listing eagerly (`"...".format(versions)`, as log calls used
+to) with passing it as a lazy logging argument while DEBUG is disabled, then
+measures a full remote listing refresh with logging at INFO and at DEBUG.
+
+Usage: python -m cheddar.tests.benchmarks.bench_logging [--versions N] [--repeat N]
+"""
+from argparse import ArgumentParser
+from logging import DEBUG, getLogger, INFO, NullHandler
+from time import time
+
+from mock import MagicMock, patch
+from requests import codes
+
+from cheddar.model.versions import sort_versions
+from cheddar.tests import fixtures
+
+
+def make_listing(count):
+    """
+    Make a listing of count versions, as the remote index builds it.
+    """
+    return sort_versions({"large-1.{}.tar.gz".format(index):
+                          "/remote/packages/large-1.{}.tar.gz?base=http%3A%2F%2Fexample.com".format(index)
+                          for index in range(count)})
+
+
+def make_html(count):
+    """
+    Make a remote (PEP 503) listing page with count links.
+    """
+    links = "".join('<a href="/packages/large-1.{0}.tar.gz">large-1.{0}.tar.gz</a>\n'.format(index)
+                    for index in range(count))
+    return "<html><body>\n{}</body></html>".format(links)
+
+
+def measure(label, func, repeat):
+    started = time()
+    for _ in range(repeat):
+        func()
+    elapsed = (time() - started) / repeat
+    print "{:<40} {:>10.3f} ms".format(label, elapsed * 1000)
+    return elapsed
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark logging of large listings")
+    parser.add_argument("--versions", type=int, default=2000, help="versions per listing")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    logger = getLogger("cheddar.benchmarks")
+    logger.addHandler(NullHandler())
+    logger.propagate = False
+    logger.setLevel(INFO)
+    versions = make_listing(args.versions)
+
+    print "log call at INFO, DEBUG disabled ({} versions)".format(args.versions)
+    measure("eager format",
+            lambda: logger.debug("Returning new versions: {}".format(versions)),
+            args.repeat)
+    measure("lazy argument",
+            lambda: logger.debug("Returning new versions: %s", versions),
+            args.repeat)
+
+    class Fixture(object):
+        pass
+
+    fixture = Fixture()
+    fixtures.setup(fixture)
+    try:
+        app = fixture.app
+        remote = app.index.remote
+        response = MagicMock()
+        response.status_code = codes.ok
+        response.text = make_html(args.versions)
+        response.history = []
+        response.headers = {}
+
+        def refresh():
+            return remote._refresh_versions("large", None)
+
+        print "remote listing refresh ({} versions)".format(args.versions)
+        with patch("cheddar.index.remote.get", return_value=response):
+            for level in (INFO, DEBUG):
+                app.logger.setLevel(level)
+                app.logger.handlers = [NullHandler()]
+                measure("logging at {}".format("DEBUG" if level == DEBUG else "INFO"),
+                        refresh,
+                        args.repeat)
+    finally:
+        fixtures.teardown(fixture)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark metadata extraction from large distributions.
+
+Compares pkginfo's archive readers with `read_metadata` reading from a path
+and from an in-memory buffer.
+
+Usage: python -m cheddar.tests.benchmarks.bench_metadata [--size MB] [--repeat N]
+"""
+from argparse import ArgumentParser
+from io import BytesIO
+from os import urandom
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from pkginfo import SDist, Wheel
+
+from cheddar.model.versions import read_metadata
+from cheddar.tests.distributions import make_sdist, PKG_INFO
+
+
+# How large is each generated member?
+MEMBER_SIZE = 256 * 1024
+
+
+def write_sdist(path, size):
+    """
+    Write a gzipped sdist of roughly size bytes, with PKG-INFO at the end (as setuptools does).
+    """
+    members = [("large/data{}.bin".format(index), urandom(MEMBER_SIZE))
+               for index in range(size // MEMBER_SIZE)]
+    with open(path, "wb") as file_:
+        file_.write(make_sdist("large", "1.0", members))
+
+
+def make_wheel(path, size):
+    """
+    Write a wheel of roughly size bytes.
+    """
+    with ZipFile(path, "w", ZIP_DEFLATED) as archive:
+        for index in range(size // MEMBER_SIZE):
+            archive.writestr("large/data{}.bin".format(index), urandom(MEMBER_SIZE))
+        archive.writestr("large-1.0.dist-info/METADATA", PKG_INFO.format(name="large", version="1.0"))
+        archive.writestr("large-1.0.dist-info/WHEEL", "Wheel-Version: 1.0\n")
+
+
+def measure(label, func, repeat):
+    started = time()
+    for _ in range(repeat):
+        func()
+    elapsed = (time() - started) / repeat
+    print "{:<40} {:>10.2f} ms".format(label, elapsed * 1000)
+    return elapsed
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark metadata extraction")
+    parser.add_argument("--size", type=int, default=50, help="archive size in MB")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    work_dir = mkdtemp()
+    try:
+        sdist_path = join(work_dir, "large-1.0.tar.gz")
+        wheel_path = join(work_dir, "large-1.0-py2-none-any.whl")
+        write_sdist(sdist_path, args.size * 1024 * 1024)
+        make_wheel(wheel_path, args.size * 1024 * 1024)
+
+        with open(sdist_path, "rb") as file_:
+            sdist_data = file_.read()
+        with open(wheel_path, "rb") as file_:
+            wheel_data = file_.read()
+
+        print "sdist ({} MB)".format(args.size)
+        measure("pkginfo.SDist", lambda: SDist(sdist_path), args.repeat)
+        measure("read_metadata (path)", lambda: read_metadata(sdist_path), args.repeat)
+        measure("read_metadata (buffer)",
+                lambda: read_metadata(BytesIO(sdist_data), sdist_path),
+                args.repeat)
+
+        print "wheel ({} MB)".format(args.size)
+        measure("pkginfo.Wheel", lambda: Wheel(wheel_path), args.repeat)
+        measure("read_metadata (path)", lambda: read_metadata(wheel_path), args.repeat)
+        measure("read_metadata (buffer)",
+                lambda: read_metadata(BytesIO(wheel_data), wheel_path),
+                args.repeat)
+    finally:
+        rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
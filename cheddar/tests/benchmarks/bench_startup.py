@@ -0,0 +1,78 @@
+"""
+Benchmark application startup.
+
+Each run starts a fresh interpreter that imports `cheddar.app` and creates the
+app, as a uwsgi worker (re)spawn does, then reports how long each step took and
+which heavy modules were imported along the way. Runs are made with and without
+`PRELOAD`. Redis is pointed at an unresolvable host and storage at directories
+that don't exist, so any connection or directory created at startup shows up.
+
+Usage: python -m cheddar.tests.benchmarks.bench_startup [--repeat N]
+"""
+from argparse import ArgumentParser
+from json import loads
+from os import environ
+from os.path import join
+from shutil import rmtree
+from subprocess import check_output
+from sys import executable
+from tempfile import mkdtemp
+
+from cheddar.configure import LAZY_IMPORTS
+
+
+CHILD = """
+from json import dumps
+from os.path import exists
+from sys import modules
+from time import time
+
+started = time()
+from cheddar.app import create_app
+imported = time()
+app = create_app(testing=True)
+created = time()
+
+print dumps(dict(imported=imported - started,
+                 created=created - imported,
+                 modules=[name for name in {lazy_imports!r} if name in modules],
+                 dirs=exists(app.local_storage.base_dir) or exists(app.remote_storage.base_dir)))
+"""
+
+
+def run_child(config_file):
+    env = dict(environ, CHEDDAR_SETTINGS=config_file)
+    return loads(check_output([executable, "-W", "ignore", "-c", CHILD.format(lazy_imports=LAZY_IMPORTS)],
+                              env=env).splitlines()[-1])
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark application startup")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    config_dir = mkdtemp()
+    try:
+        for preload in (False, True):
+            config_file = join(config_dir, "cheddar-{}.conf".format(preload))
+            with open(config_file, "w") as file_:
+                file_.write('LOCAL_CACHE_DIR = "{}/local"\n'.format(config_dir))
+                file_.write('REMOTE_CACHE_DIR = "{}/remote"\n'.format(config_dir))
+                file_.write('REDIS_HOSTNAME = "redis.invalid"\n')
+                file_.write("PRELOAD = {}\n".format(preload))
+
+            results = [run_child(config_file) for _ in range(args.repeat)]
+            imported = sorted(result["imported"] for result in results)[len(results) // 2]
+            created = sorted(result["created"] for result in results)[len(results) // 2]
+            print "PRELOAD = {}".format(preload)
+            print "{:<40} {:>10.1f} ms".format("import cheddar.app (median)", imported * 1000)
+            print "{:<40} {:>10.1f} ms".format("create_app (median)", created * 1000)
+            print "{:<40} {}".format("heavy modules imported", ", ".join(results[0]["modules"]) or "none")
+            print "{:<40} {}".format("storage directories created", "yes" if results[0]["dirs"] else "no")
+            print
+    finally:
+        rmtree(config_dir)
+
+
+if __name__ == "__main__":
+    main()
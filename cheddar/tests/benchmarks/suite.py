@@ -0,0 +1,372 @@
+"""
+Micro-benchmark suite for hot paths.
+
+Each benchmark times one operation against deterministic data (Redis is mocked,
+storage lives in temporary directories) and reports the best time per operation
+over several repeats. Results may be saved as a baseline and later compared
+against it; operations that slowed down by more than the threshold are flagged
+as regressions (and the run exits non-zero).
+
+Usage:
+
+    python -m cheddar.tests.benchmarks.suite [--only NAME ...] [--repeat N]
+    python -m cheddar.tests.benchmarks.suite --save baseline.json
+    python -m cheddar.tests.benchmarks.suite --compare baseline.json [--threshold 0.2]
+"""
+from argparse import ArgumentParser
+from json import dump, load
+from platform import python_implementation, python_version
+from random import Random
+from sys import exit
+from time import time
+
+from mock import MagicMock, patch
+from requests import codes
+
+from cheddar.index.remote import iter_version_links
+from cheddar.model.versions import (_parsed_filenames,
+                                    guess_name_and_version,
+                                    is_pre_release,
+                                    parse_filenames,
+                                    sort_key,
+                                    sort_versions)
+from cheddar.tests import fixtures
+
+
+# Registered benchmarks, in order: (name, setup) pairs where setup returns the operation to time
+BENCHMARKS = []
+
+# How many seconds should each repeat take (at least)?
+MIN_REPEAT_TIME = 0.1
+
+# How many versions do generated projects have?
+VERSION_COUNT = 500
+
+# How many links does a generated upstream page have?
+LINK_COUNT = 5000
+
+# How large are stored distributions?
+DISTRIBUTION_SIZE = 1024 * 1024
+
+
+def benchmark(name):
+    """
+    Register a benchmark.
+
+    The decorated function receives a `Context` and returns a function that
+    performs the operation once.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+class Context(object):
+    """
+    Shared benchmark state: a seeded random generator and an app with mocked Redis.
+    """
+
+    def __init__(self, seed=0):
+        self.random = Random(seed)
+        fixtures.setup(self)
+        self.app.logger.disabled = True
+        self.patches = []
+
+    def patch(self, target, **kwargs):
+        patcher = patch(target, **kwargs)
+        self.patches.append(patcher)
+        return patcher.start()
+
+    def close(self):
+        for patcher in reversed(self.patches):
+            patcher.stop()
+        fixtures.teardown(self)
+
+    def versions(self, count):
+        """
+        Generate count realistic versions (releases, pre-releases, and post releases).
+        """
+        versions = []
+        for _ in range(count):
+            version = "{}.{}.{}".format(self.random.randint(0, 9),
+                                        self.random.randint(0, 30),
+                                        self.random.randint(0, 99))
+            suffix = self.random.choice(["", "", "", "rc1", "b2", ".post1", ".dev3"])
+            versions.append(version + suffix)
+        return versions
+
+    def filenames(self, count, name="large"):
+        return ["{}-{}{}".format(name, version, self.random.choice([".tar.gz", ".zip"]))
+                for version in self.versions(count)]
+
+    def upstream_page(self, count, name="large"):
+        """
+        Generate a PEP 503 listing page much like PyPI's for a project with many files.
+        """
+        lines = ["<!DOCTYPE html>", "<html>", "<head><title>Links for {}</title></head>".format(name),
+                 "<body>", "<h1>Links for {}</h1>".format(name)]
+        for filename in self.filenames(count, name):
+            digest = "%064x" % self.random.getrandbits(256)
+            lines.append('<a href="https://files.example.com/packages/{}/{}/{}/{}#sha256={}" '
+                         'data-requires-python="&gt;=2.7">{}</a><br/>'.format(
+                             digest[:2], digest[2:4], digest[4:], filename, digest, filename))
+        lines.extend(["</body>", "</html>"])
+        return "\n".join(lines)
+
+    def add_project(self, name, count):
+        for version in set(self.versions(count)):
+            self.app.projects.add_metadata({"name": name,
+                                            "version": version,
+                                            "_filename": "{}-{}.tar.gz".format(name, version)})
+
+
+@benchmark("versions.guess_name_and_version")
+def bench_guess_name_and_version(context):
+    filenames = context.filenames(1000)
+
+    def run():
+        for filename in filenames:
+            guess_name_and_version(filename)
+    return run
+
+
+@benchmark("versions.guess_name_and_version (cold)")
+def bench_guess_name_and_version_cold(context):
+    filenames = context.filenames(1000)
+
+    def run():
+        _parsed_filenames.clear()
+        for filename in filenames:
+            guess_name_and_version(filename)
+    return run
+
+
+@benchmark("versions.parse_filenames")
+def bench_parse_filenames(context):
+    filenames = context.filenames(1000)
+
+    def run():
+        parse_filenames(filenames)
+    return run
+
+
+@benchmark("versions.sort_versions")
+def bench_sort_versions(context):
+    versions = {filename: filename for filename in context.filenames(VERSION_COUNT)}
+
+    def run():
+        sort_versions(versions)
+    return run
+
+
+@benchmark("versions.sort_key")
+def bench_sort_key(context):
+    filenames = context.filenames(1000)
+
+    def run():
+        for filename in filenames:
+            sort_key(filename)
+    return run
+
+
+@benchmark("versions.is_pre_release")
+def bench_is_pre_release(context):
+    filenames = context.filenames(1000)
+
+    def run():
+        for filename in filenames:
+            is_pre_release(filename)
+    return run
+
+
+@benchmark("remote.iter_version_links")
+def bench_iter_version_links(context):
+    html = context.upstream_page(LINK_COUNT)
+
+    def run():
+        for _ in iter_version_links(html, "large"):
+            pass
+    return run
+
+
+@benchmark("local.get_versions")
+def bench_local_get_versions(context):
+    context.add_project("local-large", VERSION_COUNT)
+    local = context.app.index.local
+
+    def run():
+        local.get_versions("local-large")
+    return run
+
+
+@benchmark("remote.get_versions (hit)")
+def bench_remote_get_versions_hit(context):
+    remote = context.app.index.remote
+    versions = {filename: "/remote/packages/{}?base=http%3A%2F%2Fexample.com".format(filename)
+                for filename in context.filenames(VERSION_COUNT, "remote-large")}
+    remote._save_index("remote-large", versions)
+
+    def run():
+        remote.get_versions("remote-large")
+    return run
+
+
+@benchmark("remote.get_versions (miss)")
+def bench_remote_get_versions_miss(context):
+    remote = context.app.index.remote
+    response = MagicMock()
+    response.status_code = codes.ok
+    response.text = context.upstream_page(VERSION_COUNT, "remote-missed")
+    response.history = []
+    response.headers = {}
+    context.patch("cheddar.index.remote.get", return_value=response)
+
+    def run():
+        context.app.redis.delete(remote._key("remote-missed"))
+        remote.get_versions("remote-missed")
+    return run
+
+
+@benchmark("storage.write")
+def bench_storage_write(context):
+    storage = context.app.local_storage
+    data = "".join(chr(context.random.getrandbits(8)) for _ in range(DISTRIBUTION_SIZE))
+
+    def run():
+        storage.write("written-1.0.tar.gz", data)
+    return run
+
+
+@benchmark("storage.read")
+def bench_storage_read(context):
+    storage = context.app.local_storage
+    storage.write("read-1.0.tar.gz", "".join(chr(context.random.getrandbits(8))
+                                             for _ in range(DISTRIBUTION_SIZE)))
+
+    def run():
+        storage.read("read-1.0.tar.gz")
+    return run
+
+
+@benchmark("controllers.get_project (render)")
+def bench_render_project(context):
+    context.add_project("rendered-large", VERSION_COUNT)
+    client = context.app.test_client()
+
+    def run():
+        context.app.rendered.invalidate("rendered-large")
+        client.get("/simple/rendered-large")
+    return run
+
+
+@benchmark("controllers.get_project (cached)")
+def bench_cached_project(context):
+    context.add_project("cached-large", VERSION_COUNT)
+    client = context.app.test_client()
+    client.get("/simple/cached-large")
+
+    def run():
+        client.get("/simple/cached-large")
+    return run
+
+
+def measure(run, repeat):
+    """
+    Time run, returning the best time per operation over repeat repeats.
+    """
+    number = 1
+    while True:
+        started = time()
+        for _ in range(number):
+            run()
+        elapsed = time() - started
+        if elapsed >= MIN_REPEAT_TIME:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(MIN_REPEAT_TIME / elapsed) + 1)
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        started = time()
+        for _ in range(number):
+            run()
+        best = min(best, (time() - started) / number)
+    return best
+
+
+def run_benchmarks(names=None, repeat=5):
+    """
+    Run benchmarks.
+
+    :param names: optional names (or name prefixes) of the benchmarks to run
+    :returns: a dictionary mapping benchmark name to seconds per operation
+    """
+    results = {}
+    for name, setup in BENCHMARKS:
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+        context = Context()
+        try:
+            results[name] = measure(setup(context), repeat)
+        finally:
+            context.close()
+        print "{:<40} {:>12.3f} ms".format(name, results[name] * 1000)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare results against a baseline.
+
+    :returns: the names of benchmarks that regressed by more than threshold (e.g. 0.2 for 20%)
+    """
+    regressions = []
+    print
+    print "{:<40} {:>12} {:>12} {:>8}".format("benchmark", "baseline", "current", "change")
+    for name, seconds in sorted(results.iteritems()):
+        if name not in baseline:
+            print "{:<40} {:>12} {:>12.3f} {:>8}".format(name, "-", seconds * 1000, "new")
+            continue
+        change = seconds / baseline[name] - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print "{:<40} {:>12.3f} {:>12.3f} {:>+7.1f}%{}".format(name,
+                                                               baseline[name] * 1000,
+                                                               seconds * 1000,
+                                                               change * 100,
+                                                               flag)
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark cheddar hot paths")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="benchmark names (or prefixes) to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", metavar="PATH", help="save results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare results against a baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="slowdown (as a fraction) that counts as a regression")
+    args = parser.parse_args()
+
+    print "{} {}".format(python_implementation(), python_version())
+    results = run_benchmarks(args.only, args.repeat)
+
+    if args.save:
+        with open(args.save, "w") as file_:
+            dump(dict(python="{} {}".format(python_implementation(), python_version()), results=results),
+                 file_, indent=2, sort_keys=True)
+        print "Saved baseline to: {}".format(args.save)
+
+    if args.compare:
+        with open(args.compare) as file_:
+            baseline = load(file_)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print "{} benchmark(s) regressed by more than {:.0%}".format(len(regressions), args.threshold)
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
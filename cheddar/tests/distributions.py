@@ -0,0 +1,53 @@
+"""
+Generate distributions for tests, benchmarks, and load tests.
+
+Kept apart from `cheddar.tests.fixtures` (which re-exports it) so that tools run
+against a live server need not import the app or its test dependencies.
+"""
+from io import BytesIO
+from tarfile import open as tar_open, TarInfo
+from zipfile import ZipFile
+
+
+PKG_INFO = """\
+Metadata-Version: 1.0
+Name: {name}
+Version: {version}
+Summary: Example distribution
+"""
+
+
+def make_sdist(name, version, members=()):
+    """
+    Generate a minimal source distribution in memory.
+
+    :param members: optional (path, data) pairs, relative to the sdist's top-level
+                    directory, added before PKG-INFO (as setuptools does)
+    :returns: the gzipped tar data
+    """
+    base_dir = "{}-{}".format(name, version)
+    members = [("{}/{}".format(base_dir, path), data) for path, data in members]
+    members.append(("{}/PKG-INFO".format(base_dir), PKG_INFO.format(name=name, version=version)))
+    return make_archive(members)
+
+
+def make_archive(members, zip_=False):
+    """
+    Generate an archive in memory from exact member paths (e.g. for wheels or malformed sdists).
+
+    :param members: (path, data) pairs, in archive order
+    :param zip_: whether to generate a zip (or wheel) instead of a gzipped tar
+    :returns: the archive data
+    """
+    buffer_ = BytesIO()
+    if zip_:
+        with ZipFile(buffer_, "w") as archive:
+            for path, data in members:
+                archive.writestr(path, data)
+    else:
+        with tar_open(fileobj=buffer_, mode="w:gz") as archive:
+            for path, data in members:
+                info = TarInfo(path)
+                info.size = len(data)
+                archive.addfile(info, BytesIO(data))
+    return buffer_.getvalue()
@@ -1,28 +1,37 @@
 """
 Shared test fixtures.
 """
-from os import environ
+from os import environ, makedirs
 from os.path import join
+from shutil import rmtree
 from tempfile import mkdtemp
 
 from mock import patch
 from mockredis import MockRedis
 
 from cheddar.app import create_app
+from cheddar.tests.distributions import make_sdist  # noqa
 
 
-def setup(self):
+def setup(self, **config):
     """
     Setup an instance of the Flask app with suitable temporary directories and mocks.
+
+    :param config: additional settings for the app
     """
     self.config_dir = mkdtemp()
     self.config_file = join(self.config_dir, "cheddar.conf")
     self.local_cache_dir = mkdtemp()
     self.remote_cache_dir = mkdtemp()
+    # storage creates these on first write; tests copy distributions straight into them
+    for cache_dir in (self.local_cache_dir, self.remote_cache_dir):
+        makedirs(join(cache_dir, "releases"))
 
     with open(self.config_file, "w") as file_:
         file_.write('LOCAL_CACHE_DIR = "{}"\n'.format(self.local_cache_dir))
         file_.write('REMOTE_CACHE_DIR = "{}"\n'.format(self.remote_cache_dir))
+        for key, value in sorted(config.iteritems()):
+            file_.write('{} = {!r}\n'.format(key, value))
 
     self.previous_config_file = environ.get("CHEDDAR_SETTINGS")
     environ["CHEDDAR_SETTINGS"] = self.config_file
@@ -30,3 +39,16 @@ def setup(self):
     with patch('cheddar.configure.Redis', MockRedis):
         self.app = create_app(testing=True)
 
+
+def teardown(self):
+    """
+    Restore configuration and remove temporary directories created by `setup`.
+    """
+    if self.previous_config_file is None:
+        del environ["CHEDDAR_SETTINGS"]
+    else:
+        environ["CHEDDAR_SETTINGS"] = self.previous_config_file
+
+    rmtree(self.local_cache_dir)
+    rmtree(self.remote_cache_dir)
+    rmtree(self.config_dir)
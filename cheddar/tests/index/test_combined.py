@@ -0,0 +1,168 @@
+"""
+Test combined index.
+"""
+from collections import OrderedDict
+from threading import Event, Thread
+from time import time
+
+from mock import patch
+from nose.tools import assert_raises, eq_, ok_
+
+from cheddar.exceptions import NotFoundError
+from cheddar.index.combined import (CombinedIndex,
+                                    LOCAL_ONLY,
+                                    MERGED,
+                                    merge_versions,
+                                    REMOTE_SHADOWED,
+                                    RemoteListing)
+from cheddar.tests.fixtures import setup, teardown
+
+
+LOCAL = OrderedDict([("foo-1.1.tar.gz", "/local/foo-1.1.tar.gz"),
+                     ("foo-1.0.tar.gz", "/local/foo-1.0.tar.gz")])
+
+REMOTE = OrderedDict([("foo-1.2.tar.gz", "/remote/foo-1.2.tar.gz"),
+                      ("foo-1.1.zip", "/remote/foo-1.1.zip"),
+                      ("foo-1.0.tar.gz", "/remote/foo-1.0.tar.gz")])
+
+
+def test_merge_versions():
+    eq_(merge_versions(LOCAL, REMOTE, MERGED).items(),
+        [("foo-1.2.tar.gz", "/remote/foo-1.2.tar.gz"),
+         ("foo-1.1.tar.gz", "/local/foo-1.1.tar.gz"),
+         ("foo-1.1.zip", "/remote/foo-1.1.zip"),
+         ("foo-1.0.tar.gz", "/local/foo-1.0.tar.gz")])
+
+
+def test_merge_versions_remote_shadowed():
+    eq_(merge_versions(LOCAL, REMOTE, REMOTE_SHADOWED).items(),
+        [("foo-1.2.tar.gz", "/remote/foo-1.2.tar.gz"),
+         ("foo-1.1.tar.gz", "/local/foo-1.1.tar.gz"),
+         ("foo-1.0.tar.gz", "/local/foo-1.0.tar.gz")])
+
+
+class TestCombinedIndex(object):
+
+    def setup(self):
+        setup(self)
+        self.index = self.app.index
+        for version in ["1.0", "1.1"]:
+            self.app.projects.add_metadata({"name": "foo",
+                                            "version": version,
+                                            "_filename": "foo-{}.tar.gz".format(version)})
+        self.local = self.index.local.get_versions("foo")
+
+    def teardown(self):
+        teardown(self)
+
+    def test_unknown_mode(self):
+        self.app.config["INDEX_MODES"] = {"foo": "remote-only"}
+        with assert_raises(ValueError):
+            CombinedIndex(self.app)
+
+    def test_get_mode(self):
+        self.index.modes = {"foo-bar": MERGED}
+        eq_(self.index.get_mode("Foo_Bar"), MERGED)
+        eq_(self.index.get_mode("foo"), LOCAL_ONLY)
+
+    def test_local_only(self):
+        with patch.object(self.index.remote, "get_versions") as mock_get_versions:
+            eq_(self.index.get_versions("foo"), self.local)
+        eq_(mock_get_versions.call_count, 0)
+
+    def test_merged(self):
+        self.index.modes = {"foo": MERGED}
+        with patch.object(self.index.remote, "_refresh_versions", return_value=REMOTE):
+            versions = self.index.get_versions("foo")
+
+        eq_(list(versions), ["foo-1.2.tar.gz", "foo-1.1.tar.gz", "foo-1.1.zip", "foo-1.0.tar.gz"])
+
+    def test_merged_cached(self):
+        """
+        A fresh cached remote listing is merged without refreshing it.
+        """
+        self.index.modes = {"foo": MERGED}
+        self.index.remote._save_index("foo", REMOTE)
+        with patch.object(self.index.remote, "_get_pool") as mock_get_pool:
+            versions = self.index.get_versions("foo")
+
+        eq_(mock_get_pool.call_count, 0)
+        eq_(len(versions), 4)
+
+    def test_merged_remote_not_found(self):
+        self.index.modes = {"foo": MERGED}
+        with patch.object(self.index.remote, "_refresh_versions", side_effect=NotFoundError()):
+            eq_(self.index.get_versions("foo"), self.local)
+
+            with assert_raises(NotFoundError):
+                self.index.get_versions("bar")
+
+    def test_merged_over_budget(self):
+        """
+        Local versions are served when the remote index is too slow; it finishes in the background.
+        """
+        self.index.modes = {"foo": MERGED}
+        self.index.remote_budget = 0.01
+        released = Event()
+
+        invalidated = []
+
+        def refresh_versions(name, cached_versions):
+            released.wait()
+            return REMOTE
+
+        def invalidate(name, projects=True):
+            # invalidated before the listing is marked done
+            invalidated.append(listing.done.is_set())
+
+        with patch.object(self.index.remote, "_refresh_versions",
+                          side_effect=refresh_versions) as mock_refresh_versions:
+            with patch.object(self.index.rendered, "invalidate", side_effect=invalidate) as mock_invalidate:
+                eq_(self.index.get_versions("foo"), self.local)
+                listing = self.index._listings["foo"]
+
+                # the same listing is awaited again rather than requested twice
+                eq_(self.index.get_versions("foo"), self.local)
+
+                released.set()
+                ok_(listing.done.wait(1))
+
+        eq_(mock_refresh_versions.call_count, 1)
+        mock_invalidate.assert_called_with("foo", projects=False)
+        eq_(invalidated, [False])
+        ok_("foo" not in self.index._listings)
+
+    def test_overlapping_waiters(self):
+        """
+        One waiter running out of budget does not cut short another waiter on the same listing.
+        """
+        listing = RemoteListing()
+        results = {}
+
+        def wait(label, budget):
+            results[label] = self.index._merge_within_budget("foo", MERGED, self.local, listing,
+                                                             time() + budget)
+
+        patient = Thread(target=wait, args=("patient", 5))
+        with patch.object(self.index.metrics, "increment") as mock_increment:
+            patient.start()
+            wait("hasty", 0)
+            ok_(listing.abandoned)
+
+            listing.versions = REMOTE
+            listing.done.set()
+            patient.join()
+
+        eq_(results["hasty"], self.local)
+        eq_(len(results["patient"]), 4)
+        eq_(mock_increment.call_count, 1)
+
+    def test_batch_merged(self):
+        self.index.modes = {"foo": MERGED}
+        with patch.object(self.index.remote, "_refresh_versions", return_value=REMOTE):
+            with patch.object(self.index.remote, "get_versions_batch",
+                              return_value={"bar": OrderedDict()}) as mock_get_versions_batch:
+                results = self.index.get_versions_batch(["foo", "bar"])
+
+        mock_get_versions_batch.assert_called_with(["bar"])
+        eq_(len(results["foo"]), 4)
@@ -0,0 +1,159 @@
+"""
+Test local index.
+"""
+from logging import getLogger
+from os import remove, utime
+from os.path import dirname, join
+from shutil import copyfile
+
+from mock import patch
+from nose.tools import eq_, ok_
+
+from cheddar.index.local import _digest_file
+from cheddar.index.manifest import StorageManifest
+
+from cheddar.tests.fixtures import make_sdist, setup, teardown
+
+
+def _write(path, data):
+    with open(path, "wb") as file_:
+        file_.write(data)
+
+
+class TestLocalIndexRebuild(object):
+
+    def setup(self):
+        setup(self)
+        self.index = self.app.index.local
+        self.releases_dir = join(self.local_cache_dir, "releases")
+        self.example = join(self.releases_dir, "example-1.0.tar.gz")
+        copyfile(join(dirname(__file__), "../data/example-1.0.tar.gz"), self.example)
+
+    def teardown(self):
+        teardown(self)
+
+    def test_rebuild(self):
+        stats = self.index.rebuild(workers=1)
+
+        eq_(stats["parsed"], 1)
+        eq_(stats["skipped"], 0)
+        eq_(self.app.projects.get_listing("example"), {"1.0": "example-1.0.tar.gz"})
+
+    def test_rebuild_skips_unchanged_files(self):
+        self.index.rebuild(workers=1)
+        stats = self.index.rebuild(workers=1)
+
+        eq_(stats["parsed"], 0)
+        eq_(stats["skipped"], 1)
+        eq_(self.app.projects.get_listing("example"), {"1.0": "example-1.0.tar.gz"})
+
+    def test_rebuild_rereads_changed_files(self):
+        self.index.rebuild(workers=1)
+        utime(self.example, (1000, 1000))
+
+        eq_(self.index.rebuild(workers=1)["parsed"], 1)
+
+    def test_rebuild_full(self):
+        self.index.rebuild(workers=1)
+        eq_(self.index.rebuild(workers=1, full=True)["parsed"], 1)
+
+    def test_rebuild_rereads_lost_index(self):
+        self.index.rebuild(workers=1)
+        self.app.projects.remove_metadata("example", "1.0")
+
+        eq_(self.index.rebuild(workers=1)["parsed"], 1)
+        eq_(self.app.projects.get_listing("example"), {"1.0": "example-1.0.tar.gz"})
+
+    def test_rebuild_removes_orphans(self):
+        self.app.projects.add_metadata({"name": "example", "version": "0.9", "_filename": "example-0.9.tar.gz"})
+        self.app.projects.add_metadata({"name": "other", "version": "1.0", "_filename": "other-1.0.tar.gz"})
+
+        stats = self.index.rebuild(workers=1)
+
+        eq_(stats["removed"], 2)
+        eq_(self.app.projects.get_listing("example"), {"1.0": "example-1.0.tar.gz"})
+        eq_(self.app.projects.get_project("other"), None)
+
+    def test_rebuild_removes_deleted_files(self):
+        self.index.rebuild(workers=1)
+        remove(self.example)
+
+        stats = self.index.rebuild(workers=1)
+
+        eq_(stats["removed"], 1)
+        eq_(self.app.projects.list_projects(), [])
+        eq_(self.app.redis.hgetall(self.index.signatures_key), {})
+
+    def test_rebuild_keeps_versions_with_unreadable_files(self):
+        self.index.rebuild(workers=1)
+        with open(self.example, "w") as file_:
+            file_.write("not a tarball")
+
+        stats = self.index.rebuild(workers=1)
+
+        eq_(stats["failed"], 1)
+        eq_(stats["removed"], 0)
+        eq_(self.app.projects.get_listing("example"), {"1.0": "example-1.0.tar.gz"})
+
+    def test_rebuild_keeps_upload_timestamp_and_digests(self):
+        self.index.rebuild(workers=1)
+        uploaded = self.app.projects.get_metadata("example", "1.0")
+        utime(self.example, (1000, 1000))
+
+        eq_(self.index.rebuild(workers=1)["parsed"], 1)
+        metadata = self.app.projects.get_metadata("example", "1.0")
+        eq_(metadata["_uploaded_timestamp"], uploaded["_uploaded_timestamp"])
+        eq_(len(metadata["_sha256_digest"]), 64)
+        eq_(len(metadata["_md5_digest"]), 32)
+
+    def test_get_versions_links_digests(self):
+        self.index.rebuild(workers=1)
+        digest = self.app.projects.get_metadata("example", "1.0")["_sha256_digest"]
+
+        eq_(self.index.get_versions("example"),
+            {"example-1.0.tar.gz": "/local/example-1.0.tar.gz#sha256={}".format(digest)})
+
+    def test_rebuild_repairs_manifest(self):
+        """
+        A lost manifest is rebuilt from the digests computed while reading metadata.
+        """
+        manifest = StorageManifest(self.app.redis, getLogger(), "cheddar.manifest.local")
+        self.index.storage.manifest = manifest
+        manifest.add("gone-1.0.tar.gz", "/gone-1.0.tar.gz", 1, "digest")
+
+        with patch("cheddar.index.local._digest_file", wraps=_digest_file) as mock_digest_file:
+            with patch.object(self.index.storage, "_digest") as mock_digest:
+                eq_(self.index.rebuild(workers=1)["parsed"], 1)
+        eq_(mock_digest_file.call_count, 1)
+        eq_(mock_digest.call_count, 0)
+
+        entry = manifest.get("example-1.0.tar.gz")
+        eq_(entry["sha256"], self.app.projects.get_metadata("example", "1.0")["_sha256_digest"])
+        eq_(manifest.get("gone-1.0.tar.gz"), None)
+        eq_(manifest.totals()[0], 1)
+
+        # unchanged files (with current manifest entries) are skipped
+        eq_(self.index.rebuild(workers=1)["skipped"], 1)
+
+    def test_rebuild_skips_bad_files(self):
+        with open(join(self.releases_dir, "broken-1.0.tar.gz"), "w") as file_:
+            file_.write("not a tarball")
+        _write(join(self.releases_dir, "mismatch-1.0.tar.gz"), make_sdist("other", "1.0"))
+
+        stats = self.index.rebuild(workers=1)
+
+        eq_(stats["parsed"], 1)
+        eq_(stats["failed"], 2)
+        eq_(self.app.projects.get_project("broken"), None)
+
+    def test_rebuild_parallel(self):
+        for version in ["1.1", "1.2", "1.3"]:
+            _write(join(self.releases_dir, "example-{}.tar.gz".format(version)), make_sdist("example", version))
+
+        progress = []
+        stats = self.index.rebuild(workers=2, progress=lambda done, total, _: progress.append((done, total)))
+
+        eq_(stats["parsed"], 4)
+        eq_(progress, [(1, 4), (2, 4), (3, 4), (4, 4)])
+        eq_(sorted(self.app.projects.get_listing("example")), ["1.0", "1.1", "1.2", "1.3"])
+        ok_(stats["rate"] > 0)
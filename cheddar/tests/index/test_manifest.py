@@ -0,0 +1,92 @@
+"""
+Test storage manifest.
+"""
+from logging import getLogger
+from os import remove, utime
+from os.path import join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from mockredis import MockRedis
+from nose.tools import eq_, ok_
+
+from cheddar.index.manifest import StorageManifest
+from cheddar.index.storage import DistributionStorage
+
+
+class TestStorageManifest(object):
+
+    def setup(self):
+        self.base_dir = mkdtemp()
+        self.redis = MockRedis()
+        self.manifest = StorageManifest(self.redis, getLogger(), "cheddar.manifest.local")
+        self.storage = DistributionStorage(self.base_dir, getLogger(), manifest=self.manifest)
+
+    def teardown(self):
+        rmtree(self.base_dir)
+
+    def test_write_adds_entry(self):
+        path = self.storage.write("foo-1.0.tar.gz", "data")
+
+        entry = self.manifest.get("foo-1.0.tar.gz")
+        eq_(entry["path"], path)
+        eq_(entry["size"], 4)
+        eq_(self.storage.stats(), (1, 4))
+        eq_(list(self.storage), [path])
+
+    def test_overwrite_updates_totals(self):
+        self.storage.write("foo-1.0.tar.gz", "data")
+        created = self.manifest.get("foo-1.0.tar.gz")["created"]
+        self.storage.write("foo-1.0.tar.gz", "longer data")
+
+        eq_(self.storage.stats(), (1, 11))
+        eq_(self.manifest.get("foo-1.0.tar.gz")["created"], created)
+
+    def test_commit_adds_entry(self):
+        spooled = self.storage.spool("foo-1.0.tar.gz", StringIO("data"))
+        self.storage.commit(spooled, "foo-1.0.tar.gz")
+
+        eq_(self.manifest.get("foo-1.0.tar.gz")["sha256"], spooled.sha256_digest)
+        eq_(self.storage.stats(), (1, 4))
+
+    def test_remove_removes_entry(self):
+        self.storage.write("foo-1.0.tar.gz", "data")
+        self.storage.write("bar-1.0.tar.gz", "more data")
+        self.storage.remove("foo-1.0.tar.gz")
+
+        eq_(self.manifest.get("foo-1.0.tar.gz"), None)
+        eq_(self.storage.stats(), (1, 9))
+
+        # removing again is harmless
+        self.storage.remove("foo-1.0.tar.gz")
+        eq_(self.storage.stats(), (1, 9))
+
+    def test_oldest(self):
+        foo = self.storage.write("foo-1.0.tar.gz", "data")
+        bar = self.storage.write("bar-1.0.tar.gz", "data")
+        utime(foo, (2000, 2000))
+        utime(bar, (1000, 1000))
+        self.storage.reconcile()
+
+        eq_(self.storage.oldest(), [bar])
+        eq_(self.storage.oldest(2), [bar, foo])
+
+    def test_reconcile(self):
+        foo = self.storage.write("foo-1.0.tar.gz", "data")
+        self.storage.write("bar-1.0.tar.gz", "data")
+
+        # drift: one file appears, one disappears, one changes
+        with open(join(self.storage.release_dir, "baz-1.0.tar.gz"), "w") as file_:
+            file_.write("baz data")
+        remove(join(self.storage.release_dir, "bar-1.0.tar.gz"))
+        with open(foo, "w") as file_:
+            file_.write("new data")
+
+        eq_(self.storage.reconcile(), dict(added=1, updated=1, removed=1))
+        eq_(self.storage.stats(), (2, 16))
+        eq_(self.manifest.get("bar-1.0.tar.gz"), None)
+        ok_(self.manifest.get("baz-1.0.tar.gz") is not None)
+
+        # reconciling again is a no-op
+        eq_(self.storage.reconcile(), dict(added=0, updated=0, removed=0))
@@ -1,6 +1,7 @@
 """
 Test remote index.
 """
+from json import dumps, loads
 from logging import getLogger
 from textwrap import dedent
 
@@ -14,7 +15,8 @@ from cheddar.index.remote import (build_remote_path,
                                   get_absolute_path,
                                   get_base_url,
                                   get_request_location,
-                                  iter_version_links)
+                                  iter_version_links,
+                                  RemoteIndex)
 from cheddar.tests.fixtures import setup
 
 
@@ -204,6 +206,43 @@ def test_iter_version_links():
         next(iter_)
 
 
+def test_iter_listings_spiders_with_project_name():
+    """
+    Spidered pages are filtered by the project's name, not a preceding link's filename.
+    """
+    pages = {
+        "http://pypi.python.org/simple/foo": dedent("""\
+            <html>
+              <body>
+              <a href="../../packages/foo-1.0.tar.gz"/>foo-1.0.tar.gz</a>
+              <a href="http://foo.com/foo" rel="download"/>foo download link</a>
+              </body>
+            </html>"""),
+        "http://foo.com/foo": dedent("""\
+            <html>
+              <body>
+              <a href="http://foo.com/files/foo-1.1.tar.gz"/>foo-1.1.tar.gz</a>
+              <a href="http://foo.com/files/bar-1.0.tar.gz"/>bar-1.0.tar.gz</a>
+              </body>
+            </html>"""),
+    }
+
+    def mock_fetch_url(url, timeout, logger, metrics):
+        response = MagicMock()
+        response.history = []
+        response.headers = {}
+        response.text = pages[url]
+        return response
+
+    app = MagicMock()
+    app.config = dict(INDEX_URL="http://pypi.python.org/simple", GET_TIMEOUT=TIMEOUT)
+    index = RemoteIndex(app)
+    with patch("cheddar.index.remote.fetch_url", side_effect=mock_fetch_url):
+        listings = list(index._iter_listings("http://pypi.python.org/simple/foo", "foo"))
+
+    eq_([filename for filename, _, _ in listings], ["foo-1.0.tar.gz", "foo-1.1.tar.gz"])
+
+
 class TestCachedRemoteIndex(object):
 
     def setup(self):
@@ -237,6 +276,37 @@ class TestCachedRemoteIndex(object):
         self.index._save_index("foo", versions)
         eq_(self.index._get_cached_index("foo"), (versions, False))
 
+    def test_cached_index_ordered(self):
+        versions = {"foo-1.9.tar.gz": "../../packages/foo-1.9.tar.gz",
+                    "foo-1.10.tar.gz": "../../packages/foo-1.10.tar.gz",
+                    "foo-1.0.zip": "../../packages/foo-1.0.zip"}
+        self.index._save_index("foo", versions)
+
+        eq_(loads(self.app.redis.get(self.index._key("foo")))[0],
+            ["foo-1.10.tar.gz", "../../packages/foo-1.10.tar.gz"])
+        with patch("cheddar.model.versions.parse_version") as mock_parse_version:
+            cached_versions, _ = self.index._get_cached_index("foo")
+            eq_(mock_parse_version.call_count, 0)
+        eq_(cached_versions.keys(), ["foo-1.10.tar.gz", "foo-1.9.tar.gz", "foo-1.0.zip"])
+
+    def test_cached_index_legacy_cached(self):
+        """
+        Listings cached as dictionaries are still readable.
+        """
+        self.app.redis.set(self.index._key("foo"), dumps({"foo-1.9.tar.gz": "foo-1.9.tar.gz",
+                                                          "foo-1.10.tar.gz": "foo-1.10.tar.gz"}))
+        cached_versions, _ = self.index._get_cached_index("foo")
+        eq_(cached_versions.keys(), ["foo-1.10.tar.gz", "foo-1.9.tar.gz"])
+
+    def test_save_index_invalidates_rendered(self):
+        self.app.rendered.put("foo", "html", None, "<html/>", "text/html")
+        self.app.rendered.put(None, "html", None, "<html/>", "text/html")
+
+        self.index._save_index("foo", {"foo-1.0.tar.gz": "../../packages/foo-1.0.tar.gz"})
+
+        eq_(self.app.rendered.get("foo", "html")[0], None)
+        ok_(self.app.rendered.get(None, "html")[0] is not None)
+
     def test_cached_index_negative_cached(self):
         self.index._save_negative_index("foo")
         eq_(self.index._get_cached_index("foo"), ({}, False))
@@ -324,3 +394,87 @@ class TestCachedRemoteIndex(object):
                 with assert_raises(NotFoundError):
                     self.index.get_versions("foo")
                 eq_(mocked.call_count, 1)
+
+    def test_get_versions_batch(self):
+        """
+        Fresh cached listings are returned as is; others are fetched.
+        """
+        fresh = {"foo-1.0.tar.gz": "/remote/packages/foo-1.0.tar.gz?base=http%3A%2F%2Fpypi.python.org"}
+        self.index._save_index("foo", fresh)
+
+        HTML = dedent("""\
+            <html>
+              <body>
+                 <a href="../../packages/bar-1.0.tar.gz"/>bar-1.0.tar.gz</a>
+              </body>
+            </html>""")
+
+        def mock_get(url, timeout):
+            response = MagicMock()
+            response.history = []
+            response.headers = {}
+            if url.endswith("/bar"):
+                response.status_code = codes.ok
+                response.text = HTML
+            else:
+                response.status_code = codes.not_found
+            return response
+
+        with patch("cheddar.index.remote.get", side_effect=mock_get) as mocked:
+            results = self.index.get_versions_batch(["foo", "bar", "baz"])
+            eq_(mocked.call_count, 2)
+
+        eq_(results["foo"], fresh)
+        eq_(results["bar"].keys(), ["bar-1.0.tar.gz"])
+        ok_(isinstance(results["baz"], NotFoundError))
+        eq_(results["baz"].status_code, codes.not_found)
+
+        # fetched listings were cached
+        eq_(self.index._get_cached_index("bar")[0], results["bar"])
+        eq_(self.app.redis.get(self.index._key("baz")), "{}")
+
+    def test_get_versions_batch_errors(self):
+        """
+        An unexpected error fetching one project is that project's result.
+        """
+        def mock_refresh_versions(name, cached_versions):
+            if name == "bar":
+                raise ValueError("unparseable")
+            return {}
+
+        with patch.object(self.index, "_refresh_versions", side_effect=mock_refresh_versions):
+            results = self.index.get_versions_batch(["foo", "bar"])
+
+        eq_(results["foo"], {})
+        ok_(isinstance(results["bar"], ValueError))
+
+    def test_get_versions_batch_shares_pool(self):
+        pool = self.index._get_pool()
+        with patch.object(self.index, "_refresh_versions", return_value={}):
+            self.index.get_versions_batch(["foo"])
+            self.index.get_versions_batch(["bar"])
+        ok_(self.index._get_pool() is pool)
+
+        # a forked worker gets its own pool
+        with patch("cheddar.index.remote.getpid", return_value=-1):
+            ok_(self.index._get_pool() is not pool)
+
+    def test_refresh_records_changes(self):
+        """
+        Refreshes are recorded in the change log only when the listing changes.
+        """
+        listing = {"foo-1.0.tar.gz": "/remote/foo-1.0.tar.gz"}
+        updated = dict(listing, **{"foo-1.1.tar.gz": "/remote/foo-1.1.tar.gz"})
+
+        with patch.object(RemoteIndex, "get_versions", side_effect=[listing, listing, updated]):
+            for _ in range(3):
+                cached_versions, _ = self.index._get_cached_index("foo")
+                self.index._refresh_versions("foo", cached_versions)
+
+        eq_([(change["action"], change["name"]) for change in self.app.changelog.recent(10)],
+            [("refresh", "foo"), ("refresh", "foo")])
+
+        with patch.object(RemoteIndex, "get_versions", side_effect=NotFoundError(codes.not_found)):
+            with assert_raises(NotFoundError):
+                self.index._refresh_versions("foo", updated)
+        eq_(self.app.changelog.serial(), 3)
@@ -0,0 +1,157 @@
+"""
+Test distribution storage.
+"""
+from hashlib import md5, sha256
+from logging import getLogger
+from os import listdir, rename
+from os.path import exists, join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+
+from mock import patch
+from nose.tools import eq_, ok_
+
+from cheddar.cache import LRUCache
+from cheddar.index.storage import DistributionStorage
+
+
+class TestDistributionStorage(object):
+
+    def setup(self):
+        self.base_dir = mkdtemp()
+        self.storage = DistributionStorage(self.base_dir, getLogger())
+        self.storage.CHUNK_SIZE = 3
+
+    def teardown(self):
+        rmtree(self.base_dir)
+
+    def test_base_dirs_created_on_first_write(self):
+        """
+        Initializing storage does not touch the file system.
+        """
+        storage = DistributionStorage(join(self.base_dir, "deferred"), getLogger())
+
+        ok_(not exists(storage.base_dir))
+        eq_(storage.read("foo-1.0.tar.gz"), None)
+        eq_(list(storage), [])
+
+        storage.write("foo-1.0.tar.gz", "data")
+        ok_(storage.exists("foo-1.0.tar.gz"))
+
+    def test_base_dirs_created_concurrently(self):
+        """
+        Losing a race to create the base dirs is harmless.
+        """
+        storage = DistributionStorage(join(self.base_dir, "raced"), getLogger())
+        with patch("cheddar.index.storage.isdir", return_value=False):
+            storage.write("foo-1.0.tar.gz", "data")
+            storage.write("bar-1.0.tar.gz", "data")
+        ok_(storage.exists("bar-1.0.tar.gz"))
+
+    def test_read_legacy_partition(self):
+        """
+        Entries stored in the other partition (by earlier releases) are still found.
+        """
+        storage = self.storage
+        storage.write("foo-1.0-py2-none-any.whl", "data")
+        rename(storage.compute_path("foo-1.0-py2-none-any.whl"),
+               join(storage.pre_release_dir, "foo-1.0-py2-none-any.whl"))
+
+        ok_(storage.exists("foo-1.0-py2-none-any.whl"))
+        eq_(storage.read("foo-1.0-py2-none-any.whl")[0], "data")
+        ok_(storage.remove("foo-1.0-py2-none-any.whl"))
+        ok_(not storage.exists("foo-1.0-py2-none-any.whl"))
+
+    def test_spool(self):
+        """
+        Spooling hashes content and keeps it out of release storage.
+        """
+        data = "some distribution content"
+        spooled = self.storage.spool("foo-1.0.tar.gz", StringIO(data))
+
+        eq_(spooled.size, len(data))
+        eq_(spooled.sha256_digest, sha256(data).hexdigest())
+        eq_(spooled.md5_digest, md5(data).hexdigest())
+        ok_(spooled.path.startswith(self.storage.tmp_dir))
+        ok_(spooled.path.endswith("foo-1.0.tar.gz"))
+        ok_(not self.storage.exists("foo-1.0.tar.gz"))
+        eq_(list(self.storage), [])
+
+    def test_commit(self):
+        """
+        Committing moves a spooled file into place.
+        """
+        spooled = self.storage.spool("foo-1.0.tar.gz", StringIO("data"))
+        path = self.storage.commit(spooled, "foo-1.0.tar.gz")
+
+        eq_(path, join(self.storage.release_dir, "foo-1.0.tar.gz"))
+        ok_(not exists(spooled.path))
+        ok_(self.storage.exists("foo-1.0.tar.gz"))
+        eq_(list(self.storage), [path])
+
+    def test_discard(self):
+        """
+        Discarding removes a spooled file.
+        """
+        spooled = self.storage.spool("foo-1.0.tar.gz", StringIO("data"))
+        self.storage.discard(spooled)
+
+        eq_(listdir(self.storage.tmp_dir), [])
+        ok_(not self.storage.exists("foo-1.0.tar.gz"))
+
+
+class TestCachedDistributionStorage(object):
+
+    def setup(self):
+        self.base_dir = mkdtemp()
+        self.cache = LRUCache(1024, sizeof=lambda value: len(value[0]))
+        self.storage = DistributionStorage(self.base_dir, getLogger(), cache=self.cache)
+
+    def teardown(self):
+        rmtree(self.base_dir)
+
+    def test_read_caches_content(self):
+        """
+        Repeated reads are served from the cache.
+        """
+        self.storage.write("foo-1.0.tar.gz", "data")
+        first = self.storage.read("foo-1.0.tar.gz")
+        with patch("cheddar.index.storage.open", create=True) as mocked:
+            eq_(self.storage.read("foo-1.0.tar.gz"), first)
+            eq_(mocked.call_count, 0)
+        eq_(self.cache.stats()["hits"], 1)
+
+    def test_write_invalidates(self):
+        self.storage.write("foo-1.0.tar.gz", "data")
+        self.storage.read("foo-1.0.tar.gz")
+        self.storage.write("foo-1.0.tar.gz", "other")
+        eq_(self.storage.read("foo-1.0.tar.gz")[0], "other")
+
+    def test_remove_invalidates(self):
+        self.storage.write("foo-1.0.tar.gz", "data")
+        self.storage.read("foo-1.0.tar.gz")
+        self.storage.remove("foo-1.0.tar.gz")
+        eq_(self.storage.read("foo-1.0.tar.gz"), None)
+
+    def test_stale_entries_are_reread(self):
+        """
+        Changes made by other processes (e.g. another worker's storage) are seen.
+        """
+        other = DistributionStorage(self.base_dir, getLogger())
+        self.storage.write("foo-1.0.tar.gz", "data")
+        self.storage.read("foo-1.0.tar.gz")
+
+        other.write("foo-1.0.tar.gz", "other content")
+        eq_(self.storage.read("foo-1.0.tar.gz")[0], "other content")
+
+        other.remove("foo-1.0.tar.gz")
+        eq_(self.storage.read("foo-1.0.tar.gz"), None)
+        eq_(len(self.cache), 0)
+
+    def test_large_files_bypass(self):
+        self.cache.max_entry_size = 2
+        self.storage.write("foo-1.0.tar.gz", "data")
+        self.storage.read("foo-1.0.tar.gz")
+        eq_(len(self.cache), 0)
+        eq_(self.cache.stats()["bypasses"], 1)
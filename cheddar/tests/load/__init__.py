@@ -0,0 +1,10 @@
+"""
+Load-test kit: a fake upstream index and a traffic driver.
+
+Serve the fake index, point cheddar's `INDEX_URL` at it, and drive traffic::
+
+    python -m cheddar.tests.load.upstream --port 8001 --latency 50
+    INDEX_URL = "http://127.0.0.1:8001/simple"
+    python -m cheddar.tests.load.driver --url http://localhost:5000 --upstream http://127.0.0.1:8001 \\
+        --username user --password password --concurrency 16 --duration 60
+"""
@@ -0,0 +1,297 @@
+"""
+Replay pip-like traffic against a running cheddar.
+
+Each worker thread repeatedly picks an operation from the traffic mix:
+
+ - list: get a project's listing (as pip does before installing)
+ - download_cached: download a distribution that was downloaded before
+ - download_uncached: download a distribution for the first time
+ - upload: upload a new (generated) source distribution
+ - delete: delete a previously uploaded version
+
+Projects are picked with a skewed (Pareto) distribution, so that a few projects
+are popular, as in real traffic. When the fake upstream's URL is given, the
+report includes upstream requests per cheddar request (amplification).
+
+Usage: python -m cheddar.tests.load.driver --url http://localhost:5000 \\
+           [--upstream http://localhost:8001] [--duration S] [--concurrency N] [--mix list=60,...]
+"""
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from itertools import count
+from json import dump
+from math import ceil
+from random import Random
+from threading import local, Lock, Thread
+from time import time
+
+from requests import codes, get, RequestException, Session
+
+from cheddar.tests.distributions import make_sdist
+
+
+OPERATIONS = ["list", "download_cached", "download_uncached", "upload", "delete"]
+
+DEFAULT_MIX = "list=60,download_cached=25,download_uncached=10,upload=3,delete=2"
+
+
+def parse_mix(mix):
+    """
+    Parse a traffic mix (e.g. "list=60,upload=40") into operation weights.
+    """
+    weights = {}
+    for item in mix.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown operation: {}".format(operation))
+        weights[operation] = float(weight)
+    return weights
+
+
+def percentile(values, fraction):
+    """
+    Compute a percentile (nearest rank) of sorted values.
+    """
+    if not values:
+        return None
+    rank = int(ceil(fraction * len(values))) - 1
+    return values[max(0, min(len(values) - 1, rank))]
+
+
+class Driver(object):
+    """
+    Traffic generator and result collector.
+    """
+
+    def __init__(self, url, projects=100, username=None, password=None, timeout=30, seed=0):
+        self.url = url.rstrip("/")
+        self.projects = projects
+        self.auth = (username, password) if username else None
+        self.timeout = timeout
+        self.seed = seed
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.known = {}
+        self.downloaded = []
+        self._downloaded = set()
+        self.uploaded = []
+        self._uploads = count()
+        self._lock = Lock()
+        self._local = local()
+
+    def run(self, duration, concurrency, weights):
+        """
+        Run workers for duration seconds.
+
+        :returns: the elapsed time
+        """
+        deadline = time() + duration
+        threads = [Thread(target=self._work, args=(index, deadline, weights))
+                   for index in range(concurrency)]
+        started = time()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time() - started
+
+    def list_(self, random):
+        name = self._pick_project(random)
+        response = self._session().get("{}/simple/{}".format(self.url, name),
+                                       headers={"Accept": "application/json"},
+                                       timeout=self.timeout)
+        if response.status_code == codes.ok:
+            versions = response.json().get("versions", {})
+            with self._lock:
+                self.known.update(versions)
+        return response.status_code
+
+    def download_uncached(self, random):
+        with self._lock:
+            candidates = [path for path in self.known.itervalues() if path not in self._downloaded]
+        if not candidates:
+            return self.list_(random)
+        path = random.choice(candidates)
+        status = self._download(path)
+        if status == codes.ok:
+            with self._lock:
+                if path not in self._downloaded:
+                    self._downloaded.add(path)
+                    self.downloaded.append(path)
+        return status
+
+    def download_cached(self, random):
+        with self._lock:
+            downloaded = list(self.downloaded)
+        if not downloaded:
+            return self.download_uncached(random)
+        return self._download(random.choice(downloaded))
+
+    def upload(self, random):
+        index = next(self._uploads)
+        name, version = "loadtest{}".format(self.seed), "1.{}.{}".format(int(time()), index)
+        filename = "{}-{}.tar.gz".format(name, version)
+        response = self._session().post("{}/pypi".format(self.url),
+                                        data={":action": "file_upload", "name": name, "version": version},
+                                        files={"content": (filename, make_sdist(name, version))},
+                                        auth=self.auth,
+                                        timeout=self.timeout)
+        if response.status_code == codes.ok:
+            with self._lock:
+                self.uploaded.append((name, version))
+        return response.status_code
+
+    def delete(self, random):
+        with self._lock:
+            if not self.uploaded:
+                uploaded = None
+            else:
+                uploaded = self.uploaded.pop(random.randrange(len(self.uploaded)))
+        if uploaded is None:
+            return self.upload(random)
+        response = self._session().delete("{}/simple/{}/{}".format(self.url, *uploaded),
+                                          auth=self.auth,
+                                          timeout=self.timeout)
+        return response.status_code
+
+    def _work(self, index, deadline, weights):
+        random = Random("{}:{}".format(self.seed, index))
+        operations, cumulative, total = [], [], 0.0
+        for operation, weight in sorted(weights.iteritems()):
+            total += weight
+            operations.append(operation)
+            cumulative.append(total)
+
+        while time() < deadline:
+            point = random.uniform(0, total)
+            operation = next(op for op, bound in zip(operations, cumulative) if point <= bound)
+            started = time()
+            try:
+                status = getattr(self, "list_" if operation == "list" else operation)(random)
+            except RequestException as error:
+                status = type(error).__name__
+            elapsed = time() - started
+            with self._lock:
+                self.latencies[operation].append(elapsed)
+                if not isinstance(status, int) or status >= 400:
+                    self.errors[operation][status] += 1
+
+    def _download(self, path):
+        response = self._session().get("{}{}".format(self.url, path.split("#", 1)[0]),
+                                       timeout=self.timeout)
+        return response.status_code
+
+    def _pick_project(self, random):
+        return "project{}".format(int(random.paretovariate(1.2) - 1) % self.projects)
+
+    def _session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = Session()
+        return self._local.session
+
+
+def get_upstream_stats(upstream):
+    if upstream is None:
+        return {}
+    return get("{}/stats".format(upstream.rstrip("/")), timeout=10).json()
+
+
+def build_report(driver, elapsed, upstream_before, upstream_after):
+    """
+    Summarize throughput, latency percentiles, errors, and upstream amplification.
+    """
+    total = sum(len(latencies) for latencies in driver.latencies.itervalues())
+    report = dict(elapsed=elapsed,
+                  requests=total,
+                  throughput=total / elapsed if elapsed else 0.0,
+                  operations={})
+    for operation, latencies in sorted(driver.latencies.iteritems()):
+        latencies = sorted(latencies)
+        report["operations"][operation] = dict(count=len(latencies),
+                                               errors=dict(driver.errors[operation]),
+                                               p50=percentile(latencies, 0.50),
+                                               p90=percentile(latencies, 0.90),
+                                               p99=percentile(latencies, 0.99),
+                                               max=latencies[-1])
+
+    if upstream_after:
+        upstream = {kind: upstream_after.get(kind, 0) - upstream_before.get(kind, 0)
+                    for kind in upstream_after}
+        listings = upstream.get("simple", 0) + upstream.get("pages", 0)
+        report["upstream"] = dict(requests=upstream,
+                                  amplification=sum(upstream.values()) / float(max(total, 1)),
+                                  listings_per_list=listings / float(
+                                      max(len(driver.latencies["list"]), 1)),
+                                  packages_per_download=upstream.get("packages", 0) / float(
+                                      max(len(driver.latencies["download_cached"]) +
+                                          len(driver.latencies["download_uncached"]), 1)))
+    return report
+
+
+def print_report(report):
+    print "{} requests in {:.1f}s: {:.1f} requests/second".format(report["requests"],
+                                                                report["elapsed"],
+                                                                report["throughput"])
+    print
+    print "{:<20} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        "operation", "count", "errors", "p50 ms", "p90 ms", "p99 ms", "max ms")
+    for operation, stats in sorted(report["operations"].iteritems()):
+        print "{:<20} {:>8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            operation,
+            stats["count"],
+            sum(stats["errors"].values()),
+            stats["p50"] * 1000,
+            stats["p90"] * 1000,
+            stats["p99"] * 1000,
+            stats["max"] * 1000)
+        for status, errors in sorted(stats["errors"].iteritems()):
+            print "{:<20} {:>8} x {}".format("", errors, status)
+
+    if "upstream" in report:
+        upstream = report["upstream"]
+        print
+        print "upstream requests: {}".format(", ".join("{}={}".format(kind, requests) for kind, requests
+                                                       in sorted(upstream["requests"].iteritems())))
+        print "upstream requests per request: {:.3f}".format(upstream["amplification"])
+        print "upstream listings per list: {:.3f}".format(upstream["listings_per_list"])
+        print "upstream packages per download: {:.3f}".format(upstream["packages_per_download"])
+
+
+def main():
+    parser = ArgumentParser(description="Replay pip-like traffic against cheddar")
+    parser.add_argument("--url", default="http://localhost:5000", help="cheddar's URL")
+    parser.add_argument("--upstream", help="the fake upstream's URL (for amplification)")
+    parser.add_argument("--projects", type=int, default=100, help="projects served upstream")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights")
+    parser.add_argument("--username", help="upload username (required for uploads and deletes)")
+    parser.add_argument("--password")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="also write the report as JSON")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    if (weights.get("upload") or weights.get("delete")) and not args.username:
+        parser.error("--username is required for uploads and deletes")
+
+    driver = Driver(args.url,
+                    projects=args.projects,
+                    username=args.username,
+                    password=args.password,
+                    timeout=args.timeout,
+                    seed=args.seed)
+    upstream_before = get_upstream_stats(args.upstream)
+    elapsed = driver.run(args.duration, args.concurrency, weights)
+    report = build_report(driver, elapsed, upstream_before, get_upstream_stats(args.upstream))
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as file_:
+            dump(report, file_, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Test the load-test kit.
+"""
+from threading import Thread
+
+from nose.tools import eq_, ok_
+from requests import get
+
+from cheddar.tests.fixtures import make_sdist, setup, teardown
+from cheddar.tests.load.driver import parse_mix, percentile
+from cheddar.tests.load.upstream import Upstream, UpstreamServer
+
+
+def test_percentile():
+    values = range(1, 101)
+    eq_(percentile(values, 0.5), 50)
+    eq_(percentile(values, 0.99), 99)
+    eq_(percentile(values, 1.0), 100)
+    eq_(percentile([], 0.5), None)
+
+
+def test_parse_mix():
+    eq_(parse_mix("list=60,upload=40"), dict(list=60.0, upload=40.0))
+
+
+def test_make_sdist():
+    ok_(make_sdist("loadtest", "1.0").startswith("\x1f\x8b"))
+
+
+class TestUpstream(object):
+
+    def setup(self):
+        setup(self)
+        self.upstream = Upstream(projects=4, versions=6, size=1000, redirect_rate=1.0, spider_rate=1.0)
+        self.server = UpstreamServer(("127.0.0.1", 0), self.upstream)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.app.index.remote.index_url = "{}/simple".format(self.server.url)
+
+    def teardown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        teardown(self)
+
+    def test_remote_listing(self):
+        """
+        Cheddar follows redirects and spiders to second pages.
+        """
+        versions = self.app.index.remote.get_versions("project1")
+
+        eq_(sorted(versions), sorted(self.upstream.filenames("project1")))
+        stats = self.upstream.stats()
+        eq_(stats["simple"], 2)
+        eq_(stats["pages"], 1)
+
+    def test_unknown_project(self):
+        eq_(get("{}/simple/other".format(self.server.url)).status_code, 404)
+
+    def test_download(self):
+        response = get("{}/packages/project1-1.0.tar.gz".format(self.server.url))
+
+        eq_(response.status_code, 200)
+        eq_(len(response.content), 1000)
+        eq_(self.upstream.stats()["packages"], 1)
@@ -0,0 +1,253 @@
+"""
+A fake PyPI (simple index) server for load tests.
+
+Serves `/simple/<name>/` listings for generated projects (`project0` through
+`project<N-1>`) and deterministic distribution content under `/packages/`.
+Latency, failures, redirects, and `rel="download"` spidering are configurable,
+and `/stats` reports request counts (by kind) so that drivers can measure how
+many upstream requests cheddar makes per request it serves.
+
+Usage: python -m cheddar.tests.load.upstream [--port PORT] [--latency MS] [--failure-rate F] ...
+"""
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import Counter
+from hashlib import sha256
+from json import dumps
+from random import Random
+from SocketServer import ThreadingMixIn
+from threading import Lock
+from time import sleep
+from urlparse import urlsplit
+
+
+# How many bytes of content are generated at a time?
+CHUNK_SIZE = 64 * 1024
+
+
+class Upstream(object):
+    """
+    Generated projects and simulated upstream behavior.
+    """
+
+    def __init__(self,
+                 projects=100,
+                 versions=50,
+                 size=64 * 1024,
+                 latency=0.0,
+                 jitter=0.0,
+                 failure_rate=0.0,
+                 redirect_rate=0.0,
+                 spider_rate=0.0,
+                 seed=0):
+        """
+        :param projects: number of projects
+        :param versions: number of versions per project
+        :param size: size of each distribution in bytes
+        :param latency: seconds to wait before responding
+        :param jitter: maximum seconds added to (or removed from) latency
+        :param failure_rate: fraction of requests answered with a 503
+        :param redirect_rate: fraction of projects whose listings redirect (to a trailing slash)
+        :param spider_rate: fraction of projects whose listings link (rel="download")
+                            to a second page holding half of their files
+        """
+        self.projects = projects
+        self.versions = versions
+        self.size = size
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.redirect_rate = redirect_rate
+        self.spider_rate = spider_rate
+        self.seed = seed
+        self.random = Random(seed)
+        self.counts = Counter()
+        self._lock = Lock()
+
+    def project_names(self):
+        return ["project{}".format(index) for index in range(self.projects)]
+
+    def filenames(self, name):
+        return ["{}-1.{}.tar.gz".format(name, index) for index in range(self.versions)]
+
+    def has_project(self, name):
+        index = name[len("project"):]
+        return name.startswith("project") and index.isdigit() and int(index) < self.projects
+
+    def redirects(self, name):
+        return self._selected(name, "redirect", self.redirect_rate)
+
+    def spiders(self, name):
+        return self._selected(name, "spider", self.spider_rate)
+
+    def listing(self, name, base_url, page=False):
+        """
+        Render a project's listing (or, if spidered, its second page).
+
+        :param base_url: the server's URL, for absolute spidering links
+        """
+        filenames = self.filenames(name)
+        if self.spiders(name):
+            middle = len(filenames) // 2
+            filenames = filenames[middle:] if page else filenames[:middle]
+
+        lines = ["<html><head><title>Links for {}</title></head><body>".format(name)]
+        for filename in filenames:
+            lines.append('<a href="/packages/{0}#sha256={1}">{0}</a><br/>'.format(
+                filename, sha256(filename).hexdigest()))
+        if self.spiders(name) and not page:
+            lines.append('<a href="{}/pages/{}/" rel="download">more files</a><br/>'.format(
+                base_url, name))
+        lines.append("</body></html>")
+        return "\n".join(lines)
+
+    def content(self, filename):
+        """
+        Generate a distribution's (deterministic) content in chunks.
+        """
+        block = sha256(filename).digest() * (CHUNK_SIZE // 32)
+        remaining = self.size
+        while remaining > 0:
+            yield block[:remaining]
+            remaining -= len(block)
+
+    def delay(self):
+        if self.latency or self.jitter:
+            with self._lock:
+                offset = self.random.uniform(-self.jitter, self.jitter)
+            sleep(max(0.0, self.latency + offset))
+
+    def fails(self):
+        if not self.failure_rate:
+            return False
+        with self._lock:
+            return self.random.random() < self.failure_rate
+
+    def count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _selected(self, name, purpose, rate):
+        """
+        Deterministically select a fraction (rate) of projects for a purpose.
+        """
+        digest = sha256("{}:{}:{}".format(self.seed, purpose, name)).hexdigest()
+        return int(digest[:8], 16) < rate * 0xffffffff
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    """
+    Serve an `Upstream` (as `self.server.upstream`).
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        upstream = self.server.upstream
+        path = urlsplit(self.path).path
+        parts = [part for part in path.split("/") if part]
+
+        if parts == ["stats"]:
+            return self._send(200, dumps(upstream.stats()), "application/json")
+
+        kind = parts[0] if parts else "other"
+        upstream.count(kind)
+        upstream.delay()
+        if upstream.fails():
+            upstream.count("failed")
+            return self._send(503, "Service Unavailable")
+
+        if kind in ("simple", "pages") and len(parts) == 2 and upstream.has_project(parts[1]):
+            name = parts[1]
+            if kind == "simple" and upstream.redirects(name) and not path.endswith("/"):
+                self.send_response(302)
+                self.send_header("Location", "{}/".format(path))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            base_url = "http://{}".format(self.headers.get("Host") or "{}:{}".format(*self.server.server_address))
+            listing = upstream.listing(name, base_url, page=kind == "pages")
+            return self._send(200, listing, "text/html")
+
+        if kind == "packages" and len(parts) == 2:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-gzip")
+            self.send_header("Content-Length", str(upstream.size))
+            self.end_headers()
+            for chunk in upstream.content(parts[1]):
+                self.wfile.write(chunk)
+            return
+
+        return self._send(404, "Not Found")
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class UpstreamServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server for an `Upstream`.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, upstream, verbose=False):
+        HTTPServer.__init__(self, address, UpstreamHandler)
+        self.upstream = upstream
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return "http://{}:{}".format(host, port)
+
+
+def main():
+    parser = ArgumentParser(description="Serve a fake PyPI for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--projects", type=int, default=100)
+    parser.add_argument("--versions", type=int, default=50, help="versions per project")
+    parser.add_argument("--size", type=int, default=64 * 1024, help="distribution size in bytes")
+    parser.add_argument("--latency", type=float, default=50, help="response latency in ms")
+    parser.add_argument("--jitter", type=float, default=25, help="latency jitter in ms")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of 503 responses")
+    parser.add_argument("--redirect-rate", type=float, default=0.1,
+                        help="fraction of projects whose listings redirect")
+    parser.add_argument("--spider-rate", type=float, default=0.1,
+                        help="fraction of projects whose listings span two pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    upstream = Upstream(projects=args.projects,
+                        versions=args.versions,
+                        size=args.size,
+                        latency=args.latency / 1000.0,
+                        jitter=args.jitter / 1000.0,
+                        failure_rate=args.failure_rate,
+                        redirect_rate=args.redirect_rate,
+                        spider_rate=args.spider_rate,
+                        seed=args.seed)
+    server = UpstreamServer((args.host, args.port), upstream, verbose=args.verbose)
+    print "Serving fake index at: {}/simple".format(server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
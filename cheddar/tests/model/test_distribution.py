@@ -0,0 +1,351 @@
+"""
+Test distribution model.
+"""
+from json import dumps
+from logging import getLogger
+from random import Random
+from threading import RLock, Thread
+
+from mock import patch
+from mockredis import MockRedis
+from nose.tools import eq_, ok_
+
+from cheddar.model.distribution import Projects
+
+
+class TestProjects(object):
+
+    def setup(self):
+        self.redis = MockRedis()
+        self.projects = Projects(self.redis, getLogger())
+
+    def test_get_listing_not_found(self):
+        eq_(self.projects.get_listing("foo"), None)
+
+    def test_get_listing(self):
+        for version in ["1.0", "1.1", "2.0"]:
+            self.projects.add_metadata({"name": "foo",
+                                        "version": version,
+                                        "_filename": "foo-{}.tar.gz".format(version)})
+        # incomplete metadata is skipped
+        self.projects.add_metadata({"name": "foo", "version": "3.0"})
+
+        eq_(self.projects.get_listing("foo"), {"1.0": "foo-1.0.tar.gz",
+                                               "1.1": "foo-1.1.tar.gz",
+                                               "2.0": "foo-2.0.tar.gz"})
+
+    def test_get_listing_digests(self):
+        self.projects.add_metadata({"name": "foo",
+                                    "version": "1.0",
+                                    "_filename": "foo-1.0.tar.gz",
+                                    "_sha256_digest": "abc123"})
+        self.projects.add_metadata({"name": "foo",
+                                    "version": "1.1",
+                                    "_filename": "foo-1.1.tar.gz"})
+
+        eq_(self.projects.get_listing("foo"), {"1.0": "foo-1.0.tar.gz",
+                                               "1.1": "foo-1.1.tar.gz"})
+        eq_(self.projects.get_listing("foo", digests=True), {"1.0": ("foo-1.0.tar.gz", "abc123"),
+                                                             "1.1": ("foo-1.1.tar.gz", None)})
+        eq_(self.projects.get_listings(["foo"], digests=True)["foo"]["1.0"],
+            ("foo-1.0.tar.gz", "abc123"))
+
+    def test_get_listing_ordered(self):
+        for version in ["1.9", "1.10", "1.0.dev1", "1.0", "2.0rc1"]:
+            self.projects.add_metadata({"name": "foo",
+                                        "version": version,
+                                        "_filename": "foo-{}.tar.gz".format(version)})
+        self.projects.remove_metadata("foo", "1.9")
+
+        with patch("cheddar.model.distribution.parse_version") as mock_parse_version:
+            listing = self.projects.get_listing("foo")
+            eq_(mock_parse_version.call_count, 0)
+        eq_(listing.keys(), ["2.0rc1", "1.10", "1.0", "1.0.dev1"])
+
+    def test_get_listing_without_order(self):
+        """
+        Versions written without an order are sorted when read.
+        """
+        project = self.projects.add_project("foo")
+        for version in ["1.10", "1.9"]:
+            project.add_version(version).set_metadata({"name": "foo",
+                                                       "version": version,
+                                                       "_filename": "foo-{}.tar.gz".format(version)})
+
+        eq_(self.projects.get_listing("foo").keys(), ["1.10", "1.9"])
+
+        self.projects.get_project("foo").reorder()
+        eq_(self.redis.zrange("cheddar.local.order:foo", 0, -1), ["1.9", "1.10"])
+
+    def test_get_listing_canonical_name(self):
+        self.projects.add_metadata({"name": "foo_bar", "version": "1.0", "_filename": "foo_bar-1.0.tar.gz"})
+        for name in ["foo_bar", "foo-bar", "Foo.Bar", "FOO__BAR"]:
+            eq_(self.projects.get_listing(name), {"1.0": "foo_bar-1.0.tar.gz"})
+        eq_(self.projects.get_metadata("Foo-Bar", "1.0")["_filename"], "foo_bar-1.0.tar.gz")
+
+    def test_add_equivalent_name(self):
+        """
+        Equivalent names are stored under the first project name.
+        """
+        self.projects.add_metadata({"name": "foo_bar", "version": "1.0", "_filename": "foo_bar-1.0.tar.gz"})
+        self.projects.add_metadata({"name": "Foo-Bar", "version": "1.1", "_filename": "Foo-Bar-1.1.tar.gz"})
+
+        eq_([project.name for project in self.projects.list_projects()], ["foo_bar"])
+        eq_(self.projects.get_listing("foo-bar"), {"1.0": "foo_bar-1.0.tar.gz",
+                                                   "1.1": "Foo-Bar-1.1.tar.gz"})
+
+    def test_remove_canonical_name(self):
+        self.projects.add_metadata({"name": "foo_bar", "version": "1.0", "_filename": "foo_bar-1.0.tar.gz"})
+        self.projects.remove_metadata("Foo-Bar", "1.0")
+
+        eq_(self.projects.get_project("foo_bar"), None)
+        eq_(self.redis.hgetall("cheddar.local:names"), {})
+
+    def test_get_listing_round_trips(self):
+        """
+        Listing cost does not grow with the number of versions.
+        """
+        for version in range(100):
+            self.projects.add_metadata({"name": "foo",
+                                        "version": "1.{}".format(version),
+                                        "_filename": "foo-1.{}.tar.gz".format(version)})
+
+        with patch("cheddar.model.distribution.Version.get_metadata") as mock_get_metadata:
+            with patch.object(self.redis, "mget", wraps=self.redis.mget) as mock_mget:
+                with patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as mock_pipeline:
+                    listing = self.projects.get_listing("foo")
+                    eq_(len(listing), 100)
+                    eq_(mock_get_metadata.call_count, 0)
+                    # one pipeline resolves the name and one reads the listing
+                    eq_(mock_pipeline.call_count, 2)
+                    eq_(mock_mget.call_count, 0)
+
+    def test_get_listings(self):
+        self.projects.add_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+        self.projects.add_metadata({"name": "foo", "version": "1.1", "_filename": "foo-1.1.tar.gz"})
+        self.projects.add_metadata({"name": "bar_baz", "version": "2.0", "_filename": "bar_baz-2.0.tar.gz"})
+
+        # one pipeline resolves names (including legacy candidates) and one reads listings
+        with patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as mock_pipeline:
+            listings = self.projects.get_listings(["foo", "Bar-Baz", "missing"])
+            eq_(mock_pipeline.call_count, 2)
+
+        eq_(listings["foo"].items(), [("1.1", "foo-1.1.tar.gz"), ("1.0", "foo-1.0.tar.gz")])
+        eq_(listings["Bar-Baz"].items(), [("2.0", "bar_baz-2.0.tar.gz")])
+        eq_(listings["missing"], None)
+        eq_(self.projects.get_listings([]), {})
+
+    def test_versions_do_not_collide(self):
+        """
+        Name and version boundaries are preserved in keys.
+        """
+        self.projects.add_metadata({"name": "foo-1", "version": "2", "_filename": "foo-1-2.tar.gz"})
+        self.projects.add_metadata({"name": "foo", "version": "1-2", "_filename": "foo-1-2.zip"})
+
+        eq_(self.projects.get_metadata("foo-1", "2")["_filename"], "foo-1-2.tar.gz")
+        eq_(self.projects.get_metadata("foo", "1-2")["_filename"], "foo-1-2.zip")
+
+    def test_get_field(self):
+        self.projects.add_metadata({"name": "foo",
+                                    "version": "1.0",
+                                    "_filename": "foo-1.0.tar.gz",
+                                    "platforms": ["UNKNOWN"]})
+        version = self.projects.get_project("foo").get_version("1.0")
+        eq_(version.get_field("platforms"), ["UNKNOWN"])
+        eq_(version.get_field("summary"), None)
+
+
+class TestLegacyProjects(object):
+
+    def setup(self):
+        self.redis = MockRedis()
+        self.projects = Projects(self.redis, getLogger())
+        self._add_legacy_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+        self._add_legacy_metadata({"name": "foo", "version": "1.1", "_filename": "foo-1.1.tar.gz"})
+
+    def _add_legacy_metadata(self, metadata):
+        name, version = metadata["name"], metadata["version"]
+        self.redis.sadd("cheddar.local", name)
+        self.redis.sadd("cheddar.local.{}".format(name), version)
+        self.redis.set("cheddar.local.{}-{}".format(name, version), dumps(metadata))
+
+    def test_dual_read(self):
+        """
+        Legacy and current metadata are combined while legacy reads are enabled.
+        """
+        self.projects.add_metadata({"name": "foo", "version": "2.0", "_filename": "foo-2.0.tar.gz"})
+
+        eq_(self.projects.get_listing("foo").items(), [("2.0", "foo-2.0.tar.gz"),
+                                                       ("1.1", "foo-1.1.tar.gz"),
+                                                       ("1.0", "foo-1.0.tar.gz")])
+        eq_(self.projects.get_metadata("foo", "1.0")["_filename"], "foo-1.0.tar.gz")
+        eq_(self.projects.get_project("foo").num_versions(), 3)
+
+    def test_get_listings_legacy(self):
+        self.projects.add_metadata({"name": "foo", "version": "2.0", "_filename": "foo-2.0.tar.gz"})
+        self._add_legacy_metadata({"name": "bar", "version": "1.0", "_filename": "bar-1.0.tar.gz"})
+
+        listings = self.projects.get_listings(["foo", "bar"])
+        eq_(listings["foo"].keys(), ["2.0", "1.1", "1.0"])
+        eq_(listings["bar"].items(), [("1.0", "bar-1.0.tar.gz")])
+
+    def test_legacy_reads_disabled(self):
+        projects = Projects(self.redis, getLogger(), legacy_reads=False)
+        eq_(projects.get_listing("foo"), None)
+        eq_(projects.get_metadata("foo", "1.0"), None)
+
+    def test_legacy_name_lookup(self):
+        self._add_legacy_metadata({"name": "foo_bar", "version": "1.0", "_filename": "foo_bar-1.0.tar.gz"})
+        eq_(self.projects.get_listing("foo-bar"), {"1.0": "foo_bar-1.0.tar.gz"})
+
+    def test_legacy_name_lookup_round_trips(self):
+        """
+        Legacy names are checked in the same round trip as the canonical name.
+        """
+        self._add_legacy_metadata({"name": "foo_bar", "version": "1.0", "_filename": "foo_bar-1.0.tar.gz"})
+        with patch.object(self.redis, "pipeline", wraps=self.redis.pipeline) as mock_pipeline:
+            eq_(self.projects.get_project("foo-bar").name, "foo_bar")
+            eq_(mock_pipeline.call_count, 1)
+
+    def test_backfill_names(self):
+        self._add_legacy_metadata({"name": "Foo_Bar", "version": "1.0", "_filename": "Foo_Bar-1.0.tar.gz"})
+
+        eq_(self.projects.backfill_names(), 2)
+        eq_(self.redis.hgetall("cheddar.local:names"), {"foo": "foo", "foo-bar": "Foo_Bar"})
+        eq_(self.projects.backfill_names(), 0)
+
+    def test_remove_legacy(self):
+        self.projects.remove_metadata("foo", "1.0")
+        self.projects.remove_metadata("foo", "1.1")
+
+        eq_(self.redis.smembers("cheddar.local"), set())
+        eq_(self.redis.keys("cheddar.local*"), [])
+
+    def test_migrate(self):
+        # a version uploaded after the rollout must not be clobbered
+        self.projects.add_metadata({"name": "foo", "version": "1.1", "_filename": "foo-1.1.zip"})
+
+        eq_(self.projects.migrate(), 1)
+
+        projects = Projects(self.redis, getLogger(), legacy_reads=False)
+        eq_(projects.get_listing("foo").items(), [("1.1", "foo-1.1.zip"),
+                                                  ("1.0", "foo-1.0.tar.gz")])
+        eq_(self.redis.zrange("cheddar.local.order:foo", 0, -1), ["1.0", "1.1"])
+        ok_(not self.redis.exists("cheddar.local.foo"))
+        ok_(not self.redis.exists("cheddar.local.foo-1.0"))
+        ok_(not self.redis.exists("cheddar.local.foo-1.1"))
+
+        # migrating again is a no-op
+        eq_(self.projects.migrate(), 0)
+
+
+class AtomicMockRedis(MockRedis):
+    """
+    MockRedis that, like Redis, runs each command and each transaction atomically.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AtomicMockRedis, self).__init__(*args, **kwargs)
+        self.lock = RLock()
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        pipe = super(AtomicMockRedis, self).pipeline(transaction, shard_hint)
+        # WATCH snapshots and EXEC checks read raw state, so they need the lock too
+        for name in ("execute", "watch"):
+            setattr(pipe, name, self._atomic(getattr(pipe, name)))
+        return pipe
+
+    def _atomic(self, func):
+        def atomic(*args, **kwargs):
+            with self.lock:
+                return func(*args, **kwargs)
+        return atomic
+
+    def __getattribute__(self, name):
+        attr = super(AtomicMockRedis, self).__getattribute__(name)
+        if name.startswith("_") or name in ("lock", "pipeline", "transaction") or not callable(attr):
+            return attr
+        return self._atomic(attr)
+
+
+class TestConcurrentProjects(object):
+
+    def setup(self):
+        self.redis = AtomicMockRedis()
+        self.projects = Projects(self.redis, getLogger(), legacy_reads=False)
+
+    def assert_no_orphans(self):
+        """
+        Every key is reachable from the project set, and vice versa.
+        """
+        names = set(self.redis.smembers("cheddar.local"))
+        eq_(set(self.redis.hvals("cheddar.local:names")), names)
+
+        expected_keys = set(["cheddar.local", "cheddar.local:names"]) if names else set()
+        for name in names:
+            versions = self.redis.hkeys("cheddar.local.project:{}".format(name))
+            ok_(versions, "project {} has no versions".format(name))
+            expected_keys.add("cheddar.local.project:{}".format(name))
+            expected_keys.add("cheddar.local.order:{}".format(name))
+            eq_(set(self.redis.zrange("cheddar.local.order:{}".format(name), 0, -1)), set(versions))
+            expected_keys.update("cheddar.local.metadata:{}:{}".format(name, version)
+                                 for version in versions)
+        eq_(set(self.redis.keys("cheddar.local*")), expected_keys)
+
+    def test_remove_retries_on_concurrent_add(self):
+        """
+        A version added while the last version is being removed keeps its project.
+        """
+        self.projects.add_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+
+        hkeys = self.redis.hkeys
+        calls = []
+
+        def racing_hkeys(key):
+            result = hkeys(key)
+            if not calls:
+                calls.append(key)
+                self.projects.add_metadata({"name": "foo", "version": "1.1", "_filename": "foo-1.1.tar.gz"})
+            return result
+
+        with patch.object(self.redis, "hkeys", racing_hkeys):
+            self.projects.remove_metadata("foo", "1.0")
+
+        eq_(self.projects.get_listing("foo"), {"1.1": "foo-1.1.tar.gz"})
+        self.assert_no_orphans()
+
+    def test_concurrent_add_and_remove(self):
+        """
+        Concurrent uploads and deletes never leave orphaned keys.
+        """
+        names = ["foo", "Foo_Bar", "foo-bar", "baz"]
+        versions = ["1.0", "1.1", "2.0"]
+        errors = []
+
+        def worker(seed):
+            rng = Random(seed)
+            try:
+                for _ in range(100):
+                    name, version = rng.choice(names), rng.choice(versions)
+                    if rng.random() < 0.5:
+                        self.projects.add_metadata({"name": name,
+                                                    "version": version,
+                                                    "_filename": "{}-{}.tar.gz".format(name, version)})
+                    else:
+                        self.projects.remove_metadata(name, version)
+            except Exception as error:
+                errors.append(error)
+
+        threads = [Thread(target=worker, args=(seed,)) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        eq_(errors, [])
+        self.assert_no_orphans()
+
+        for name in names:
+            for version in versions:
+                self.projects.remove_metadata(name, version)
+        eq_(self.redis.keys("cheddar.local*"), [])
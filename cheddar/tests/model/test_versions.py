@@ -2,14 +2,22 @@
 Test version functions
 """
 from os.path import dirname, join
+from StringIO import StringIO
 
-from nose.tools import eq_
+from mock import patch
+from nose.tools import assert_raises, eq_, ok_
 
-from cheddar.model.versions import (guess_name_and_version,
+from cheddar.model.versions import (canonicalize_name,
+                                    guess_name_and_version,
                                     is_pre_release,
                                     name_match,
+                                    parse_filename,
+                                    parse_filenames,
+                                    parse_version,
                                     read_metadata,
-                                    sort_key)
+                                    sort_key,
+                                    sort_versions)
+from cheddar.tests.distributions import make_archive, make_sdist, PKG_INFO
 
 
 def test_parse_name_and_version():
@@ -31,6 +39,74 @@ def test_parse_name_and_version():
              version="1.0"))
 
 
+def test_read_metadata_file_object():
+    path = join(dirname(__file__), "../data/example-1.0.tar.gz")
+    with open(path) as file_:
+        metadata = read_metadata(file_, "example-1.0.tar.gz")
+    eq_(metadata, read_metadata(path))
+
+
+def test_read_metadata_tar_prefers_top_level():
+    nested = PKG_INFO.format(name="nested", version="1.0")
+    archive = make_sdist("foo", "1.0", [("foo.egg-info/PKG-INFO", nested), ("setup.py", "")])
+    eq_(read_metadata(StringIO(archive), "foo-1.0.tar.gz")["name"], "foo")
+
+
+def test_read_metadata_tar_nested_fallback():
+    pkg_info = PKG_INFO.format(name="foo", version="1.0")
+    archive = make_archive([("foo-1.0/setup.py", ""), ("foo-1.0/foo.egg-info/PKG-INFO", pkg_info)])
+    eq_(read_metadata(StringIO(archive), "foo-1.0.tar.gz")["name"], "foo")
+
+
+def test_read_metadata_zip():
+    pkg_info = PKG_INFO.format(name="foo", version="1.0")
+    archive = make_archive([("foo-1.0/setup.py", ""), ("foo-1.0/PKG-INFO", pkg_info)], zip_=True)
+    metadata = read_metadata(StringIO(archive), "foo-1.0.zip")
+    eq_(metadata["name"], "foo")
+    eq_(metadata["version"], "1.0")
+
+
+def test_read_metadata_wheel():
+    pkg_info = PKG_INFO.format(name="foo", version="1.0")
+    archive = make_archive([("foo/__init__.py", ""),
+                            ("foo-1.0.dist-info/METADATA", pkg_info),
+                            ("foo-1.0.dist-info/WHEEL", "Wheel-Version: 1.0\n")],
+                           zip_=True)
+    metadata = read_metadata(StringIO(archive), "foo-1.0-py2-none-any.whl")
+    eq_(metadata["name"], "foo")
+    eq_(metadata["version"], "1.0")
+
+
+def test_read_metadata_wheel_root_metadata():
+    root_metadata = ("METADATA", PKG_INFO.format(name="root", version="1.0"))
+    pkg_info = PKG_INFO.format(name="foo", version="1.0")
+    archive = make_archive([root_metadata, ("foo-1.0.dist-info/METADATA", pkg_info)], zip_=True)
+    eq_(read_metadata(StringIO(archive), "foo-1.0-py2-none-any.whl")["name"], "foo")
+
+    archive = make_archive([root_metadata], zip_=True)
+    with assert_raises(ValueError):
+        read_metadata(StringIO(archive), "foo-1.0-py2-none-any.whl")
+
+
+def test_read_metadata_truncated():
+    data = make_sdist("foo", "1.0", [("setup.py", "x" * 10000)])
+    # stop short of the PKG-INFO member
+    for length in [3, 5, 20, len(data) // 2, len(data) - 30]:
+        with assert_raises(ValueError):
+            read_metadata(StringIO(data[:length]), "foo-1.0.tar.gz")
+
+
+def test_read_metadata_errors():
+    with assert_raises(ValueError):
+        read_metadata(StringIO(make_archive([("foo-1.0/setup.py", "")])), "foo-1.0.tar.gz")
+    with assert_raises(ValueError):
+        read_metadata(StringIO("not an archive"), "foo-1.0.tar.gz")
+    with assert_raises(ValueError):
+        read_metadata(StringIO("not an archive"), "foo-1.0.zip")
+    with assert_raises(ValueError):
+        read_metadata(StringIO(""), "foo-1.0.exe")
+
+
 def test_guess_name_and_version():
 
     def validate_guess(basename, expected_name, expected_version):
@@ -44,11 +120,57 @@ def test_guess_name_and_version():
              # hypenated names are a bad idea!
              ("foo-bar-1.0.tar.gz", "foo-bar", "1.0"),
              # weird versions extensions are also a bad idea (but may be required when forking)
-             ("foo-1.0-bar.tar.gz", "foo", "1.0-bar")]
+             ("foo-1.0-bar.tar.gz", "foo", "1.0-bar"),
+             ("foo-1.0-1.tar.gz", "foo", "1.0-1"),
+             # names may end in a number
+             ("project-1-1.0.tar.gz", "project-1", "1.0"),
+             ("foo-1-1.tar.gz", "foo", "1-1"),
+             ("foo-1.0.tar.bz2", "foo", "1.0"),
+             ("foo-1.0.tgz", "foo", "1.0"),
+             ("foo_bar-1.0-py2.py3-none-any.whl", "foo_bar", "1.0"),
+             ("foo-1.0-1-cp27-cp27mu-manylinux1_x86_64.whl", "foo", "1.0"),
+             ("foo-1.0-py2.7.egg", "foo", "1.0"),
+             ("foo-1.0-py2.7-linux-x86_64.egg", "foo", "1.0")]
     for basename, expected_name, expected_version in cases:
         yield validate_guess, basename, expected_name, expected_version
 
 
+def test_guess_name_and_version_errors():
+    for basename in ["foo-1.0.exe", "foo", "foo.tar.gz"]:
+        with assert_raises(ValueError):
+            guess_name_and_version(basename)
+
+
+def test_parse_filename():
+    parsed = parse_filename("Foo_Bar-1.0rc1-py2-none-any.whl")
+
+    eq_(parsed.name, "Foo_Bar")
+    eq_(parsed.version, "1.0rc1")
+    eq_(parsed.canonical_name, "foo-bar")
+    eq_(parsed.parsed_version, parse_version("1.0rc1"))
+    ok_(parsed.is_pre_release)
+
+
+def test_parse_filename_memoized():
+    parse_filename("memoized-1.0.tar.gz")
+    with patch("cheddar.model.versions.parse_version") as mock_parse_version:
+        eq_(parse_filename("memoized-1.0.tar.gz").version, "1.0")
+        eq_(mock_parse_version.call_count, 0)
+
+
+def test_parse_filenames():
+    parsed = parse_filenames(["foo-1.0.tar.gz", "foo-1.1b1.zip", "index.html"])
+
+    eq_(parsed["foo-1.0.tar.gz"], parse_filename("foo-1.0.tar.gz"))
+    ok_(parsed["foo-1.1b1.zip"].is_pre_release)
+    eq_(parsed["index.html"], None)
+
+
+def test_sort_versions():
+    versions = {"foo-1.0.tar.gz": "a", "foo-1.1.tar.gz": "b", "foo-1.0.1.tar.gz": "c", "foo": "d"}
+    eq_(list(sort_versions(versions)), ["foo-1.1.tar.gz", "foo-1.0.1.tar.gz", "foo-1.0.tar.gz", "foo"])
+
+
 def test_sort_key():
     versions = ["foo-1.1",
                 "foo-1.0.1",
@@ -70,11 +192,19 @@ def test_name_match():
              ("foo", "bar", False),
              ("foo-bar", "foo_bar", True),
              ("foo-bar", "foobar", False),
+             ("foo.bar", "Foo_Bar", True),
              ]
     for this, that, expected in cases:
         yield validate_name_match, this, that, expected
 
 
+def test_canonicalize_name():
+    eq_(canonicalize_name("Foo"), "foo")
+    eq_(canonicalize_name("foo_bar"), "foo-bar")
+    eq_(canonicalize_name("Foo.Bar"), "foo-bar")
+    eq_(canonicalize_name("foo__-.bar"), "foo-bar")
+
+
 def test_is_pre_release():
 
     def validate_is_pre_release(basename, expected):
@@ -99,6 +229,8 @@ def test_is_pre_release():
              ("foo-1.0-dev", True),
              ("foo-1.0-xx", False),
              ("foo-1.0-xx.dev1", True),
-             ("foo-1.0-1", False)]
+             ("foo-1.0-1", False),
+             ("foo-1.0-py2-none-any.whl", False),
+             ("foo-1.0b1-py2-none-any.whl", True)]
     for basename, expected in cases:
         yield validate_is_pre_release, basename, expected
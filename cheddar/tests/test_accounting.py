@@ -0,0 +1,88 @@
+"""
+Test Redis accounting.
+"""
+from threading import Thread
+
+from mockredis import MockRedis
+from nose.tools import eq_
+
+from cheddar.accounting import CountingRedis
+
+
+class TestCountingRedis(object):
+
+    def setup(self):
+        self.redis = CountingRedis(MockRedis())
+
+    def test_commands(self):
+        with self.redis.track() as stats:
+            self.redis.set("foo", "bar")
+            eq_(self.redis.get("foo"), "bar")
+
+        eq_(stats.commands, 2)
+        eq_(stats.round_trips, 2)
+
+    def test_untracked(self):
+        self.redis.set("foo", "bar")
+        with self.redis.track() as stats:
+            pass
+        self.redis.get("foo")
+
+        eq_(stats.round_trips, 0)
+        # untracked commands are not wrapped
+        eq_(self.redis.get, self.redis._redis.get)
+
+    def test_other_threads_untracked(self):
+        with self.redis.track() as stats:
+            thread = Thread(target=self.redis.get, args=("foo",))
+            thread.start()
+            thread.join()
+
+        eq_(stats.round_trips, 0)
+
+    def test_pipeline(self):
+        with self.redis.track() as stats:
+            pipe = self.redis.pipeline()
+            pipe.set("foo", "bar").set("bar", "baz")
+            pipe.get("foo")
+            eq_(pipe.execute(), [True, True, "bar"])
+            # nothing queued; no round trip
+            eq_(pipe.execute(), [])
+
+        eq_(stats.commands, 3)
+        eq_(stats.round_trips, 1)
+
+    def test_transaction(self):
+        self.redis.set("foo", "1")
+
+        def increment(pipe):
+            value = int(pipe.get("foo"))
+            pipe.multi()
+            pipe.set("foo", value + 1)
+            return value + 1
+
+        with self.redis.track() as stats:
+            eq_(self.redis.transaction(increment, "foo", value_from_callable=True), 2)
+
+        eq_(self.redis.get("foo"), "2")
+        # WATCH, GET, and MULTI/SET/EXEC
+        eq_(stats.commands, 3)
+        eq_(stats.round_trips, 3)
+
+    def test_nested_tracking(self):
+        with self.redis.track() as outer:
+            self.redis.get("foo")
+            with self.redis.track() as inner:
+                self.redis.get("bar")
+
+        eq_(outer.round_trips, 2)
+        eq_(inner.round_trips, 1)
+
+    def test_scan_iter(self):
+        for index in range(25):
+            self.redis.set("key{}".format(index), index)
+
+        with self.redis.track() as stats:
+            eq_(len(list(self.redis.scan_iter(match="key*"))), 25)
+
+        eq_(stats.round_trips, 3)
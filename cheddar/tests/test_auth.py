@@ -0,0 +1,108 @@
+"""
+Test authentication.
+"""
+from logging import getLogger
+
+from mock import patch
+from mockredis import MockRedis
+from nose.tools import eq_, ok_
+
+from cheddar.auth import hash_password, is_hashed, Users, verify_password
+
+
+def test_hash_password():
+    record = hash_password("secret", 10)
+    ok_(is_hashed(record))
+    ok_(record.startswith("pbkdf2_sha256$10$"))
+    ok_(record != hash_password("secret", 10))
+    ok_(verify_password("secret", record))
+    ok_(verify_password(u"secret", record))
+    ok_(not verify_password("wrong", record))
+
+
+def test_verify_plaintext_password():
+    ok_(verify_password("secret", "secret"))
+    ok_(not verify_password("wrong", "secret"))
+
+
+class TestUsers(object):
+
+    def setup(self):
+        self.redis = MockRedis()
+        self.users = Users(self.redis, getLogger(), 10, cache_ttl=60)
+
+    def test_set_password(self):
+        self.users.set_password("alice", "secret")
+        ok_(is_hashed(self.redis.get("cheddar.user.alice")))
+        ok_(self.users.verify("alice", "secret"))
+        ok_(not self.users.verify("alice", "wrong"))
+        ok_(not self.users.verify("bob", "secret"))
+
+    def test_verify_malformed_record(self):
+        for record in ["pbkdf2_sha256$10$salt", "pbkdf2_sha256$ten$salt$hash", "pbkdf2_sha256$10$salt$hash$extra"]:
+            self.redis.set("cheddar.user.alice", record)
+            ok_(not self.users.verify("alice", "secret"))
+
+    def test_verify_cached(self):
+        self.users.set_password("alice", "secret")
+
+        with patch("cheddar.auth.verify_password", wraps=verify_password) as mock_verify:
+            for _ in range(5):
+                ok_(self.users.verify("alice", "secret"))
+            ok_(not self.users.verify("alice", "wrong"))
+            eq_(mock_verify.call_count, 1)
+
+    def test_verify_cache_expired(self):
+        self.users.set_password("alice", "secret")
+        ok_(self.users.verify("alice", "secret"))
+
+        with patch("cheddar.auth.time", lambda: 10 ** 10):
+            with patch("cheddar.auth.verify_password", wraps=verify_password) as mock_verify:
+                ok_(self.users.verify("alice", "secret"))
+                eq_(mock_verify.call_count, 1)
+
+    def test_password_change_invalidates_cache(self):
+        """
+        Changing a password in another process invalidates cached credentials.
+        """
+        self.users.set_password("alice", "secret")
+        ok_(self.users.verify("alice", "secret"))
+
+        Users(self.redis, getLogger(), 10).set_password("alice", "changed")
+        ok_(not self.users.verify("alice", "secret"))
+        ok_(self.users.verify("alice", "changed"))
+
+        Users(self.redis, getLogger(), 10).remove("alice")
+        ok_(not self.users.verify("alice", "changed"))
+
+    def test_verify_plaintext_upgrades(self):
+        self.redis.set("cheddar.user.alice", "secret")
+
+        ok_(self.users.verify("alice", "secret"))
+        ok_(is_hashed(self.redis.get("cheddar.user.alice")))
+        ok_(self.users.verify("alice", "secret"))
+
+    def test_upgrade(self):
+        self.redis.set("cheddar.user.alice", "secret")
+        self.users.set_password("bob", "secret")
+
+        eq_(self.users.upgrade(), 1)
+        eq_(self.users.upgrade(), 0)
+        ok_(verify_password("secret", self.redis.get("cheddar.user.alice")))
+
+    def test_list_and_remove(self):
+        self.users.set_password("bob", "secret")
+        self.users.set_password("alice", "secret")
+        eq_(self.users.list_users(), ["alice", "bob"])
+
+        ok_(self.users.remove("alice"))
+        ok_(not self.users.remove("alice"))
+        eq_(self.users.list_users(), ["bob"])
+
+    def test_cache_disabled(self):
+        users = Users(self.redis, getLogger(), 10)
+        users.set_password("alice", "secret")
+        with patch("cheddar.auth.verify_password", wraps=verify_password) as mock_verify:
+            ok_(users.verify("alice", "secret"))
+            ok_(users.verify("alice", "secret"))
+            eq_(mock_verify.call_count, 2)
@@ -0,0 +1,75 @@
+"""
+Test in-process caching.
+"""
+from logging import getLogger
+
+from mockredis import MockRedis
+from nose.tools import eq_, ok_
+
+from cheddar.cache import LRUCache
+from cheddar.metrics import Metrics
+
+
+def test_get_put():
+    cache = LRUCache(10)
+    eq_(cache.get("foo"), None)
+    ok_(cache.put("foo", "bar"))
+    eq_(cache.get("foo"), "bar")
+    eq_(cache.stats()["hits"], 1)
+    eq_(cache.stats()["misses"], 1)
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(6)
+    cache.put("a", "aa")
+    cache.put("b", "bb")
+    cache.put("c", "cc")
+    # touch "a" so that "b" is least recently used
+    cache.get("a")
+    cache.put("d", "dd")
+
+    eq_(cache.get("b"), None)
+    eq_(cache.get("a"), "aa")
+    eq_(cache.get("d"), "dd")
+    eq_(cache.size, 6)
+    eq_(cache.stats()["evictions"], 1)
+
+
+def test_replace_updates_size():
+    cache = LRUCache(10)
+    cache.put("a", "aaaa")
+    cache.put("a", "aa")
+    eq_(cache.size, 2)
+    eq_(len(cache), 1)
+
+
+def test_large_entries_bypass():
+    cache = LRUCache(10, max_entry_size=3)
+    cache.put("a", "aa")
+    ok_(not cache.put("b", "bbbb"))
+    eq_(cache.get("b"), None)
+    eq_(cache.get("a"), "aa")
+    eq_(cache.stats()["bypasses"], 1)
+
+
+def test_invalidate():
+    cache = LRUCache(10)
+    cache.put("a", "aa")
+    cache.invalidate("a")
+    eq_(cache.get("a"), None)
+    eq_(cache.size, 0)
+
+
+def test_metrics():
+    metrics = Metrics(MockRedis(), getLogger())
+    cache = LRUCache(4, metrics=metrics, name="test")
+    cache.get("foo")
+    cache.put("foo", "bar")
+    cache.get("foo")
+    cache.put("baz", "bazbaz")
+    cache.put("qux", "qux")
+    metrics.flush()
+
+    rendered = metrics.render()
+    for event, count in [("bypass", 1), ("eviction", 1), ("hit", 1), ("miss", 1)]:
+        ok_('cheddar_cache_events_total{{cache="test",event="{}"}} {}\n'.format(event, count) in rendered)
@@ -0,0 +1,67 @@
+"""
+Test change log.
+"""
+from nose.tools import eq_
+
+from cheddar.changelog import ChangeLog
+from cheddar.tests.fixtures import setup, teardown
+
+
+class TestChangeLog(object):
+
+    def setup(self):
+        setup(self)
+        self.changelog = self.app.changelog
+
+    def teardown(self):
+        teardown(self)
+
+    def test_record(self):
+        eq_(self.changelog.serial(), 0)
+        eq_(self.changelog.record(ChangeLog.UPLOAD, "foo", "1.0"), 1)
+        eq_(self.changelog.record(ChangeLog.REFRESH, "bar"), 2)
+        eq_(self.changelog.serial(), 2)
+
+        eq_([(change["action"], change["name"], change["version"]) for change in self.changelog.recent(10)],
+            [(ChangeLog.REFRESH, "bar", None), (ChangeLog.UPLOAD, "foo", "1.0")])
+
+    def test_since(self):
+        for version in range(5):
+            self.changelog.record(ChangeLog.UPLOAD, "foo", "1.{}".format(version))
+
+        result = self.changelog.since(0, 2)
+        eq_([change["serial"] for change in result["changes"]], [1, 2])
+        eq_(result["more"], True)
+        eq_(result["serial"], 5)
+        eq_(result["truncated"], False)
+
+        result = self.changelog.since(4, 2)
+        eq_([change["serial"] for change in result["changes"]], [5])
+        eq_(result["more"], False)
+
+    def test_capped(self):
+        self.changelog.size = 3
+        for version in range(5):
+            self.changelog.record(ChangeLog.UPLOAD, "foo", "1.{}".format(version))
+
+        eq_(len(self.changelog.recent(10)), 3)
+        eq_(self.changelog.since(0, 10)["truncated"], True)
+        eq_(self.changelog.since(1, 10)["truncated"], True)
+        eq_(self.changelog.since(2, 10)["truncated"], False)
+
+    def test_change_in_transaction(self):
+        change = self.changelog.change(ChangeLog.UPLOAD, "foo", "1.0")
+
+        def _write(pipe):
+            change.prepare(pipe)
+            pipe.multi()
+            pipe.set("other", "value")
+            change.queue(pipe)
+
+        self.app.redis.transaction(_write)
+
+        eq_(change.serial, 1)
+        eq_(self.changelog.serial(), 1)
+        eq_(self.app.redis.get("other"), "value")
+        eq_([(entry["action"], entry["name"]) for entry in self.changelog.recent(10)],
+            [(ChangeLog.UPLOAD, "foo")])
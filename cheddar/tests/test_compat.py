@@ -0,0 +1,20 @@
+"""
+Test dependency compatibility.
+"""
+from mock import MagicMock, patch
+
+from cheddar.compat import zadd
+
+
+def test_zadd_keywords():
+    redis = MagicMock()
+    with patch("cheddar.compat.REDIS_ZADD_MAPPING", False):
+        zadd(redis, "key", {"foo": 1.0})
+    redis.zadd.assert_called_with("key", foo=1.0)
+
+
+def test_zadd_mapping():
+    redis = MagicMock()
+    with patch("cheddar.compat.REDIS_ZADD_MAPPING", True):
+        zadd(redis, "key", {"foo": 1.0})
+    redis.zadd.assert_called_with("key", {"foo": 1.0})
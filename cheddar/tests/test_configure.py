@@ -0,0 +1,109 @@
+"""
+Test application configuration.
+"""
+from os.path import exists
+
+from flask import Flask
+from mock import patch
+from mockredis import MockRedis
+from nose.tools import eq_, ok_
+
+from cheddar import defaults
+from cheddar.app import create_app
+from cheddar.configure import _create_redis, after_fork
+from cheddar.tests.fixtures import setup, teardown
+
+
+class TestCreateRedis(object):
+
+    def setup(self):
+        self.app = Flask(__name__)
+        self.app.config.from_object(defaults)
+
+    def test_default_pool(self):
+        with patch("cheddar.configure.Redis") as mock_redis:
+            _create_redis(self.app)
+        mock_redis.assert_called_with(self.app.config["REDIS_HOSTNAME"])
+
+    def test_bounded_pool(self):
+        self.app.config["REDIS_MAX_CONNECTIONS"] = 8
+        with patch("cheddar.configure.Redis") as mock_redis:
+            _create_redis(self.app)
+        _, kwargs = mock_redis.call_args
+        pool = kwargs["connection_pool"]
+        eq_(pool.max_connections, 8)
+        eq_(pool.timeout, self.app.config["REDIS_POOL_TIMEOUT"])
+        eq_(pool.connection_kwargs["host"], self.app.config["REDIS_HOSTNAME"])
+
+
+class TestRequestLogging(object):
+
+    def setup(self):
+        setup(self)
+        with open(self.config_file, "a") as file_:
+            file_.write("REQUEST_LOG_SAMPLE_RATE = 1\n")
+        with patch("cheddar.configure.Redis", MockRedis):
+            self.app = create_app(testing=True)
+        self.client = self.app.test_client()
+
+    def teardown(self):
+        teardown(self)
+
+    def test_sampled_request(self):
+        self.app.projects.add_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+
+        with patch.object(self.app.logger, "info") as mock_info:
+            self.client.get("/simple/foo")
+
+        records = [kwargs["extra"]["request"] for _, kwargs in mock_info.call_args_list
+                   if "extra" in kwargs]
+        eq_(len(records), 1)
+        eq_(records[0]["endpoint"], "get_project")
+        eq_(records[0]["name"], "foo")
+        eq_(records[0]["status"], 200)
+        ok_(records[0]["redis_round_trips"] > 0)
+
+
+class TestStartup(object):
+
+    def setup(self):
+        setup(self)
+
+    def teardown(self):
+        teardown(self)
+
+    def test_lazy_startup(self):
+        """
+        Creating the app neither connects to Redis nor creates storage directories.
+        """
+        with open(self.config_file, "a") as file_:
+            file_.write('LOCAL_CACHE_DIR = "{}/local"\n'.format(self.config_dir))
+            file_.write('REMOTE_CACHE_DIR = "{}/remote"\n'.format(self.config_dir))
+            file_.write('REDIS_HOSTNAME = "redis.invalid"\n')
+
+        app = create_app(testing=True)
+
+        ok_(not exists(app.local_storage.base_dir))
+        ok_(not exists(app.remote_storage.base_dir))
+
+    def test_preload(self):
+        with open(self.config_file, "a") as file_:
+            file_.write("PRELOAD = True\n")
+        with patch("cheddar.configure.Redis", MockRedis):
+            with patch("cheddar.configure.import_module") as mock_import:
+                app = create_app(testing=True)
+
+        eq_(sorted(args[0] for args, _ in mock_import.call_args_list),
+            ["BeautifulSoup", "magic", "pkg_resources", "pkginfo"])
+        ok_(app.jinja_env.cache)
+
+    def test_after_fork(self):
+        app = create_app(testing=True)
+        app.metrics.increment("foo_total")
+        pool = app.redis.connection_pool
+        pool.pid = -1
+
+        after_fork(app)
+
+        eq_(app.metrics._pending, {})
+        ok_(pool.pid > 0)
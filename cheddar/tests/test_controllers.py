@@ -3,11 +3,14 @@ Test controller behavior.
 """
 from base64 import b64encode
 from contextlib import contextmanager
-from json import loads
-from os import environ
+from hashlib import sha256
+from json import dumps, loads
+from os import environ, listdir
 from os.path import dirname, exists, join
 from shutil import copyfile, rmtree
+from StringIO import StringIO
 from textwrap import dedent
+from zlib import decompress, MAX_WBITS
 
 from mock import patch
 from nose.tools import assert_raises, eq_, ok_
@@ -46,7 +49,38 @@ class TestControllers(object):
     def test_index_template_json(self):
         result = self.client.get("/", headers=self.use_json)
         eq_(result.status_code, codes.ok)
-        eq_(loads(result.data), dict(history=[]))
+        eq_(loads(result.data), dict(history=[], changes=[]))
+
+    def test_index_template_render_changes(self):
+        self.app.changelog.record("upload", "foo", "1.0")
+        self.app.changelog.record("refresh", "bar")
+        result = self.client.get("/")
+        eq_(result.status_code, codes.ok)
+        ok_('href="/simple/foo/1.0"' in result.data)
+        ok_('href="/simple/bar"' in result.data)
+
+    def test_list_changes(self):
+        with open(join(dirname(__file__), "data/example-1.0.tar.gz")) as file_:
+            self.client.post("/pypi", data={"file": (file_, "example-1.0.tar.gz")}, headers=self.use_auth)
+        self.client.delete("/simple/example/1.0", headers=self.use_auth)
+
+        result = loads(self.client.get("/changes").data)
+        eq_([(change["serial"], change["action"], change["name"], change["version"])
+             for change in result["changes"]],
+            [(1, "upload", "example", "1.0"), (2, "remove", "example", "1.0")])
+        eq_(result["serial"], 2)
+        eq_(result["more"], False)
+        eq_(result["truncated"], False)
+
+        result = loads(self.client.get("/changes?since=1&limit=1").data)
+        eq_([change["serial"] for change in result["changes"]], [2])
+
+        result = loads(self.client.get("/changes?since=2").data)
+        eq_(result["changes"], [])
+
+    def test_list_changes_bad_request(self):
+        eq_(self.client.get("/changes?since=foo").status_code, codes.bad_request)
+        eq_(self.client.get("/changes?limit=0").status_code, codes.bad_request)
 
     def test_get_projects_no_projects_template_render(self):
         result = self.client.get("/simple")
@@ -108,6 +142,178 @@ class TestControllers(object):
                                      versions={"foo-1.0.tar.gz": "/local/foo-1.0.tar.gz",
                                                "foo-1.1.tar.gz": "/local/foo-1.1.tar.gz"}))
 
+    def test_get_project_etag(self):
+        self.app.projects.add_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+
+        result = self.client.get("/simple/foo")
+        eq_(result.status_code, codes.ok)
+        etag, _ = result.get_etag()
+        ok_(etag)
+        eq_(result.headers["Cache-Control"], self.app.config["LISTING_CACHE_CONTROL"])
+
+        with patch.object(self.app.index, "get_versions") as mock_get_versions:
+            result = self.client.get("/simple/foo", headers={"If-None-Match": '"{}"'.format(etag)})
+            eq_(result.status_code, codes.not_modified)
+            eq_(result.data, "")
+
+            result = self.client.get("/simple/foo")
+            eq_(result.status_code, codes.ok)
+            eq_(result.get_etag(), (etag, False))
+            eq_(mock_get_versions.call_count, 0)
+
+        # other representations are rendered separately
+        result = self.client.get("/simple/foo", headers=self.use_json)
+        ok_(result.get_etag()[0] != etag)
+        eq_(loads(result.data)["project"], "foo")
+
+    def test_get_project_compressed(self):
+        for version in range(50):
+            self.app.projects.add_metadata({"name": "foo",
+                                            "version": "1.{}".format(version),
+                                            "_filename": "foo-1.{}.tar.gz".format(version)})
+
+        result = self.client.get("/simple/foo")
+        ok_("Content-Encoding" not in result.headers)
+        eq_(result.headers["Vary"], "Accept, Accept-Encoding")
+        etag, _ = result.get_etag()
+
+        with patch.object(self.app.index, "get_versions") as mock_get_versions:
+            compressed = self.client.get("/simple/foo", headers={"Accept-Encoding": "gzip, deflate"})
+            eq_(mock_get_versions.call_count, 0)
+        eq_(compressed.headers["Content-Encoding"], "gzip")
+        eq_(decompress(compressed.data, 16 + MAX_WBITS), result.data)
+        compressed_etag, _ = compressed.get_etag()
+        ok_(compressed_etag != etag)
+
+        result = self.client.get("/simple/foo", headers={"Accept-Encoding": "gzip",
+                                                         "If-None-Match": '"{}"'.format(compressed_etag)})
+        eq_(result.status_code, codes.not_modified)
+        result = self.client.get("/simple/foo", headers={"If-None-Match": '"{}"'.format(compressed_etag)})
+        eq_(result.status_code, codes.ok)
+
+    def test_get_projects_etag(self):
+        result = self.client.get("/simple")
+        etag, _ = result.get_etag()
+
+        result = self.client.get("/simple", headers={"If-None-Match": '"{}"'.format(etag)})
+        eq_(result.status_code, codes.not_modified)
+
+    def test_get_project_invalidated_by_upload(self):
+        projects_etag, _ = self.client.get("/simple").get_etag()
+
+        with open(join(dirname(__file__), "data/example-1.0.tar.gz")) as file_:
+            self.client.post("/pypi", data={"file": (file_, "example-1.0.tar.gz")}, headers=self.use_auth)
+
+        result = self.client.get("/simple/example")
+        eq_(result.status_code, codes.ok)
+        ok_("example-1.0.tar.gz" in result.data)
+        result = self.client.get("/simple", headers={"If-None-Match": '"{}"'.format(projects_etag)})
+        eq_(result.status_code, codes.ok)
+        ok_("example" in result.data)
+
+        self.app.projects.add_metadata({"name": "example", "version": "0.9", "_filename": "example-0.9.tar.gz"})
+        self.client.delete("/simple/example/1.0", headers=self.use_auth)
+        ok_("example-1.0.tar.gz" not in self.client.get("/simple/example").data)
+
+    def test_get_projects_batch(self):
+        self.app.projects.add_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+        self.app.projects.add_metadata({"name": "foo", "version": "1.1", "_filename": "foo-1.1.tar.gz"})
+
+        with self._mocked_get("http://pypi.python.org/simple/bar", codes.not_found):
+            result = self.client.post("/batch", data=dumps(["foo", "bar", "foo"]))
+
+        eq_(result.status_code, codes.ok)
+        eq_(loads(result.data), dict(projects=[
+            dict(name="foo", versions=[["foo-1.1.tar.gz", "/local/foo-1.1.tar.gz"],
+                                       ["foo-1.0.tar.gz", "/local/foo-1.0.tar.gz"]]),
+            dict(name="bar", error=dict(status=codes.not_found, upstream_status=codes.not_found)),
+        ]))
+
+    def test_get_projects_batch_error(self):
+        with patch.object(self.app.index.remote, "_refresh_versions", side_effect=ValueError("unparseable")):
+            result = self.client.post("/batch", data=dumps(["bar"]))
+
+        eq_(result.status_code, codes.ok)
+        eq_(loads(result.data), dict(projects=[dict(name="bar", error=dict(status=codes.bad_gateway))]))
+
+    def test_get_projects_batch_object(self):
+        self.app.projects.add_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+
+        result = self.client.post("/batch", data=dumps(dict(projects=["Foo"])),
+                                  content_type="application/json")
+
+        eq_(result.status_code, codes.ok)
+        eq_(loads(result.data)["projects"][0]["versions"], [["foo-1.0.tar.gz", "/local/foo-1.0.tar.gz"]])
+
+    def test_get_projects_batch_bad_request(self):
+        eq_(self.client.post("/batch", data="not json").status_code, codes.bad_request)
+        eq_(self.client.post("/batch", data=dumps({"foo": "bar"})).status_code, codes.bad_request)
+        eq_(self.client.post("/batch", data=dumps([1, 2])).status_code, codes.bad_request)
+
+        self.app.config["BATCH_MAX_PROJECTS"] = 1
+        eq_(self.client.post("/batch", data=dumps(["foo", "bar"])).status_code, codes.bad_request)
+
+    def test_metrics(self):
+        self.client.get("/simple/")
+        self.client.get("/metrics")
+
+        result = self.client.get("/metrics")
+
+        eq_(result.status_code, codes.ok)
+        ok_(result.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+        ok_("# TYPE cheddar_request_duration_seconds histogram" in result.data)
+        ok_('cheddar_request_duration_seconds_count{endpoint="list_project",method="GET",status="200"} 1'
+            in result.data)
+
+    def test_profiles_disabled(self):
+        eq_(self.app.profiler, None)
+        eq_(self.client.get("/profiles", headers=self.use_auth).status_code, codes.not_found)
+
+    def test_get_project_round_trips(self):
+        for version in ["1.0", "1.1", "1.2"]:
+            self.app.projects.add_metadata({"name": "foo",
+                                            "version": version,
+                                            "_filename": "foo-{}.tar.gz".format(version)})
+
+        # rendering takes a fixed number of round trips, however many versions there are
+        with self.app.redis.track() as stats:
+            eq_(self.client.get("/simple/foo").status_code, codes.ok)
+        ok_(stats.round_trips <= 6, stats)
+
+        # cached listings take one
+        with self.app.redis.track() as stats:
+            eq_(self.client.get("/simple/foo").status_code, codes.ok)
+        eq_(stats.round_trips, 1)
+
+    def test_list_projects_round_trips(self):
+        for name in ["foo", "bar", "baz"]:
+            self.app.projects.add_metadata({"name": name,
+                                            "version": "1.0",
+                                            "_filename": "{}-1.0.tar.gz".format(name)})
+
+        with self.app.redis.track() as stats:
+            eq_(self.client.get("/simple/").status_code, codes.ok)
+        ok_(stats.round_trips <= 5, stats)
+
+    def test_get_projects_batch_round_trips(self):
+        for name in ["foo", "bar", "baz"]:
+            self.app.projects.add_metadata({"name": name,
+                                            "version": "1.0",
+                                            "_filename": "{}-1.0.tar.gz".format(name)})
+
+        with self.app.redis.track() as stats:
+            result = self.client.post("/batch", data=dumps(["foo", "bar", "baz"]))
+        eq_(result.status_code, codes.ok)
+        eq_(stats.round_trips, 2)
+
+    def test_redis_debug_headers(self):
+        self.app.debug = True
+        result = self.client.get("/simple/")
+
+        ok_(int(result.headers["X-Redis-Round-Trips"]) > 0)
+        ok_(int(result.headers["X-Redis-Commands"]) >= int(result.headers["X-Redis-Round-Trips"]))
+        ok_("X-Redis-Time" in result.headers)
+
     def test_get_local_distribution(self):
         distribution = join(self.local_cache_dir, "releases", "example-1.0.tar.gz")
         copyfile(join(dirname(__file__), "data/example-1.0.tar.gz"), distribution)
@@ -174,19 +380,17 @@ class TestControllers(object):
         self.app.history.add("example", "1.0")
 
         eq_(self.app.redis.smembers("cheddar.local"), set(["example"]))
-        eq_(self.app.redis.smembers("cheddar.local.example"), set(["1.0"]))
-        eq_(loads(self.app.redis.get("cheddar.local.example-1.0")),
-            {"name": "example",
-             "version": "1.0",
-             "_filename": distribution})
+        eq_(self.app.redis.hgetall("cheddar.local.project:example"), {"1.0": distribution})
+        eq_(loads(self.app.redis.hget("cheddar.local.metadata:example:1.0", "_filename")),
+            distribution)
         ok_(exists(distribution))
 
         result = self.client.delete("/simple/example/1.0", headers=self.use_auth)
         eq_(result.status_code, codes.ok)
 
         eq_(self.app.redis.smembers("cheddar.local"), set())
-        ok_(not self.app.redis.exists("cheddar.local.example"))
-        ok_(not self.app.redis.exists("cheddar.local.example-1.0"))
+        ok_(not self.app.redis.exists("cheddar.local.project:example"))
+        ok_(not self.app.redis.exists("cheddar.local.metadata:example:1.0"))
         ok_(not exists(distribution))
         ok_(not self.app.history)
 
@@ -210,14 +414,31 @@ class TestControllers(object):
                                       data={"file": (file_, "example-1.1.tar.gz")},
                                       headers=self.use_auth)
         eq_(result.status_code, codes.bad_request)
+        ok_(not exists(join(self.local_cache_dir, "releases", "example-1.1.tar.gz")))
+        eq_(listdir(join(self.local_cache_dir, "tmp")), [])
+
+    def test_upload_bad_archive(self):
+        result = self.client.post("/pypi",
+                                  data={"file": (StringIO("not an archive"), "example-1.0.tar.gz")},
+                                  headers=self.use_auth)
+        eq_(result.status_code, codes.bad_request)
+        eq_(listdir(join(self.local_cache_dir, "tmp")), [])
 
     def test_upload_ok(self):
-        with open(join(dirname(__file__), "data/example-1.0.tar.gz")) as file_:
+        template = join(dirname(__file__), "data/example-1.0.tar.gz")
+        with open(template) as file_:
             result = self.client.post("/pypi",
                                       data={"file": (file_, "example-1.0.tar.gz")},
                                       headers=self.use_auth)
         eq_(result.status_code, codes.ok)
         eq_(self.app.history.all(), ["example/1.0"])
+        ok_(exists(join(self.local_cache_dir, "releases", "example-1.0.tar.gz")))
+        eq_(listdir(join(self.local_cache_dir, "tmp")), [])
+
+        with open(template) as file_:
+            expected_digest = sha256(file_.read()).hexdigest()
+        metadata = self.app.projects.get_metadata("example", "1.0")
+        eq_(metadata["_sha256_digest"], expected_digest)
 
     @contextmanager
     def _mocked_get(self, url, status_code,):
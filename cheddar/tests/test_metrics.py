@@ -0,0 +1,82 @@
+"""
+Test metrics.
+"""
+from logging import getLogger
+
+from mock import patch
+from mockredis import MockRedis
+from redis import ConnectionError
+from nose.tools import eq_, ok_
+
+from cheddar.metrics import format_sample, Metrics
+
+
+def test_format_sample():
+    eq_(format_sample("foo_total", {}), "foo_total")
+    eq_(format_sample("foo_total", dict(b="2", a='say "hi"')), 'foo_total{a="say \\"hi\\"",b="2"}')
+
+
+class TestMetrics(object):
+
+    def setup(self):
+        self.redis = MockRedis()
+        self.metrics = Metrics(self.redis, getLogger(), buckets=(0.1, 1.0))
+
+    def test_increment(self):
+        self.metrics.increment("foo_total", result="hit")
+        self.metrics.increment("foo_total", 2, result="hit")
+        eq_(self.metrics.render(), "")
+
+        self.metrics.flush()
+        eq_(self.metrics.render(), '# TYPE foo_total counter\nfoo_total{result="hit"} 3\n')
+
+    def test_observe(self):
+        self.metrics.observe("foo_seconds", 0.5, host="a")
+        self.metrics.observe("foo_seconds", 0.05, host="a")
+        self.metrics.flush()
+
+        eq_(self.metrics.render().splitlines(), [
+            "# TYPE foo_seconds histogram",
+            'foo_seconds_bucket{host="a",le="0.1"} 1',
+            'foo_seconds_bucket{host="a",le="1.0"} 2',
+            'foo_seconds_bucket{host="a",le="+Inf"} 2',
+            'foo_seconds_count{host="a"} 2',
+            'foo_seconds_sum{host="a"} 0.55',
+        ])
+
+    def test_flush_aggregates_processes(self):
+        other = Metrics(self.redis, getLogger())
+        self.metrics.increment("foo_total")
+        other.increment("foo_total")
+        self.metrics.flush()
+        other.flush()
+        # flushing again adds nothing
+        other.flush()
+
+        ok_("foo_total 2\n" in self.metrics.render())
+
+    def test_maybe_flush(self):
+        self.metrics.flush_interval = 60
+        self.metrics.increment("foo_total")
+        self.metrics.maybe_flush()
+        eq_(self.metrics.render(), "")
+
+        self.metrics.flush_interval = 0
+        self.metrics.maybe_flush()
+        ok_("foo_total 1\n" in self.metrics.render())
+
+    def test_discard(self):
+        self.metrics.increment("foo_total")
+        self.metrics.discard()
+        self.metrics.flush()
+        eq_(self.metrics.render(), "")
+
+    def test_flush_failure_keeps_samples(self):
+        self.metrics.increment("foo_total")
+        with patch.object(self.redis, "pipeline") as mock_pipeline:
+            mock_pipeline.return_value.execute.side_effect = ConnectionError("unavailable")
+            self.metrics.flush()
+
+        self.metrics.increment("foo_total")
+        self.metrics.flush()
+        eq_(self.metrics.render(), "# TYPE foo_total counter\nfoo_total 2\n")
@@ -0,0 +1,101 @@
+"""
+Test request profiling.
+"""
+from base64 import b64encode
+from os import listdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from mock import patch
+from nose.tools import assert_raises, eq_, ok_
+from requests import codes
+
+from cheddar.tests.fixtures import setup, teardown
+
+
+class TestProfiling(object):
+
+    def setup(self):
+        self.profile_dir = mkdtemp()
+        setup(self,
+              PROFILING_ENABLED=True,
+              PROFILE_DIR=join(self.profile_dir, "profiles"),
+              PROFILE_HISTORY=2)
+
+        self.client = self.app.test_client()
+        self.app.users.set_password("username", "password")
+        auth = b64encode("username:password")
+        self.use_auth = {"authorization": "Basic {}".format(auth)}
+        self.request_profile = dict(self.use_auth, **{self.app.config["PROFILE_HEADER"]: "1"})
+
+    def teardown(self):
+        rmtree(self.profile_dir)
+        teardown(self)
+
+    def test_not_profiled(self):
+        result = self.client.get("/simple/")
+        ok_("X-Cheddar-Profile-Id" not in result.headers)
+        eq_(self.app.profiler.list_profiles(), [])
+
+    def test_unauthenticated_profile_request(self):
+        result = self.client.get("/simple/", headers={self.app.config["PROFILE_HEADER"]: "1"})
+        ok_("X-Cheddar-Profile-Id" not in result.headers)
+
+    def test_profile_request(self):
+        self.app.projects.add_metadata({"name": "foo", "version": "1.0", "_filename": "foo-1.0.tar.gz"})
+
+        result = self.client.get("/simple/foo", headers=self.request_profile)
+
+        eq_(result.status_code, codes.ok)
+        profile_id = result.headers["X-Cheddar-Profile-Id"]
+        profiles = self.app.profiler.list_profiles()
+        eq_([profile["id"] for profile in profiles], [profile_id])
+        eq_(profiles[0]["endpoint"], "get_project")
+        eq_(profiles[0]["name"], "foo")
+        eq_(profiles[0]["status"], codes.ok)
+
+        summary = self.client.get("/profiles/{}".format(profile_id), headers=self.use_auth)
+        eq_(summary.status_code, codes.ok)
+        ok_("function calls" in summary.data)
+
+        listing = self.client.get("/profiles", headers=self.use_auth)
+        eq_(listing.status_code, codes.ok)
+        ok_(profile_id in listing.data)
+
+    def test_profile_failed_request(self):
+        with patch.object(self.app.index, "get_versions", side_effect=RuntimeError("failed")):
+            with assert_raises(RuntimeError):
+                self.client.get("/simple/foo", headers=self.request_profile)
+        eq_(self.app.profiler.list_profiles(), [])
+
+        # the profile was stopped, so the next request can be profiled
+        result = self.client.get("/simple/", headers=self.request_profile)
+        ok_("X-Cheddar-Profile-Id" in result.headers)
+
+    def test_one_profile_at_a_time(self):
+        with self.app.test_request_context("/simple/"):
+            profile = self.app.profiler.start()
+            ok_(profile is not None)
+            eq_(self.app.profiler.start(), None)
+            self.app.profiler.abort(profile)
+            self.app.profiler.abort(self.app.profiler.start())
+
+    def test_sampling(self):
+        self.app.profiler.sample_rate = 1
+        self.client.get("/simple/")
+        eq_(len(self.app.profiler.list_profiles()), 1)
+
+    def test_prune(self):
+        self.app.profiler.sample_rate = 1
+        for _ in range(4):
+            self.client.get("/simple/")
+        eq_(len(listdir(self.app.profiler.profile_dir)), 4)
+
+    def test_profiles_require_auth(self):
+        eq_(self.client.get("/profiles").status_code, codes.unauthorized)
+        eq_(self.client.get("/profiles/123-abc").status_code, codes.unauthorized)
+
+    def test_unknown_profile(self):
+        eq_(self.client.get("/profiles/123-abc", headers=self.use_auth).status_code, codes.not_found)
+        eq_(self.client.get("/profiles/..", headers=self.use_auth).status_code, codes.not_found)
@@ -0,0 +1,111 @@
+"""
+Test rendered listing cache.
+"""
+from zlib import decompress, MAX_WBITS
+
+from mock import patch
+from nose.tools import eq_, ok_
+from werkzeug.datastructures import Accept
+
+from cheddar.rendered import gzip_compress
+from cheddar.tests.fixtures import setup, teardown
+
+
+LARGE_BODY = "<html>{}</html>".format("<a href='/local/foo-1.0.tar.gz'>foo-1.0.tar.gz</a>" * 100)
+
+
+class TestRenderedCache(object):
+
+    def setup(self):
+        setup(self)
+        self.rendered = self.app.rendered
+
+    def teardown(self):
+        teardown(self)
+
+    def test_get_not_cached(self):
+        eq_(self.rendered.get("foo", "html"), (None, None))
+
+    def test_put_and_get(self):
+        entry = self.rendered.put("foo", "html", None, "<html/>", "text/html")
+        cached, _ = self.rendered.get("foo", "html")
+        eq_(cached, entry)
+        eq_(cached["variants"], {"identity": "<html/>"})
+        ok_(cached["etag"])
+
+        # representations and spellings are cached separately
+        eq_(self.rendered.get("foo", "json")[0], None)
+        eq_(self.rendered.get("Foo", "html")[0], None)
+
+    def test_put_compressed(self):
+        entry = self.rendered.put("foo", "html", None, LARGE_BODY, "text/html")
+        eq_(decompress(entry["variants"]["gzip"], 16 + MAX_WBITS), LARGE_BODY)
+
+        cached, _ = self.rendered.get("foo", "html", "gzip")
+        eq_(cached["variants"], {"gzip": entry["variants"]["gzip"]})
+        cached, _ = self.rendered.get("foo", "html")
+        eq_(cached["variants"], {"identity": LARGE_BODY})
+
+    def test_small_bodies_are_not_compressed(self):
+        self.rendered.put("foo", "html", None, "<html/>", "text/html")
+        cached, _ = self.rendered.get("foo", "html", "gzip")
+        eq_(cached["variants"], {"identity": "<html/>"})
+
+    def test_gzip_compress_is_deterministic(self):
+        eq_(gzip_compress(LARGE_BODY), gzip_compress(LARGE_BODY))
+
+    def test_negotiate(self):
+        eq_(self.rendered.negotiate(Accept([("gzip", 1), ("deflate", 1)])), "gzip")
+        eq_(self.rendered.negotiate(Accept([("*", 1)])) in ("br", "gzip"), True)
+        eq_(self.rendered.negotiate(Accept([("gzip", 0)])), "identity")
+        eq_(self.rendered.negotiate(Accept()), "identity")
+
+    def test_get_expired(self):
+        self.rendered.put("foo", "html", None, "<html/>", "text/html")
+        with patch("cheddar.rendered.time", lambda: 10 ** 10):
+            eq_(self.rendered.get("foo", "html")[0], None)
+
+    def test_invalidate(self):
+        self.rendered.put(None, "html", None, "<html/>", "text/html")
+        self.rendered.put("foo_bar", "html", None, "<html/>", "text/html")
+        self.rendered.put("Foo-Bar", "json", None, "{}", "application/json")
+
+        self.rendered.invalidate("foo.bar")
+
+        eq_(self.rendered.get(None, "html")[0], None)
+        eq_(self.rendered.get("foo_bar", "html")[0], None)
+        eq_(self.rendered.get("Foo-Bar", "json")[0], None)
+
+    def test_invalidate_project_only(self):
+        self.rendered.put(None, "html", None, "<html/>", "text/html")
+        self.rendered.invalidate("foo", projects=False)
+        ok_(self.rendered.get(None, "html")[0] is not None)
+
+    def test_put_after_invalidate(self):
+        """
+        A listing rendered before an invalidation is not cached after it.
+        """
+        _, stamp = self.rendered.get("foo", "html")
+        self.rendered.invalidate("foo")
+        self.rendered.put("foo", "html", stamp, "<html/>", "text/html")
+        entry, stamp = self.rendered.get("foo", "html")
+        eq_(entry, None)
+
+        # the next render is cached
+        self.rendered.put("foo", "html", stamp, "<html/>", "text/html")
+        ok_(self.rendered.get("foo", "html")[0] is not None)
+
+    def test_disabled(self):
+        self.rendered.ttl = 0
+        entry = self.rendered.put("foo", "html", None, "<html/>", "text/html")
+        ok_(entry["etag"])
+        eq_(self.rendered.get("foo", "html"), (None, None))
+        eq_(self.app.redis.keys("cheddar.rendered*"), [])
+
+    def test_disabled_compresses_only_negotiated_encoding(self):
+        self.rendered.ttl = 0
+        entry = self.rendered.put("foo", "html", None, LARGE_BODY, "text/html", "gzip")
+        eq_(sorted(entry["variants"]), ["gzip", "identity"])
+
+        entry = self.rendered.put("foo", "html", None, LARGE_BODY, "text/html", "identity")
+        eq_(sorted(entry["variants"]), ["identity"])
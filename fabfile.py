@@ -26,6 +26,7 @@ FILES = [
     "/etc/cheddar/cheddar.conf",
     "/etc/nginx/sites-available/cheddar",
     "/etc/cheddar/uwsgi.ini",
+    "/etc/cheddar/uwsgi-gevent.ini",
     "/etc/logrotate.d/cheddar",
     "/etc/supervisor/conf.d/cheddar.conf",
 ]
@@ -29,6 +29,10 @@ setup(name='cheddar',
           'python-magic>=0.4.6',
           'pkginfo>=1.1',
       ],
+      extras_require={
+          'brotli': ['brotli>=0.5'],
+          'gevent': ['gevent>=1.0'],
+      },
       tests_require=[
           'mock>=1.0.1',
           'mockredispy>=2.8.0.0',
@@ -37,6 +41,7 @@ setup(name='cheddar',
       entry_points={
           'console_scripts': [
               'development = cheddar.development:main',
+              'cheddar-manage = cheddar.manage:main',
           ]
       },
       include_package_data=True,